@@ -0,0 +1,310 @@
+"""
+Two-step answers to dataset-wide chat questions.
+
+Step one asks the model for a small JSON query spec over the dataset's
+columns: filters, an optional group-by, aggregations, ordering and a row
+limit. The spec is validated against the dataset and run locally through
+dataset_query (vectorized pandas, or Arrow for large Parquet datasets).
+Step two sends only the compact result table back for the narrative, so
+the numbers in the answer are computed rather than recalled and both
+prompts stay a fraction of the full dataset context.
+
+When the model does not return a usable spec (or HYDRO_CHAT_QUERY=0), the
+chat falls back to context_builder.build_dataset_context.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.utils.context_builder import (
+    PRIORITY_ESSENTIAL, PRIORITY_HIGH, BuiltContext, ContextBuilder, compact_table, record_prompt_metrics,
+    relevant_columns
+)
+from app.utils.dataset_query import AGGREGATIONS, FILTER_OPS, DatasetQuery, Filter, validate_filters
+from app.utils.instrumentation import count, span
+from app.utils.llm_client import LLMError, generate_text
+
+QUERY_MODE_ENV = 'HYDRO_CHAT_QUERY'
+MAX_RESULT_ROWS = 40
+DEFAULT_RESULT_ROWS = 15
+MAX_METRICS = 8
+# Category columns with more values than this are described by example only.
+MAX_LISTED_VALUES = 12
+MAX_CACHED_SCHEMAS = 4
+
+# Kept terse: this prompt and the result prompt together must stay well below the dataset context.
+SPEC_INSTRUCTIONS = """Reply with a JSON query for the question, or {"query":null}:
+{"filters":[[col,op,value]],"group_by":col,"metrics":[[col,agg]],"order_by":null,"descending":true,"limit":10}
+op: %(ops)s. agg (numeric col): %(aggs)s. order_by: samples, share_pct or col_agg."""
+
+
+def query_mode_enabled() -> bool:
+    """Whether dataset-wide chat questions use the two-step query mode (HYDRO_CHAT_QUERY, default on)."""
+    return os.getenv(QUERY_MODE_ENV, '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+@dataclass
+class QuerySpec:
+    """A validated query: filters, optional grouping and (column, aggregation) metrics."""
+
+    filters: List[Filter] = field(default_factory=list)
+    group_by: Optional[str] = None
+    metrics: List[Tuple[str, str]] = field(default_factory=list)
+    order_by: Optional[str] = None
+    descending: bool = True
+    limit: int = DEFAULT_RESULT_ROWS
+
+    @property
+    def result_columns(self) -> List[str]:
+        shares = ['share_pct'] if self.group_by is not None else []
+        return ['samples', *shares, *(f"{col}_{agg}" for col, agg in self.metrics)]
+
+    def describe(self) -> str:
+        """One-line plain-text rendering for the narrative prompt."""
+        parts = []
+        if self.metrics:
+            parts.append(", ".join(f"{agg} {col}" for col, agg in self.metrics))
+        if self.group_by is not None:
+            parts.append(f"by {self.group_by}")
+        parts.append("where " + " and ".join(
+            f"{col} {op} {', '.join(map(str, value)) if isinstance(value, list) else value}"
+            for col, op, value in self.filters
+        ) if self.filters else "all rows")
+        if self.order_by is not None:
+            parts.append(f"sorted by {self.order_by} {'desc' if self.descending else 'asc'}")
+        return "; ".join(parts)
+
+
+@dataclass(frozen=True)
+class DatasetSchema:
+    """One description line per column, plus the known values of each category column."""
+
+    lines: Dict[str, str]
+    categories: Dict[str, Dict[str, str]]
+
+    def text(self, columns: Optional[List[str]] = None) -> str:
+        return "\n".join(line for col, line in self.lines.items() if columns is None or col in columns)
+
+
+_lock = threading.Lock()
+_schemas: "OrderedDict[str, DatasetSchema]" = OrderedDict()
+
+
+def dataset_schema(query: DatasetQuery) -> DatasetSchema:
+    """Returns the column descriptions for a dataset, built once per dataset version."""
+    key = query.version or str(id(query))
+    with _lock:
+        schema = _schemas.get(key)
+        if schema is not None:
+            _schemas.move_to_end(key)
+            return schema
+
+    with span('chat.query_schema'):
+        stats = query.describe()
+        lines, categories = {}, {}
+        for col in query.columns:
+            if col in query.numeric_columns:
+                lines[col] = f"{col}: numeric {stats.at['min', col]:g}-{stats.at['max', col]:g}"
+                continue
+            values = [str(value) for value in query.value_counts(col).index]
+            # Lower-cased lookup so filters on "surat" or "ABOVE LIMIT" resolve to the stored spelling.
+            categories[col] = {value.lower(): value for value in values}
+            if len(values) <= MAX_LISTED_VALUES:
+                lines[col] = f"{col}: {' | '.join(values)}"
+            else:
+                lines[col] = f"{col}: {len(values)} values e.g. {', '.join(values[:2])}"
+        schema = DatasetSchema(lines, categories)
+    with _lock:
+        _schemas[key] = schema
+        while len(_schemas) > MAX_CACHED_SCHEMAS:
+            _schemas.popitem(last=False)
+    return schema
+
+
+def spec_context(question: str, query: DatasetQuery, schema: DatasetSchema) -> Optional[BuiltContext]:
+    """Columns shown in step one: those the question mentions (None if it mentions none)."""
+    columns = relevant_columns(query.frame(), question)
+    if not columns:
+        return None
+    builder = ContextBuilder()
+    builder.add("Columns", schema.text(columns), PRIORITY_ESSENTIAL)
+    return builder.build()
+
+
+def spec_prompt(question: str, context: BuiltContext) -> str:
+    """Step one: asks the model for a JSON query spec."""
+    return "\n".join([
+        SPEC_INSTRUCTIONS % {'ops': ' '.join(FILTER_OPS), 'aggs': ' '.join(AGGREGATIONS)},
+        context.text,
+        f"Question: {question}",
+    ])
+
+
+def _extract_json(text: str) -> Dict[str, Any]:
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        raise ValueError("The response contains no JSON object")
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"The response is not valid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("The query spec must be a JSON object")
+    return data
+
+
+def _filter_value(schema: DatasetSchema, column: str, value: Any) -> Any:
+    known = schema.categories.get(column)
+    if known is None:
+        return value
+    # A value the column never holds would run and return an empty, confidently wrong result.
+    canonical = known.get(str(value).strip().lower())
+    if canonical is None:
+        raise ValueError(f"{column} has no value {value!r}")
+    return canonical
+
+
+def _flag(value: Any, name: str) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f"{name} must be true or false, got {value!r}")
+
+
+def parse_query_spec(text: str, query: DatasetQuery, schema: Optional[DatasetSchema] = None) -> Optional[QuerySpec]:
+    """Validates the model's reply against the dataset.
+
+    Returns:
+        QuerySpec, or None if the model said the question is not a query
+
+    Raises:
+        ValueError: The reply is not a valid spec for this dataset
+    """
+    schema = schema or dataset_schema(query)
+    data = _extract_json(text)
+    if 'query' in data and data['query'] is None:
+        return None
+
+    filters = []
+    for column, op, value in validate_filters(data.get('filters') or [], query.columns):
+        if isinstance(value, list):
+            value = [_filter_value(schema, column, v) for v in value]
+        else:
+            value = _filter_value(schema, column, value)
+        filters.append((column, op, value))
+    # Checks operators and value types against the columns before anything runs.
+    filters = query.check_filters(filters)
+
+    group_by = data.get('group_by') or None
+    if group_by is not None and group_by not in query.columns:
+        raise ValueError(f"Unknown group_by column: {group_by}")
+    if group_by in query.numeric_columns:
+        raise ValueError(f"group_by must be a category column, not {group_by}")
+
+    metrics = []
+    if not isinstance(data.get('metrics') or [], list):
+        raise ValueError(f"metrics must be a list, got {data['metrics']!r}")
+    for metric in data.get('metrics') or []:
+        if isinstance(metric, dict):
+            metric = [metric.get('column'), metric.get('agg', '')]
+        if not isinstance(metric, list) or len(metric) != 2:
+            raise ValueError(f"A metric is [column, agg], got {metric!r}")
+        column, agg = metric[0], str(metric[1]).lower()
+        if column not in query.numeric_columns:
+            raise ValueError(f"Metrics need a numeric column, got {column!r}")
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation {agg!r}; use one of {', '.join(AGGREGATIONS)}")
+        if (column, agg) not in metrics:
+            metrics.append((column, agg))
+    if len(metrics) > MAX_METRICS:
+        raise ValueError(f"At most {MAX_METRICS} metrics are allowed")
+
+    try:
+        limit = int(data.get('limit') or DEFAULT_RESULT_ROWS)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"limit must be a number, got {data.get('limit')!r}") from None
+    spec = QuerySpec(
+        filters=filters,
+        group_by=group_by,
+        metrics=metrics,
+        descending=_flag(data.get('descending', True), 'descending'),
+        limit=max(1, min(limit, MAX_RESULT_ROWS)),
+    )
+    order_by = data.get('order_by') or None
+    if order_by is not None and order_by not in spec.result_columns:
+        raise ValueError(f"order_by must be one of {', '.join(spec.result_columns)}, got {order_by!r}")
+    if order_by is None and group_by is not None:
+        order_by = spec.result_columns[-1]
+    spec.order_by = order_by
+    return spec
+
+
+def run_query_spec(spec: QuerySpec, query: DatasetQuery) -> Tuple[pd.DataFrame, int]:
+    """Runs a spec locally.
+
+    Returns:
+        (result table limited to spec.limit rows, number of rows before the limit)
+    """
+    columns = list(dict.fromkeys(col for col, _ in spec.metrics))
+    aggregations = list(dict.fromkeys(agg for _, agg in spec.metrics))
+    with span('chat.query_run'):
+        if spec.group_by is None:
+            table = query.aggregate(columns, aggregations, spec.filters)
+        else:
+            table = query.group_summary(spec.group_by, columns, aggregations, spec.filters)
+            total = table['samples'].sum()
+            table.insert(1, 'share_pct', table['samples'] / total * 100 if total else 0.0)
+            table = table[table['samples'] > 0]
+    table = table[spec.result_columns]
+    if spec.order_by is not None:
+        table = table.sort_values(spec.order_by, ascending=not spec.descending, kind='stable')
+    return table.head(spec.limit), len(table)
+
+
+def plan_query(
+    question: str,
+    query: DatasetQuery,
+    dataset_version: str = ""
+) -> Tuple[Optional[QuerySpec], Optional[Dict[str, object]]]:
+    """Step one: asks the model for a spec and validates it.
+
+    Questions that mention no column skip the call.
+
+    Returns:
+        (spec, or None to use the regular context; prompt metrics record of
+        the step-one call, or None if no call was made)
+    """
+    schema = dataset_schema(query)
+    context = spec_context(question, query, schema)
+    if context is None:
+        return None, None
+    prompt = spec_prompt(question, context)
+    plan_size = record_prompt_metrics('chat_query_plan', context, prompt)
+    try:
+        with span('chat.query_plan'):
+            reply = generate_text(prompt, dataset_version=dataset_version)
+        spec = parse_query_spec(reply, query, schema)
+    except (LLMError, ValueError):
+        spec = None
+    if spec is None:
+        count('chat.query_fallbacks')
+    return spec, plan_size
+
+
+def build_query_context(spec: QuerySpec, result: pd.DataFrame, total_rows: int) -> BuiltContext:
+    """Step two's context: the query and its compact result table (total_rows from run_query_spec)."""
+    builder = ContextBuilder()
+    builder.add("Query", spec.describe(), PRIORITY_ESSENTIAL)
+    shown = f" (top {len(result)} of {total_rows})" if total_rows > len(result) else ""
+    builder.add(
+        f"Result computed from the full dataset{shown} (CSV)",
+        compact_table(result, index=spec.group_by is not None),
+        PRIORITY_HIGH,
+    )
+    return builder.build()
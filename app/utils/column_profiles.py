@@ -0,0 +1,130 @@
+"""
+Per-column profiles for the prediction form and percentile ranking.
+
+Built once per dataset version: numeric columns keep their range, quartiles
+and sorted values (so a percentile rank is a binary search), categorical
+columns keep their category list. The form and the report read these
+instead of rescanning the DataFrame on every rerun. For an ingested dataset
+with stored aggregates, numeric profiles come from its quantile sketches
+instead of sorting the columns.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.utils.data_loader import dataset_version
+from app.utils.dataset_aggregates import QuantileSketch, RunningMoments, stored_aggregates
+from app.utils.instrumentation import span
+
+MAX_CACHED_PROFILES = 4
+
+
+@dataclass(frozen=True)
+class ColumnProfile:
+    name: str
+    numeric: bool
+    count: int
+    categories: Tuple = ()
+    sorted_values: Optional[np.ndarray] = None
+    minimum: float = float('nan')
+    q25: float = float('nan')
+    median: float = float('nan')
+    q75: float = float('nan')
+    maximum: float = float('nan')
+    sketch: Optional[QuantileSketch] = None
+
+    @classmethod
+    def from_series(cls, series: pd.Series) -> 'ColumnProfile':
+        if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            values = series.dropna()
+            return cls(name=series.name, numeric=False, count=len(values), categories=tuple(pd.unique(values)))
+        values = np.sort(series.to_numpy(dtype=np.float64, na_value=np.nan))
+        values = values[:len(values) - int(np.isnan(values).sum())]
+        if len(values) == 0:
+            return cls(name=series.name, numeric=True, count=0, sorted_values=values)
+        q25, median, q75 = np.quantile(values, [0.25, 0.5, 0.75])
+        return cls(
+            name=series.name,
+            numeric=True,
+            count=len(values),
+            sorted_values=values,
+            minimum=float(values[0]),
+            q25=float(q25),
+            median=float(median),
+            q75=float(q75),
+            maximum=float(values[-1]),
+        )
+
+    @classmethod
+    def from_aggregates(cls, name: str, moments: RunningMoments, sketch: QuantileSketch) -> 'ColumnProfile':
+        """Numeric profile from stored aggregates; quartiles and ranks are sketch estimates."""
+        return cls(
+            name=name,
+            numeric=True,
+            count=moments.count,
+            minimum=moments.minimum,
+            q25=sketch.quantile(0.25),
+            median=sketch.quantile(0.5),
+            q75=sketch.quantile(0.75),
+            maximum=moments.maximum,
+            sketch=sketch,
+        )
+
+    def percentile_rank(self, value: float) -> float:
+        """Percentage of values strictly below value."""
+        if not self.count:
+            return float('nan')
+        if self.sorted_values is None:
+            return self.sketch.rank(value) * 100
+        return np.searchsorted(self.sorted_values, value, side='left') / self.count * 100
+
+    def stats(self) -> Dict[str, float]:
+        """min/quartiles/max in the layout of the report's prediction_data['stats']."""
+        return {'min': self.minimum, '25%': self.q25, '50%': self.median, '75%': self.q75, 'max': self.maximum}
+
+
+class DatasetProfile:
+    """Column profiles for one dataset, built in a single pass over its columns."""
+
+    def __init__(self, df: pd.DataFrame):
+        aggregates = stored_aggregates(df)
+        self.columns: Dict[str, ColumnProfile] = {}
+        for col in df.columns:
+            if aggregates is not None and col in aggregates.sketches:
+                self.columns[col] = ColumnProfile.from_aggregates(col, aggregates.moments[col], aggregates.sketches[col])
+            else:
+                self.columns[col] = ColumnProfile.from_series(df[col])
+        self.numeric_columns: List[str] = [col for col, p in self.columns.items() if p.numeric]
+
+    def __getitem__(self, column: str) -> ColumnProfile:
+        return self.columns[column]
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.columns
+
+
+_lock = threading.Lock()
+_profiles: "OrderedDict[object, DatasetProfile]" = OrderedDict()
+
+
+def get_column_profiles(df: pd.DataFrame) -> DatasetProfile:
+    """Returns the profiles for a dataset, building them once per dataset version."""
+    # Subsets keep the loaded frame's attrs (and so its version); the row count tells them apart.
+    key = (dataset_version(df) or id(df), len(df))
+    with _lock:
+        profile = _profiles.get(key)
+        if profile is not None:
+            _profiles.move_to_end(key)
+            return profile
+
+    with span('column_profiles.build'):
+        profile = DatasetProfile(df)
+    with _lock:
+        _profiles[key] = profile
+        while len(_profiles) > MAX_CACHED_PROFILES:
+            _profiles.popitem(last=False)
+    return profile
@@ -0,0 +1,356 @@
+"""
+Token-budgeted prompt context for the chat path.
+
+Context is assembled from prioritized blocks of compact, rounded, CSV-like
+aggregate tables restricted to the columns a question is about. When the
+estimated size exceeds the budget, the lowest-priority blocks are first
+replaced by their summaries and then dropped.
+"""
+import math
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+from app.utils.dataset_aggregates import stored_aggregates
+from app.utils.instrumentation import timed
+
+BUDGET_ENV = 'HYDRO_PROMPT_TOKEN_BUDGET'
+DEFAULT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 4
+METRICS_HISTORY = 200
+
+PRIORITY_ESSENTIAL = 100
+PRIORITY_HIGH = 75
+PRIORITY_MEDIUM = 50
+PRIORITY_LOW = 25
+
+# Question words that point at a column without naming it.
+COLUMN_SYNONYMS: Dict[str, List[str]] = {
+    'rain': ['Rainfall_2023_mm', 'Normal_Rainfall_mm'],
+    'rainfall': ['Rainfall_2023_mm', 'Normal_Rainfall_mm'],
+    'monsoon': ['Rainfall_2023_mm', 'Normal_Rainfall_mm'],
+    'salinity': ['TDS_mg_L', 'TDS/EC_Level', 'Chloride_mg_L'],
+    'saline': ['TDS_mg_L', 'TDS/EC_Level', 'Extraction_Status'],
+    'salt': ['TDS_mg_L', 'Chloride_mg_L'],
+    'hardness': ['Calcium_mg_L', 'Magnesium_mg_L'],
+    'acidity': ['PH'],
+    'alkalinity': ['PH'],
+    'extraction': ['Extraction_Status'],
+    'exploited': ['Extraction_Status'],
+    'depletion': ['Extraction_Status'],
+}
+
+STOP_TOKENS = {'mg', 'l', 'mm', 'level', 'status', 'normal', '2023'}
+
+_metrics: deque = deque(maxlen=METRICS_HISTORY)
+_metrics_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English and tables)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def default_token_budget() -> int:
+    return int(os.getenv(BUDGET_ENV, DEFAULT_TOKEN_BUDGET))
+
+
+def _column_tokens(column: str) -> List[str]:
+    return [t for t in re.split(r"[^a-z0-9]+", column.lower()) if t and t not in STOP_TOKENS]
+
+
+def relevant_columns(df: pd.DataFrame, question: str, exclude: Iterable[str] = ()) -> List[str]:
+    """Returns the columns a question mentions by name or synonym (empty if none)."""
+    words = set(re.findall(r"[a-z0-9]+", str(question).lower()))
+    excluded = set(exclude)
+    found = []
+    for col in df.columns:
+        if col in excluded:
+            continue
+        if any(token in words for token in _column_tokens(str(col))):
+            found.append(col)
+    for word in words:
+        for col in COLUMN_SYNONYMS.get(word, []):
+            if col in df.columns and col not in found and col not in excluded:
+                found.append(col)
+    return [col for col in df.columns if col in found]
+
+
+def _format_number(value, decimals: int) -> str:
+    if pd.isna(value):
+        return ''
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{round(value, decimals):.{decimals}f}".rstrip('0').rstrip('.')
+
+
+def compact_table(df: pd.DataFrame, decimals: int = 2, index: bool = True) -> str:
+    """Renders a DataFrame as rounded CSV without padding."""
+    header = ([str(df.index.name or '')] if index else []) + [str(c) for c in df.columns]
+    lines = [",".join(header)]
+    for label, row in zip(df.index, df.itertuples(index=False)):
+        cells = [str(label)] if index else []
+        for value in row:
+            if pd.api.types.is_number(value) and not pd.api.types.is_bool(value):
+                cells.append(_format_number(value, decimals))
+            else:
+                cells.append('' if pd.isna(value) else str(value))
+        lines.append(",".join(cells))
+    return "\n".join(lines)
+
+
+def numeric_stats(df: pd.DataFrame, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """count/mean/min/quartiles/max per numeric column, one row per column."""
+    numeric = df.select_dtypes(include='number')
+    if columns is not None:
+        numeric = numeric[[c for c in columns if c in numeric.columns]]
+    if numeric.shape[1] == 0:
+        return pd.DataFrame()
+    stats = numeric.describe().T.drop(columns=['std'], errors='ignore')
+    stats.index.name = 'column'
+    return stats
+
+
+def stats_from_describe(summary: pd.DataFrame, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Numeric rows of a precomputed describe(include='all') table, in numeric_stats layout."""
+    rows = ['count', 'mean', 'min', '25%', '50%', '75%', 'max']
+    present = [r for r in rows if r in summary.index]
+    table = summary.loc[present]
+    if columns is not None:
+        table = table[[c for c in columns if c in table.columns]]
+    stats = table.T.dropna(subset=['mean'] if 'mean' in present else None)
+    stats.index.name = 'column'
+    return stats.astype('float64')
+
+
+def category_shares(df: pd.DataFrame, columns: Optional[Sequence[str]] = None, top: int = 5) -> Dict[str, str]:
+    """Maps each categorical column to 'value=share%' text for its most common values."""
+    categorical = df.select_dtypes(include=['object', 'category', 'string'])
+    if columns is not None:
+        categorical = categorical[[c for c in columns if c in categorical.columns]]
+    lines = {}
+    for col in categorical.columns:
+        shares = categorical[col].value_counts(normalize=True, sort=True).head(top)
+        lines[col] = ", ".join(f"{value}={share * 100:.0f}%" for value, share in shares.items() if share > 0)
+    return lines
+
+
+def render_shares(shares: Dict[str, str], columns: Optional[Sequence[str]] = None) -> str:
+    return "\n".join(f"{col}: {text}" for col, text in shares.items() if columns is None or col in columns)
+
+
+@dataclass
+class ContextBlock:
+    title: str
+    text: str
+    priority: int = PRIORITY_MEDIUM
+    summary: Optional[str] = None
+
+    def render(self, summarized: bool = False) -> str:
+        body = self.summary if summarized and self.summary is not None else self.text
+        return f"{self.title}:\n{body}" if self.title else body
+
+
+@dataclass
+class BuiltContext:
+    text: str
+    tokens: int
+    budget: int
+    blocks: List[str] = field(default_factory=list)
+    summarized: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            'tokens': self.tokens,
+            'budget': self.budget,
+            'chars': len(self.text),
+            'blocks': len(self.blocks),
+            'summarized': len(self.summarized),
+            'dropped': len(self.dropped),
+        }
+
+
+class ContextBuilder:
+    """Collects context blocks and renders them within a token budget.
+
+    Args:
+        budget: Maximum estimated tokens (default: HYDRO_PROMPT_TOKEN_BUDGET or 1500)
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = default_token_budget() if budget is None else budget
+        self.blocks: List[ContextBlock] = []
+
+    def add(self, title: str, text: str, priority: int = PRIORITY_MEDIUM, summary: Optional[str] = None) -> None:
+        if text:
+            self.blocks.append(ContextBlock(title, text, priority, summary))
+
+    def build(self) -> BuiltContext:
+        summarized = set()
+        dropped = set()
+
+        def render() -> str:
+            return "\n\n".join(
+                block.render(i in summarized)
+                for i, block in enumerate(self.blocks)
+                if i not in dropped
+            )
+
+        text = render()
+        # Lowest priority first; later-added blocks go before earlier ones at equal priority.
+        order = sorted(range(len(self.blocks)), key=lambda i: (self.blocks[i].priority, -i))
+        for i in order:
+            if estimate_tokens(text) <= self.budget:
+                break
+            if self.blocks[i].priority >= PRIORITY_ESSENTIAL:
+                continue
+            if self.blocks[i].summary is not None:
+                summarized.add(i)
+                text = render()
+                if estimate_tokens(text) <= self.budget:
+                    break
+            dropped.add(i)
+            summarized.discard(i)
+            text = render()
+
+        return BuiltContext(
+            text=text,
+            tokens=estimate_tokens(text),
+            budget=self.budget,
+            blocks=[b.title for i, b in enumerate(self.blocks) if i not in dropped],
+            summarized=[self.blocks[i].title for i in sorted(summarized)],
+            dropped=[self.blocks[i].title for i in sorted(dropped)],
+        )
+
+
+def record_prompt_metrics(kind: str, context: BuiltContext, prompt: str) -> Dict[str, object]:
+    """Stores the size of a prompt built from context and returns the record."""
+    record = {'kind': kind, 'prompt_tokens': estimate_tokens(prompt), **context.metrics()}
+    with _metrics_lock:
+        _metrics.append(record)
+    return record
+
+
+def get_prompt_metrics() -> List[Dict[str, object]]:
+    """Returns size records for the most recent prompts."""
+    with _metrics_lock:
+        return list(_metrics)
+
+
+@timed('context.dataset')
+def build_dataset_context(
+    df: pd.DataFrame,
+    question: str,
+    overview: str,
+    district_col: Optional[str] = None,
+    budget: Optional[int] = None,
+    query=None
+) -> BuiltContext:
+    """Context for dataset-wide questions: overview, stats and per-district means.
+
+    Ingested datasets with stored aggregates (see dataset_aggregates) are
+    summarized from those; quartiles are then sketch estimates.
+
+    Args:
+        df: Dataset
+        question: User question, used to pick relevant columns
+        overview: Short dataset overview (see helpers.get_data_summary)
+        district_col: District column for the per-district table
+        budget: Token budget (default: HYDRO_PROMPT_TOKEN_BUDGET)
+        query: dataset_query.DatasetQuery over the whole dataset, when df is a sample of it
+    """
+    columns = relevant_columns(df, question, exclude=[district_col] if district_col else ())
+    builder = ContextBuilder(budget)
+    builder.add("", overview.strip(), PRIORITY_ESSENTIAL)
+
+    focus = columns or None
+    aggregates = stored_aggregates(df)
+    if query is not None:
+        stats = stats_from_describe(query.describe(focus))
+    elif aggregates is not None:
+        stats = aggregates.numeric_stats(focus)
+    else:
+        stats = numeric_stats(df, focus)
+    if not stats.empty:
+        builder.add(
+            "Column statistics (CSV)",
+            compact_table(stats),
+            PRIORITY_HIGH,
+            summary=compact_table(stats[['mean', '50%']]) if 'mean' in stats else None,
+        )
+    share_columns = [c for c in (focus or df.columns) if c != district_col]
+    if query is not None:
+        shares = query.category_shares(share_columns)
+    elif aggregates is not None:
+        shares = aggregates.category_shares(share_columns)
+    else:
+        shares = category_shares(df, share_columns)
+    builder.add("Category shares", render_shares(shares), PRIORITY_MEDIUM)
+
+    if district_col is not None:
+        numeric_focus = [c for c in (focus or df.select_dtypes(include='number').columns) if c in stats.index]
+        if numeric_focus:
+            if query is not None:
+                by_district = query.group_summary(district_col, numeric_focus)
+                by_district.columns = ['samples', *numeric_focus]
+            elif aggregates is not None and aggregates.district_col == district_col:
+                by_district = aggregates.district_means(numeric_focus)
+            else:
+                by_district = df.groupby(district_col, observed=True)[numeric_focus].mean()
+                by_district.insert(0, 'samples', df.groupby(district_col, observed=True).size())
+            extremes = []
+            for col in numeric_focus[:4]:
+                extremes.append(
+                    f"{col}: highest {by_district[col].idxmax()} ({_format_number(by_district[col].max(), 2)}), "
+                    f"lowest {by_district[col].idxmin()} ({_format_number(by_district[col].min(), 2)})"
+                )
+            builder.add(
+                "District means (CSV)",
+                compact_table(by_district),
+                PRIORITY_LOW,
+                summary="\n".join(extremes),
+            )
+
+    return builder.build()
+
+
+@timed('context.district')
+def build_district_context(
+    df: pd.DataFrame,
+    entries: Sequence,
+    question: str,
+    budget: Optional[int] = None,
+    sample_rows: int = 3
+) -> BuiltContext:
+    """Context for questions about specific districts, from precomputed index entries.
+
+    Args:
+        df: Dataset the entries were built from
+        entries: district_index.DistrictEntry records
+        question: User question, used to pick relevant columns
+        budget: Token budget (default: HYDRO_PROMPT_TOKEN_BUDGET)
+        sample_rows: Raw rows per district offered as the lowest-priority block
+    """
+    columns = relevant_columns(df, question) or None
+    builder = ContextBuilder(budget)
+    for entry in entries:
+        stats = stats_from_describe(entry.summary, columns)
+        rows = df.take(entry.positions[:sample_rows])
+        builder.add(f"{entry.name} overview", f"Samples: {entry.sample_count:,}", PRIORITY_ESSENTIAL)
+        if not stats.empty:
+            builder.add(
+                f"{entry.name} statistics (CSV)",
+                compact_table(stats),
+                PRIORITY_HIGH,
+                summary=compact_table(stats[['mean']]) if 'mean' in stats else None,
+            )
+        builder.add(f"{entry.name} category shares", render_shares(entry.categories, columns), PRIORITY_MEDIUM)
+        builder.add(f"{entry.name} sample rows (CSV)", compact_table(rows if columns is None else rows[columns], index=False), PRIORITY_LOW)
+    return builder.build()
@@ -0,0 +1,250 @@
+"""
+Dataset loading for the HydroAI application.
+
+The groundwater CSV is parsed once per process with explicit dtypes and the
+typed frame is mirrored to a Parquet sidecar, so later starts skip the CSV
+parse entirely. The sidecar is rebuilt only when the source file changes.
+A directory written by app.utils.ingestion (partitioned Parquet) or a
+single Parquet file is read directly instead.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from app.utils.instrumentation import span, timed
+
+DATA_PATH_ENV = 'HYDRO_DATA_PATH'
+CACHE_DIR_ENV = 'HYDRO_CACHE_DIR'
+DEFAULT_DATA_PATH = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'gujarat_groundwater_merged_final.csv'
+))
+
+# Bump when the dtype mapping changes so stale sidecars are rebuilt.
+SCHEMA_VERSION = 1
+# Written by app.utils.ingestion; underscore-prefixed so Parquet readers skip it.
+DATASET_MANIFEST = '_manifest.json'
+
+CATEGORICAL_COLUMNS = [
+    'District',
+    'Extraction_Status',
+    'TDS/EC_Level',
+    'Nitrate_Status',
+    'Fluoride_Status',
+]
+
+FLOAT_COLUMNS = [
+    'Rainfall_2023_mm',
+    'Normal_Rainfall_mm',
+    'PH',
+    'TDS_mg_L',
+    'Calcium_mg_L',
+    'Magnesium_mg_L',
+    'Chloride_mg_L',
+    'Nitrate_mg_L',
+    'Fluoride_mg_L',
+]
+
+_lock = threading.Lock()
+_datasets: Dict[str, Tuple[Tuple[int, int], pd.DataFrame]] = {}
+
+
+def resolve_data_path(path: Optional[str] = None) -> str:
+    """Returns the dataset path, honouring the HYDRO_DATA_PATH override."""
+    return os.path.abspath(path or os.getenv(DATA_PATH_ENV) or DEFAULT_DATA_PATH)
+
+
+def default_cache_dir() -> str:
+    """Directory for derived artifacts (HYDRO_CACHE_DIR, else data/.cache)."""
+    return os.path.abspath(os.getenv(CACHE_DIR_ENV) or os.path.join(os.path.dirname(DEFAULT_DATA_PATH), '.cache'))
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_stat(path: str) -> Tuple[int, int]:
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, DATASET_MANIFEST)):
+        # Ingestion rewrites the manifest last, so it marks every change to the directory.
+        path = os.path.join(path, DATASET_MANIFEST)
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _sidecar_paths(path: str) -> Tuple[str, str]:
+    cache_dir = os.getenv(CACHE_DIR_ENV) or os.path.join(os.path.dirname(path), '.cache')
+    base = os.path.join(cache_dir, os.path.basename(path))
+    return f"{base}.parquet", f"{base}.meta.json"
+
+
+def dtype_map(columns) -> Dict[str, str]:
+    """Builds the read_csv dtype mapping for the known columns present in a file."""
+    dtypes = {}
+    for col in columns:
+        name = str(col).strip()
+        if name in CATEGORICAL_COLUMNS:
+            dtypes[col] = 'category'
+        elif name in FLOAT_COLUMNS:
+            dtypes[col] = 'float32'
+    return dtypes
+
+
+def apply_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Narrows columns not covered by dtype_map: text to category, numbers to float32."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+            if df[col].dtype != 'float32':
+                df[col] = df[col].astype('float32')
+        elif pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].astype('category')
+    return df
+
+
+@timed('dataset.read_csv')
+def read_csv_typed(path: str, **kwargs) -> pd.DataFrame:
+    """Parses a groundwater CSV with explicit dtypes instead of inferred object columns."""
+    header = pd.read_csv(path, nrows=0, **kwargs).columns
+    df = pd.read_csv(path, dtype=dtype_map(header), **kwargs)
+    df.columns = df.columns.str.strip()
+    return apply_dtypes(df)
+
+
+def _read_meta(meta_path: str) -> Dict:
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path: str, meta: Dict) -> None:
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _load_parquet_dir(path: str) -> Tuple[pd.DataFrame, str]:
+    """Reads a partitioned Parquet dataset directory; the manifest supplies column order and version."""
+    import pyarrow.dataset as ds
+
+    meta = _read_meta(os.path.join(path, DATASET_MANIFEST))
+    df = ds.dataset(path, format='parquet', partitioning='hive').to_table().to_pandas()
+    columns = [col for col in meta.get('columns', []) if col in df.columns]
+    if columns:
+        df = df[columns + [col for col in df.columns if col not in columns]]
+    version = meta.get('content_hash')
+    if not version:
+        digest = hashlib.sha256()
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                if name.endswith('.parquet'):
+                    file_path = os.path.join(root, name)
+                    digest.update(f"{os.path.relpath(file_path, path)}:{file_hash(file_path)}".encode())
+        version = digest.hexdigest()
+    return apply_dtypes(df), version
+
+
+def _load_parquet_file(path: str) -> Tuple[pd.DataFrame, str]:
+    """Reads a single Parquet file; it is its own typed copy, so no sidecar is written."""
+    with span('dataset.read_parquet'):
+        df = pd.read_parquet(path)
+    # Files written by DataFrame.to_parquet carry the attrs (and dataset version) of the frame they came from.
+    df.attrs = {}
+    return apply_dtypes(df), file_hash(path)
+
+
+def _load_with_sidecar(path: str, stat: Tuple[int, int]) -> Tuple[pd.DataFrame, str]:
+    parquet_path, meta_path = _sidecar_paths(path)
+    meta = _read_meta(meta_path)
+    fresh = (
+        meta.get('schema') == SCHEMA_VERSION
+        and os.path.exists(parquet_path)
+    )
+
+    if fresh and (meta.get('mtime_ns'), meta.get('size')) == stat:
+        version = meta['sha256']
+    else:
+        # mtime alone is not trusted: a touched but unchanged file keeps its sidecar.
+        version = file_hash(path)
+        fresh = fresh and meta.get('sha256') == version
+
+    if fresh:
+        try:
+            with span('dataset.read_parquet'):
+                df = pd.read_parquet(parquet_path)
+            if (meta.get('mtime_ns'), meta.get('size')) != stat:
+                _write_meta(meta_path, {**meta, 'mtime_ns': stat[0], 'size': stat[1]})
+            return df, version
+        except (ImportError, OSError, ValueError):
+            pass
+
+    df = read_csv_typed(path)
+    try:
+        os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+        tmp_path = f"{parquet_path}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+        _write_meta(meta_path, {
+            'schema': SCHEMA_VERSION,
+            'mtime_ns': stat[0],
+            'size': stat[1],
+            'sha256': version,
+        })
+    except (ImportError, OSError, ValueError):
+        # No pyarrow or a read-only data directory: fall back to parsing the CSV each start.
+        pass
+    return df, version
+
+
+def load_dataset(path: Optional[str] = None) -> pd.DataFrame:
+    """Returns the process-wide typed copy of the groundwater dataset.
+
+    All callers (every Streamlit session, CLI tools) receive the same DataFrame
+    object and must treat it as read-only. The file is only re-read when its
+    modification time or size changes.
+
+    Args:
+        path: CSV path, Parquet file or ingested Parquet directory (default: HYDRO_DATA_PATH
+            or the bundled Gujarat extract)
+
+    Returns:
+        DataFrame with categorical text columns and float32 measurements; the
+        content hash is available through dataset_version()
+    """
+    path = resolve_data_path(path)
+    stat = _file_stat(path)
+
+    cached = _datasets.get(path)
+    if cached is not None and cached[0] == stat:
+        return cached[1]
+
+    with _lock:
+        cached = _datasets.get(path)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        if os.path.isdir(path):
+            df, version = _load_parquet_dir(path)
+        elif path.lower().endswith('.parquet'):
+            df, version = _load_parquet_file(path)
+        else:
+            df, version = _load_with_sidecar(path, stat)
+        df.attrs['dataset_version'] = version
+        df.attrs['source_path'] = path
+        _datasets[path] = (stat, df)
+        return df
+
+
+def dataset_version(df: pd.DataFrame) -> str:
+    """Returns the content hash of the file a DataFrame was loaded from ('' if unknown)."""
+    return str(df.attrs.get('dataset_version', ''))
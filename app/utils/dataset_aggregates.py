@@ -0,0 +1,366 @@
+"""
+Running aggregates for ingested datasets.
+
+Per column: count, mean and variance (merged with Chan's parallel update),
+extremes, category counts and a quantile sketch, for the whole dataset and
+for each district. Aggregates of two row sets merge into the aggregates of
+their union, so ingestion builds them bucket by bucket and an append only
+folds in the new rows. They are stored next to the data under the dataset's
+content hash; the summary, column profiles, district index and dataset
+context read them instead of rescanning the frame.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.utils.data_loader import dataset_version
+
+AGGREGATES_FILE = '_aggregates.json'
+# Bump when the stored layout changes so old files are rebuilt.
+AGGREGATES_VERSION = 1
+SKETCH_SIZE = 256
+DISTRICT_SKETCH_SIZE = 64
+DISTRICT_COLUMN = 'District'
+
+
+class RunningMoments:
+    """Count, mean, sum of squared deviations and extremes of a numeric column."""
+
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum')
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0,
+                 minimum: float = float('nan'), maximum: float = float('nan')):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> 'RunningMoments':
+        """Moments of the non-missing values."""
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return cls()
+        mean = float(values.mean())
+        return cls(len(values), mean, float(((values - mean) ** 2).sum()), float(values.min()), float(values.max()))
+
+    def merge(self, other: 'RunningMoments') -> None:
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (ddof=1, as pandas reports it)."""
+        return self.m2 / (self.count - 1) if self.count > 1 else float('nan')
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self) -> Dict[str, float]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float]) -> 'RunningMoments':
+        return cls(**data)
+
+
+class QuantileSketch:
+    """Mergeable quantile summary of at most `size` weighted centroids.
+
+    Repeated values share a centroid, so a column with few distinct values is
+    kept exactly and its quantiles match numpy's. Beyond `size` distinct
+    values, neighbouring centroids are combined into bins of roughly equal
+    weight, which bounds the rank error near 1/size.
+    """
+
+    def __init__(self, size: int = SKETCH_SIZE, means: Optional[Sequence[float]] = None,
+                 weights: Optional[Sequence[float]] = None, exact: bool = True,
+                 minimum: float = float('nan'), maximum: float = float('nan')):
+        self.size = size
+        self.means = np.asarray(means if means is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float64)
+        self.exact = exact
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @property
+    def total(self) -> float:
+        return float(self.weights.sum())
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self._absorb(values, np.ones(len(values)), True, values.min(), values.max())
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        if len(other.means):
+            self._absorb(other.means, other.weights, other.exact, other.minimum, other.maximum)
+
+    def _absorb(self, means: np.ndarray, weights: np.ndarray, exact: bool, minimum: float, maximum: float) -> None:
+        # Centroid means lie inside the range, so the extremes are tracked separately.
+        self.minimum = float(np.fmin(self.minimum, minimum))
+        self.maximum = float(np.fmax(self.maximum, maximum))
+        means, inverse = np.unique(np.concatenate([self.means, means]), return_inverse=True)
+        weights = np.bincount(inverse, weights=np.concatenate([self.weights, weights]))
+        self.exact = self.exact and exact
+        if len(means) > self.size:
+            before = np.cumsum(weights) - weights
+            bins = np.minimum((before / weights.sum() * self.size).astype(np.int64), self.size - 1)
+            binned = np.bincount(bins, weights=weights)
+            keep = binned > 0
+            means = (np.bincount(bins, weights=means * weights)[keep] / binned[keep])
+            weights = binned[keep]
+            self.exact = False
+        self.means, self.weights = means, weights
+
+    def quantile(self, q: float) -> float:
+        """Value at quantile q (0-1), interpolated linearly like numpy's default method."""
+        total = self.total
+        if not total:
+            return float('nan')
+        if self.exact:
+            cumulative = np.cumsum(self.weights)
+            position = (total - 1) * q
+            lo, hi = np.searchsorted(cumulative, [np.floor(position), np.ceil(position)], side='right')
+            low, high = self.means[lo], self.means[hi]
+            return float(low + (position - np.floor(position)) * (high - low))
+        positions = np.concatenate([[0.0], np.cumsum(self.weights) - self.weights / 2, [total]])
+        values = np.concatenate([[self.minimum], self.means, [self.maximum]])
+        return float(np.interp(q * total, positions, values))
+
+    def rank(self, value: float) -> float:
+        """Fraction of the weight strictly below value."""
+        total = self.total
+        if not total:
+            return float('nan')
+        if self.exact:
+            return float(self.weights[:np.searchsorted(self.means, value, side='left')].sum() / total)
+        if value <= self.minimum:
+            return 0.0
+        if value > self.maximum:
+            return 1.0
+        positions = np.concatenate([[0.0], np.cumsum(self.weights) - self.weights / 2, [total]])
+        values = np.concatenate([[self.minimum], self.means, [self.maximum]])
+        return float(np.interp(value, values, positions) / total)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'size': self.size,
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+            'exact': self.exact,
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'QuantileSketch':
+        return cls(**data)
+
+
+class GroupAggregates:
+    """Aggregates of one row set: the whole dataset or one district."""
+
+    def __init__(self, sketch_size: int = SKETCH_SIZE):
+        self.sketch_size = sketch_size
+        self.rows = 0
+        self.moments: Dict[str, RunningMoments] = {}
+        self.sketches: Dict[str, QuantileSketch] = {}
+        self.categories: Dict[str, Dict[str, int]] = {}
+
+    def update(self, frame: pd.DataFrame, exclude: Iterable[str] = ()) -> None:
+        """Folds a frame's rows in; numeric columns get moments and a sketch, text columns counts."""
+        self.rows += len(frame)
+        for col in frame.columns:
+            if col in exclude:
+                continue
+            series = frame[col]
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+                self.moments.setdefault(col, RunningMoments()).merge(RunningMoments.of(values))
+                self.sketches.setdefault(col, QuantileSketch(self.sketch_size)).update(values)
+            else:
+                counts = self.categories.setdefault(col, {})
+                for value, n in series.value_counts(dropna=True, sort=False).items():
+                    counts[str(value)] = counts.get(str(value), 0) + int(n)
+
+    def merge(self, other: 'GroupAggregates') -> None:
+        self.rows += other.rows
+        for col, moments in other.moments.items():
+            self.moments.setdefault(col, RunningMoments()).merge(moments)
+        for col, sketch in other.sketches.items():
+            self.sketches.setdefault(col, QuantileSketch(self.sketch_size)).merge(sketch)
+        for col, counts in other.categories.items():
+            mine = self.categories.setdefault(col, {})
+            for value, n in counts.items():
+                mine[value] = mine.get(value, 0) + n
+
+    def describe(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Numeric columns in the layout of DataFrame.describe()."""
+        columns = [c for c in (columns if columns is not None else self.moments) if c in self.moments]
+        table = {}
+        for col in columns:
+            moments, sketch = self.moments[col], self.sketches[col]
+            table[col] = [
+                moments.count, moments.mean if moments.count else float('nan'), moments.std, moments.minimum,
+                sketch.quantile(0.25), sketch.quantile(0.5), sketch.quantile(0.75), moments.maximum,
+            ]
+        return pd.DataFrame(table, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'], dtype='float64')
+
+    def category_shares(self, columns: Optional[Sequence[str]] = None, top: int = 5) -> Dict[str, str]:
+        """Same text as context_builder.category_shares, from the stored counts."""
+        lines = {}
+        for col in (columns if columns is not None else self.categories):
+            counts = self.categories.get(col)
+            if counts is None:
+                continue
+            total = sum(counts.values())
+            ranked = sorted(counts.items(), key=lambda item: -item[1])[:top]
+            lines[col] = ", ".join(f"{value}={n / total * 100:.0f}%" for value, n in ranked if n > 0)
+        return lines
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rows': self.rows,
+            'moments': {col: m.to_dict() for col, m in self.moments.items()},
+            'sketches': {col: s.to_dict() for col, s in self.sketches.items()},
+            'categories': self.categories,
+        }
+
+    def _load(self, data: Dict[str, Any]) -> None:
+        self.rows = data['rows']
+        self.moments = {col: RunningMoments.from_dict(m) for col, m in data['moments'].items()}
+        self.sketches = {col: QuantileSketch.from_dict(s) for col, s in data['sketches'].items()}
+        self.categories = data['categories']
+
+
+class DatasetAggregates(GroupAggregates):
+    """Dataset-wide aggregates plus one GroupAggregates per district.
+
+    Args:
+        district_col: Column that names a sample's district
+    """
+
+    def __init__(self, district_col: str = DISTRICT_COLUMN):
+        super().__init__(SKETCH_SIZE)
+        self.district_col = district_col
+        self.version = ''
+        self.districts: Dict[str, GroupAggregates] = {}
+
+    def update(self, frame: pd.DataFrame, exclude: Iterable[str] = ()) -> None:
+        super().update(frame, exclude)
+        if self.district_col not in frame.columns:
+            return
+        groups = frame.groupby(frame[self.district_col], observed=True, sort=False).indices
+        for name, positions in groups.items():
+            group = self.districts.get(str(name))
+            if group is None:
+                group = self.districts[str(name)] = GroupAggregates(DISTRICT_SKETCH_SIZE)
+            group.update(frame.take(positions), exclude=[self.district_col, *exclude])
+
+    def merge(self, other: 'DatasetAggregates') -> None:
+        super().merge(other)
+        for name, group in other.districts.items():
+            self.districts.setdefault(name, GroupAggregates(DISTRICT_SKETCH_SIZE)).merge(group)
+
+    def numeric_stats(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Same table as context_builder.numeric_stats, from the stored aggregates."""
+        stats = self.describe(columns).T.drop(columns=['std'])
+        stats.index.name = 'column'
+        return stats
+
+    def district_means(self, columns: Sequence[str]) -> pd.DataFrame:
+        """Sample count and column means per district, sorted by district name."""
+        names = sorted(self.districts)
+        table = pd.DataFrame(
+            {col: [self._district_mean(name, col) for name in names] for col in columns},
+            index=pd.Index(names, name=self.district_col),
+        )
+        table.insert(0, 'samples', [self.districts[name].rows for name in names])
+        return table
+
+    def _district_mean(self, name: str, column: str) -> float:
+        moments = self.districts[name].moments.get(column)
+        return moments.mean if moments is not None and moments.count else float('nan')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format': AGGREGATES_VERSION,
+            'version': self.version,
+            'district_col': self.district_col,
+            **super().to_dict(),
+            'districts': {name: group.to_dict() for name, group in self.districts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DatasetAggregates':
+        aggregates = cls(data['district_col'])
+        aggregates.version = data['version']
+        aggregates._load(data)
+        for name, group_data in data['districts'].items():
+            group = aggregates.districts[name] = GroupAggregates(DISTRICT_SKETCH_SIZE)
+            group._load(group_data)
+        return aggregates
+
+    def save(self, dataset_dir: str) -> None:
+        path = os.path.join(dataset_dir, AGGREGATES_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, dataset_dir: str) -> Optional['DatasetAggregates']:
+        """Stored aggregates of a dataset directory, or None if missing or in an old layout."""
+        try:
+            with open(os.path.join(dataset_dir, AGGREGATES_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('format') != AGGREGATES_VERSION:
+            return None
+        return cls.from_dict(data)
+
+
+_lock = threading.Lock()
+_loaded: Dict[str, DatasetAggregates] = {}
+
+
+def stored_aggregates(df: pd.DataFrame) -> Optional[DatasetAggregates]:
+    """Aggregates stored with the directory a DataFrame was loaded from, if they match its version.
+
+    Returns None for CSV datasets, for directories without current
+    aggregates and for subsets of the loaded frame (which keep its attrs),
+    in which case callers compute from the frame as before.
+    """
+    path, version = df.attrs.get('source_path'), dataset_version(df)
+    if not path or not version or not os.path.isdir(path):
+        return None
+    with _lock:
+        aggregates = _loaded.get(path)
+        if aggregates is None or aggregates.version != version:
+            aggregates = DatasetAggregates.load(path)
+            if aggregates is None:
+                return None
+            _loaded[path] = aggregates
+    if aggregates.version != version or aggregates.rows != len(df):
+        return None
+    return aggregates
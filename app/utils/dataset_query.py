@@ -0,0 +1,752 @@
+"""
+Query layer over the groundwater dataset, in memory or on disk.
+
+The operations the app needs beyond row-level work (filtered counts and
+rows, describe-style statistics, category counts, group-by summaries and
+training samples) are defined once on DatasetQuery and implemented twice:
+
+- PandasQuery runs them on the in-memory frame from data_loader and stays
+  the default for CSV files and small datasets.
+- ArrowQuery runs them on a Parquet dataset (a directory written by
+  app.utils.ingestion, or a single file) with pyarrow's streaming engine.
+  Only the needed columns are read, district filters skip whole partitions
+  and other filters are applied while scanning, so memory depends on the
+  result size rather than the dataset size. Quartiles and medians come from
+  t-digests and are approximate. Unfiltered statistics of ingested datasets
+  are read from their stored aggregates (see dataset_aggregates) without a
+  scan.
+
+get_dataset_query picks the backend (HYDRO_QUERY_BACKEND: auto, pandas or
+arrow). On the Arrow backend the app's widgets work on a bounded random
+sample of the rows (see DatasetQuery.frame) while counts and statistics
+cover the whole dataset.
+
+Run ``python -m app.utils.dataset_query --help`` for the command line.
+"""
+import argparse
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.utils.context_builder import category_shares, compact_table
+from app.utils.data_loader import DATASET_MANIFEST, apply_dtypes, dataset_version, load_dataset, resolve_data_path
+from app.utils.dataset_aggregates import DatasetAggregates
+from app.utils.helpers import find_district_column
+from app.utils.instrumentation import span
+
+QUERY_BACKEND_ENV = 'HYDRO_QUERY_BACKEND'
+PANDAS_MAX_MB_ENV = 'HYDRO_QUERY_PANDAS_MAX_MB'
+SAMPLE_ROWS_ENV = 'HYDRO_QUERY_SAMPLE_ROWS'
+# On-disk Parquet size up to which auto mode still loads the dataset into pandas.
+DEFAULT_PANDAS_MAX_MB = 64
+DEFAULT_SAMPLE_ROWS = 200_000
+SCAN_BATCH_ROWS = 131_072
+
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in')
+AGGREGATIONS = ('count', 'mean', 'std', 'min', 'max', 'median', 'sum')
+QUARTILES = [0.25, 0.5, 0.75]
+# Key column of the single group ArrowQuery uses for ungrouped hash aggregates.
+ALL_ROWS = '__all_rows__'
+DESCRIBE_ROWS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+Filter = Tuple[str, str, Any]
+
+
+def validate_filters(filters: Optional[Sequence[Sequence[Any]]], columns: Sequence[str]) -> List[Filter]:
+    """Checks (column, op, value) filters against the dataset's columns.
+
+    'in' and 'not in' take a list of values; the other operators take one.
+
+    Raises:
+        ValueError: Unknown column or operator, or a malformed filter
+    """
+    if filters is not None and not isinstance(filters, (list, tuple)):
+        raise ValueError(f"Filters must be a list of (column, op, value), got {filters!r}")
+    checked = []
+    for item in filters or []:
+        if not isinstance(item, (list, tuple)) or len(item) != 3:
+            raise ValueError(f"A filter is (column, op, value), got {item!r}")
+        column, op, value = item
+        if column not in columns:
+            raise ValueError(f"Unknown column in filter: {column}")
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unknown filter operator {op!r}; use one of {', '.join(FILTER_OPS)}")
+        if op in ('in', 'not in'):
+            value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        elif isinstance(value, (list, tuple, set)):
+            raise ValueError(f"Operator {op!r} takes a single value, got {value!r}")
+        checked.append((column, op, value))
+    return checked
+
+
+def parse_filter(text: str) -> Tuple[str, str, str]:
+    """Parses command line filters such as 'District == Surat' or 'PH in 6.5,8.5'."""
+    match = re.match(r'^\s*(.+?)\s+(==|!=|<=|>=|<|>|not in|in)\s+(.+?)\s*$', text)
+    if not match:
+        raise ValueError(f"Cannot parse filter {text!r}; expected 'COLUMN OP VALUE'")
+    column, op, value = match.groups()
+    return column, op, [v.strip() for v in value.split(',')] if op in ('in', 'not in') else value
+
+
+class DatasetQuery(ABC):
+    """Dataset operations independent of where the rows live.
+
+    Attributes:
+        backend: 'pandas' or 'arrow'
+        columns: Column names in dataset order
+        numeric_columns: Columns with numeric values
+        district_col: District column, if any
+        version: Content version of the dataset
+    """
+
+    backend = ''
+    columns: List[str]
+    numeric_columns: List[str]
+    district_col: Optional[str]
+    version: str
+
+    def _columns(self, columns: Optional[Sequence[str]], numeric: bool = False) -> List[str]:
+        pool = self.numeric_columns if numeric else self.columns
+        if columns is None:
+            return list(pool)
+        unknown = [c for c in columns if c not in self.columns]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        return [c for c in columns if c in pool]
+
+    def check_filters(self, filters: Optional[Sequence[Sequence[Any]]]) -> List[Filter]:
+        """Validated filters with values converted to the column's kind (numbers or text)."""
+        checked = []
+        for column, op, value in validate_filters(filters, self.columns):
+            numeric = column in self.numeric_columns
+            if op in ('<', '<=', '>', '>=') and not numeric:
+                raise ValueError(f"Operator {op!r} needs a numeric column; {column} is not")
+            convert = float if numeric else str
+            try:
+                value = [convert(v) for v in value] if isinstance(value, list) else convert(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{column} is numeric; got {value!r}") from None
+            checked.append((column, op, value))
+        return checked
+
+    @property
+    def sampled(self) -> bool:
+        """True when frame() holds only a sample of the rows."""
+        return False
+
+    @abstractmethod
+    def frame(self) -> pd.DataFrame:
+        """In-memory rows for the widgets: the whole dataset, or a bounded sample on disk-backed queries."""
+        ...
+
+    @abstractmethod
+    def count(self, filters: Optional[Sequence[Filter]] = None) -> int:
+        """Number of matching rows."""
+
+    @abstractmethod
+    def select(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Sequence[Filter]] = None,
+        limit: Optional[int] = None
+    ) -> pd.DataFrame:
+        """Matching rows (the first `limit` of them) with the given columns."""
+        ...
+
+    def district(self, name: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """All rows of one district."""
+        if self.district_col is None:
+            raise ValueError("The dataset has no district column")
+        return self.select(columns, [(self.district_col, '==', name)])
+
+    @abstractmethod
+    def describe(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Sequence[Filter]] = None,
+        by: Optional[str] = None
+    ) -> Union[pd.DataFrame, Dict[Any, pd.DataFrame]]:
+        """count/mean/std/min/quartiles/max of numeric columns, in DataFrame.describe() layout.
+
+        With `by`, returns one such table per value of that column.
+        """
+        ...
+
+    @abstractmethod
+    def value_counts(
+        self,
+        column: str,
+        filters: Optional[Sequence[Filter]] = None,
+        by: Optional[str] = None
+    ) -> Union[pd.Series, Dict[Any, pd.Series]]:
+        """Non-missing value counts of a column, most common first (per value of `by` if given)."""
+        ...
+
+    def category_shares(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Sequence[Filter]] = None,
+        top: int = 5,
+        by: Optional[str] = None
+    ) -> Union[Dict[str, str], Dict[Any, Dict[str, str]]]:
+        """Same text as context_builder.category_shares for the matching rows.
+
+        With `by`, returns the shares per value of that column (which is left out).
+        """
+        columns = self._category_columns(columns, by)
+        if by is None:
+            return {col: _render_shares(self.value_counts(col, filters), top) for col in columns}
+        shares: Dict[Any, Dict[str, str]] = {}
+        for col in columns:
+            for name, counts in self.value_counts(col, filters, by=by).items():
+                shares.setdefault(name, {})[col] = _render_shares(counts, top)
+        return shares
+
+    def _category_columns(self, columns: Optional[Sequence[str]], by: Optional[str] = None) -> List[str]:
+        columns = self._columns(columns)
+        return [c for c in columns if c not in self.numeric_columns and c != by]
+
+    @abstractmethod
+    def group_summary(
+        self,
+        by: str,
+        columns: Sequence[str],
+        aggregations: Sequence[str] = ('mean',),
+        filters: Optional[Sequence[Filter]] = None
+    ) -> pd.DataFrame:
+        """One row per value of `by`: a 'samples' count, then '<column>_<aggregation>' columns.
+
+        Aggregations are count (non-missing values), mean, std, min, max,
+        median and sum.
+        """
+        ...
+
+    def aggregate(
+        self,
+        columns: Sequence[str],
+        aggregations: Sequence[str] = ('mean',),
+        filters: Optional[Sequence[Filter]] = None
+    ) -> pd.DataFrame:
+        """group_summary over all matching rows: a single row with the same columns.
+
+        This default derives the values from describe(), so medians share its
+        precision and sums are mean times count.
+        """
+        columns = self._check_aggregations(columns, aggregations)
+        stats = self.describe(columns, filters)
+        row: Dict[str, Any] = {'samples': self.count(filters)}
+        for col in columns:
+            n = stats.at['count', col]
+            values = {
+                'count': n, 'mean': stats.at['mean', col], 'std': stats.at['std', col],
+                'min': stats.at['min', col], 'max': stats.at['max', col], 'median': stats.at['50%', col],
+                'sum': stats.at['mean', col] * n if n else 0.0,
+            }
+            for agg in aggregations:
+                row[f"{col}_{agg}"] = values[agg]
+        return pd.DataFrame([row])
+
+    @abstractmethod
+    def training_sample(
+        self,
+        target: Optional[str] = None,
+        columns: Optional[Sequence[str]] = None,
+        max_rows: Optional[int] = None,
+        filters: Optional[Sequence[Filter]] = None,
+        random_state: int = 42
+    ) -> pd.DataFrame:
+        """Rows with a known target, at most max_rows of them chosen at random (deterministically).
+
+        The frame has data_loader's dtypes and can be passed to
+        ml_models.preprocess_data or model_registry.train_or_load.
+        """
+        ...
+
+    def _check_group(self, by: str, columns: Sequence[str], aggregations: Sequence[str]) -> List[str]:
+        if by not in self.columns:
+            raise ValueError(f"Unknown group-by column: {by}")
+        return self._check_aggregations(columns, aggregations)
+
+    def _check_aggregations(self, columns: Sequence[str], aggregations: Sequence[str]) -> List[str]:
+        unknown = [a for a in aggregations if a not in AGGREGATIONS]
+        if unknown:
+            raise ValueError(f"Unknown aggregations: {', '.join(unknown)}; use {', '.join(AGGREGATIONS)}")
+        return self._columns(columns, numeric=True)
+
+
+def _render_shares(counts: pd.Series, top: int) -> str:
+    total = counts.sum()
+    if not total:
+        return ""
+    return ", ".join(f"{value}={n / total * 100:.0f}%" for value, n in counts.head(top).items() if n > 0)
+
+
+class PandasQuery(DatasetQuery):
+    """DatasetQuery over an in-memory frame (see data_loader.load_dataset)."""
+
+    backend = 'pandas'
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.columns = [str(c) for c in df.columns]
+        self.numeric_columns = [
+            c for c in self.columns
+            if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])
+        ]
+        self.district_col = find_district_column(df)
+        self.version = dataset_version(df)
+
+    def _rows(self, filters: Optional[Sequence[Filter]]) -> pd.DataFrame:
+        filters = self.check_filters(filters)
+        if not filters:
+            return self.df
+        mask = np.ones(len(self.df), dtype=bool)
+        for column, op, value in filters:
+            values = self.df[column]
+            if op == 'in':
+                mask &= values.isin(value).to_numpy()
+            elif op == 'not in':
+                mask &= ~values.isin(value).to_numpy()
+            else:
+                compare = {'==': values.__eq__, '!=': values.__ne__, '<': values.__lt__,
+                           '<=': values.__le__, '>': values.__gt__, '>=': values.__ge__}[op]
+                mask &= compare(value).fillna(False).to_numpy(dtype=bool)
+        return self.df[mask]
+
+    def frame(self) -> pd.DataFrame:
+        return self.df
+
+    def count(self, filters: Optional[Sequence[Filter]] = None) -> int:
+        return len(self._rows(filters))
+
+    def select(self, columns=None, filters=None, limit=None) -> pd.DataFrame:
+        rows = self._rows(filters)[self._columns(columns)]
+        return rows if limit is None else rows.head(limit)
+
+    def describe(self, columns=None, filters=None, by=None):
+        columns = self._columns(columns, numeric=True)
+        rows = self._rows(filters)
+        if by is None:
+            return rows[columns].describe().reindex(DESCRIBE_ROWS).astype('float64')
+        return {
+            name: group.describe().reindex(DESCRIBE_ROWS).astype('float64')
+            for name, group in rows.groupby(by, observed=True)[columns]
+        }
+
+    def value_counts(self, column, filters=None, by=None):
+        rows = self._rows(filters)
+        if by is None:
+            return rows[column].value_counts(sort=True).loc[lambda s: s > 0]
+        return {
+            name: group.value_counts(sort=True).loc[lambda s: s > 0]
+            for name, group in rows.groupby(by, observed=True)[column]
+        }
+
+    def category_shares(self, columns=None, filters=None, top=5, by=None):
+        columns = self._category_columns(columns, by)
+        rows = self._rows(filters)
+        if by is None:
+            return category_shares(rows, columns, top)
+        return {name: category_shares(group, columns, top) for name, group in rows.groupby(by, observed=True)}
+
+    def group_summary(self, by, columns, aggregations=('mean',), filters=None) -> pd.DataFrame:
+        columns = self._check_group(by, columns, aggregations)
+        groups = self._rows(filters).groupby(by, observed=True, sort=True)
+        table = groups[columns].agg(list(aggregations)) if columns else pd.DataFrame(index=groups.size().index)
+        table.columns = [f"{col}_{agg}" for col, agg in table.columns] if columns else []
+        table.insert(0, 'samples', groups.size())
+        return table
+
+    def aggregate(self, columns, aggregations=('mean',), filters=None) -> pd.DataFrame:
+        columns = self._check_aggregations(columns, aggregations)
+        rows = self._rows(filters)
+        row: Dict[str, Any] = {'samples': len(rows)}
+        if columns:
+            values = rows[columns].agg(list(aggregations))
+            row.update({f"{col}_{agg}": values.at[agg, col] for col in columns for agg in aggregations})
+        return pd.DataFrame([row])
+
+    def training_sample(self, target=None, columns=None, max_rows=None, filters=None, random_state=42) -> pd.DataFrame:
+        columns = self._columns(columns)
+        if target is not None and target not in columns:
+            columns.append(target)
+        rows = self._rows(filters)
+        if target is not None:
+            rows = rows[rows[target].notna()]
+        if max_rows is not None and len(rows) > max_rows:
+            rows = rows.sample(max_rows, random_state=random_state)
+        return rows[columns]
+
+
+class ArrowQuery(DatasetQuery):
+    """DatasetQuery over a Parquet dataset, evaluated lazily with pyarrow.
+
+    Args:
+        path: Directory written by app.utils.ingestion (hive District
+            partitions) or a single Parquet file
+        sample_rows: Rows kept in memory by frame() (default:
+            HYDRO_QUERY_SAMPLE_ROWS or 200,000)
+    """
+
+    backend = 'arrow'
+
+    def __init__(self, path: str, sample_rows: Optional[int] = None):
+        import pyarrow.dataset as ds
+
+        self.path = os.path.abspath(path)
+        self.sample_rows = sample_rows or int(os.getenv(SAMPLE_ROWS_ENV, DEFAULT_SAMPLE_ROWS))
+        is_dir = os.path.isdir(self.path)
+        self.dataset = ds.dataset(self.path, format='parquet', partitioning='hive' if is_dir else None)
+        manifest = {}
+        if is_dir:
+            try:
+                with open(os.path.join(self.path, DATASET_MANIFEST), 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                pass
+        names = self.dataset.schema.names
+        self.columns = [c for c in manifest.get('columns', []) if c in names] or list(names)
+        self.columns += [c for c in names if c not in self.columns]
+        self.numeric_columns = [
+            c for c in self.columns
+            if _is_numeric_type(self.dataset.schema.field(c).type)
+        ]
+        self.district_col = next(
+            (c for c in self.columns if 'district' in c.lower() or 'location' in c.lower()), None
+        )
+        self.version = manifest.get('content_hash') or self._listing_version()
+        aggregates = DatasetAggregates.load(self.path) if is_dir else None
+        self.aggregates = aggregates if aggregates is not None and aggregates.version == self.version else None
+        self._total_rows: Optional[int] = None
+        self._frame: Optional[pd.DataFrame] = None
+        self._lock = threading.Lock()
+
+    def _listing_version(self) -> str:
+        # Without an ingestion manifest, file names, sizes and modification times identify the content.
+        digest = hashlib.sha256()
+        for path in sorted(self.dataset.files):
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, self.path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    def _expression(self, filters: Optional[Sequence[Filter]]):
+        import pyarrow.dataset as ds
+
+        expression = None
+        for column, op, value in self.check_filters(filters):
+            field = ds.field(column)
+            if op == 'in':
+                condition = field.isin(value)
+            elif op == 'not in':
+                condition = ~field.isin(value)
+            else:
+                condition = {'==': field.__eq__, '!=': field.__ne__, '<': field.__lt__,
+                             '<=': field.__le__, '>': field.__gt__, '>=': field.__ge__}[op](value)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def _aggregate(self, aggregates: List[tuple], keys: Optional[List[str]] = None,
+                   filters: Optional[Sequence[Filter]] = None):
+        """Runs scan -> filter -> aggregate as one streaming plan; only the referenced columns are read.
+
+        keys=[ALL_ROWS] groups every row into one group, for hash_* functions
+        that have no usable scalar form.
+        """
+        import pyarrow.acero as ac
+        import pyarrow.compute as pc
+
+        expression = self._expression(filters)
+        needed = {a[0] for a in aggregates if a[0]} | set(keys or []) | {f[0] for f in filters or []}
+        read = [c for c in self.columns if c in needed]
+        nodes = [ac.Declaration('scan', ac.ScanNodeOptions(
+            self.dataset, columns=read, filter=expression, batch_size=SCAN_BATCH_ROWS
+        ))]
+        if expression is not None:
+            # The scan filter only prunes partitions and row groups; this applies it row by row.
+            nodes.append(ac.Declaration('filter', ac.FilterNodeOptions(expression)))
+        if keys == [ALL_ROWS]:
+            nodes.append(ac.Declaration('project', ac.ProjectNodeOptions(
+                [pc.field(c) for c in read] + [pc.scalar(0)], read + [ALL_ROWS]
+            )))
+        nodes.append(ac.Declaration('aggregate', ac.AggregateNodeOptions(aggregates, keys=keys)))
+        return ac.Declaration.from_sequence(nodes).to_table()
+
+    def _stored(self, filters: Optional[Sequence[Filter]], by: Optional[str] = None) -> Optional[DatasetAggregates]:
+        """Stored aggregates if they can answer an unfiltered query (grouped only by district)."""
+        if self.aggregates is None or filters or by not in (None, self.aggregates.district_col):
+            return None
+        return self.aggregates
+
+    @property
+    def sampled(self) -> bool:
+        return self.count() > self.sample_rows
+
+    def frame(self) -> pd.DataFrame:
+        with self._lock:
+            if self._frame is None:
+                with span('query.sample'):
+                    df = self.training_sample(max_rows=self.sample_rows)
+                # A sample is its own dataset version, so models trained on it are keyed apart.
+                sampled = len(df) < self.count()
+                df.attrs['dataset_version'] = f"{self.version}-sample{len(df)}" if sampled else self.version
+                df.attrs['source_path'] = self.path
+                self._frame = df
+            return self._frame
+
+    def count(self, filters=None) -> int:
+        if filters:
+            return self.dataset.count_rows(filter=self._expression(filters))
+        if self._total_rows is None:
+            self._total_rows = self.dataset.count_rows()
+        return self._total_rows
+
+    def select(self, columns=None, filters=None, limit=None) -> pd.DataFrame:
+        columns = self._columns(columns)
+        expression = self._expression(filters)
+        if limit is not None:
+            table = self.dataset.head(limit, columns=columns, filter=expression)
+        else:
+            table = self.dataset.to_table(columns=columns, filter=expression)
+        return apply_dtypes(table.to_pandas())
+
+    def describe(self, columns=None, filters=None, by=None):
+        import pyarrow.compute as pc
+
+        columns = self._columns(columns, numeric=True)
+        stored = self._stored(filters, by)
+        if stored is not None:
+            if by is None:
+                return stored.describe(columns).reindex(columns=columns)
+            return {name: stored.districts[name].describe(columns) for name in sorted(stored.districts)}
+        if not columns:
+            return pd.DataFrame(index=DESCRIBE_ROWS, dtype='float64') if by is None else {}
+        aggregates = []
+        for i, col in enumerate(columns):
+            aggregates += [
+                (col, 'hash_count', pc.CountOptions(mode='only_valid'), f'{i}:count'),
+                (col, 'hash_mean', None, f'{i}:mean'),
+                (col, 'hash_stddev', pc.VarianceOptions(ddof=1), f'{i}:std'),
+                (col, 'hash_min_max', None, f'{i}:min_max'),
+                (col, 'hash_tdigest', pc.TDigestOptions(q=QUARTILES), f'{i}:quartiles'),
+            ]
+        key = by if by is not None else ALL_ROWS
+        records = self._aggregate(aggregates, [key], filters).to_pylist()
+
+        def table(record: Dict[str, Any]) -> pd.DataFrame:
+            stats = {}
+            for i, col in enumerate(columns):
+                min_max = record.get(f'{i}:min_max') or {}
+                quartiles = record.get(f'{i}:quartiles') or [None] * len(QUARTILES)
+                stats[col] = [
+                    record.get(f'{i}:count', 0), record.get(f'{i}:mean'), record.get(f'{i}:std'),
+                    min_max.get('min'), *quartiles, min_max.get('max'),
+                ]
+            return pd.DataFrame(stats, index=DESCRIBE_ROWS, dtype='float64')
+
+        if by is None:
+            # No matching rows means no group at all.
+            return table(records[0] if records else {})
+        return {record[by]: table(record) for record in sorted(records, key=lambda r: str(r[by])) if record[by] is not None}
+
+    def category_shares(self, columns=None, filters=None, top=5, by=None):
+        stored = self._stored(filters, by)
+        if stored is None:
+            return super().category_shares(columns, filters, top, by)
+        columns = self._category_columns(columns, by)
+        if by is None:
+            return stored.category_shares(columns, top)
+        return {name: stored.districts[name].category_shares(columns, top) for name in sorted(stored.districts)}
+
+    def value_counts(self, column, filters=None, by=None):
+        import pyarrow.compute as pc
+
+        if column not in self.columns:
+            raise ValueError(f"Unknown column: {column}")
+        keys = [column] if by is None else [by, column]
+        counts = self._aggregate(
+            [(column, 'hash_count', pc.CountOptions(mode='all'), 'n')], keys, filters
+        ).to_pandas()
+        counts = counts[counts[column].notna()].sort_values('n', ascending=False, kind='stable')
+        if by is None:
+            return counts.set_index(column)['n'].rename_axis(column).rename('count')
+        return {
+            name: group.set_index(column)['n'].rename_axis(column).rename('count')
+            for name, group in counts.groupby(by, sort=True)
+        }
+
+    def group_summary(self, by, columns, aggregations=('mean',), filters=None) -> pd.DataFrame:
+        import pyarrow.compute as pc
+
+        columns = self._check_group(by, columns, aggregations)
+        functions = {
+            'count': ('hash_count', pc.CountOptions(mode='only_valid')),
+            'mean': ('hash_mean', None),
+            'std': ('hash_stddev', pc.VarianceOptions(ddof=1)),
+            'min': ('hash_min', None),
+            'max': ('hash_max', None),
+            'median': ('hash_approximate_median', None),
+            'sum': ('hash_sum', None),
+        }
+        aggregates = [([], 'hash_count_all', None, 'samples')]
+        for col in columns:
+            for agg in aggregations:
+                function, options = functions[agg]
+                aggregates.append((col, function, options, f"{col}_{agg}"))
+        table = self._aggregate(aggregates, [by], filters).to_pandas()
+        table = table[table[by].notna()].set_index(by).sort_index()
+        return table[['samples'] + [f"{col}_{agg}" for col in columns for agg in aggregations]]
+
+    def training_sample(self, target=None, columns=None, max_rows=None, filters=None, random_state=42) -> pd.DataFrame:
+        import pyarrow.dataset as ds
+
+        columns = self._columns(columns)
+        if target is not None and target not in columns:
+            columns.append(target)
+        expression = self._expression(filters)
+        if target is not None:
+            expression = ds.field(target).is_valid() if expression is None else expression & ds.field(target).is_valid()
+        # Keeping the rows with the smallest seeded random keys is a uniform sample; rows
+        # stay Arrow batches and are compacted to max_rows whenever twice that many are held.
+        import pyarrow as pa
+
+        rng = np.random.default_rng(random_state)
+        batches: List[Any] = []
+        keys: List[np.ndarray] = []
+        held = 0
+
+        def compact() -> None:
+            nonlocal held
+            table = pa.Table.from_batches(batches, schema=scanner.projected_schema)
+            all_keys = np.concatenate(keys)
+            chosen = np.sort(np.argpartition(all_keys, max_rows)[:max_rows])
+            batches[:] = table.take(chosen).combine_chunks().to_batches()
+            keys[:] = [all_keys[chosen]]
+            held = max_rows
+
+        scanner = self.dataset.scanner(columns=columns, filter=expression, batch_size=SCAN_BATCH_ROWS)
+        for batch in scanner.to_batches():
+            if not batch.num_rows:
+                continue
+            batches.append(batch)
+            keys.append(rng.random(batch.num_rows))
+            held += batch.num_rows
+            if max_rows is not None and held > 2 * max_rows:
+                compact()
+        if max_rows is not None and held > max_rows:
+            compact()
+        return apply_dtypes(pa.Table.from_batches(batches, schema=scanner.projected_schema).to_pandas())
+
+
+def _is_numeric_type(arrow_type) -> bool:
+    import pyarrow.types as pat
+
+    return pat.is_floating(arrow_type) or pat.is_integer(arrow_type) or pat.is_decimal(arrow_type)
+
+
+def _disk_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files if name.endswith('.parquet')
+    )
+
+
+def choose_backend(path: str, backend: Optional[str] = None) -> str:
+    """'pandas' or 'arrow' for a dataset path (HYDRO_QUERY_BACKEND, default auto).
+
+    auto keeps CSV files and Parquet datasets up to HYDRO_QUERY_PANDAS_MAX_MB
+    on disk (default 64, about two million rows) in pandas and queries larger Parquet datasets in place.
+    """
+    backend = (backend or os.getenv(QUERY_BACKEND_ENV) or 'auto').lower()
+    if backend not in ('auto', 'pandas', 'arrow'):
+        raise ValueError(f"Unknown query backend {backend!r}; use auto, pandas or arrow")
+    is_parquet = os.path.isdir(path) or path.lower().endswith('.parquet')
+    if backend == 'arrow' and not is_parquet:
+        raise ValueError(f"The arrow backend needs a Parquet dataset; {path} is not one (see app.utils.ingestion)")
+    if backend != 'auto':
+        return backend
+    if not is_parquet:
+        return 'pandas'
+    limit = float(os.getenv(PANDAS_MAX_MB_ENV, DEFAULT_PANDAS_MAX_MB)) * (1 << 20)
+    return 'arrow' if _disk_size(path) > limit else 'pandas'
+
+
+_lock = threading.Lock()
+_queries: Dict[str, Tuple[tuple, DatasetQuery]] = {}
+
+
+def get_dataset_query(path: Optional[str] = None, backend: Optional[str] = None) -> DatasetQuery:
+    """Returns the process-wide query object for a dataset, rebuilt when the data changes.
+
+    Args:
+        path: CSV path or Parquet dataset (default: HYDRO_DATA_PATH or the bundled extract)
+        backend: 'auto', 'pandas' or 'arrow' (default: HYDRO_QUERY_BACKEND or auto)
+    """
+    path = resolve_data_path(path)
+    chosen = choose_backend(path, backend)
+    if chosen == 'pandas':
+        # load_dataset keeps its own per-version cache; wrapping the frame is free.
+        return PandasQuery(load_dataset(path))
+    manifest = os.path.join(path, DATASET_MANIFEST)
+    stat_path = manifest if os.path.exists(manifest) else path
+    stat = os.stat(stat_path)
+    key = (chosen, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _queries.get(path)
+        if cached is None or cached[0] != key:
+            cached = _queries[path] = (key, ArrowQuery(path))
+        return cached[1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the groundwater dataset without loading it into memory.")
+    parser.add_argument('--data', default=None, help="CSV or Parquet dataset (default: HYDRO_DATA_PATH)")
+    parser.add_argument('--backend', choices=['auto', 'pandas', 'arrow'], default=None)
+    parser.add_argument('--where', action='append', default=[], metavar='FILTER',
+                        help="Row filter such as 'District == Surat' or 'PH > 8.5' (repeatable)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    describe_cmd = commands.add_parser('describe', help="Statistics of numeric columns")
+    describe_cmd.add_argument('--columns', nargs='+')
+    describe_cmd.add_argument('--by', help="One table per value of this column")
+    group_cmd = commands.add_parser('group', help="Aggregations per group")
+    group_cmd.add_argument('--by', required=True)
+    group_cmd.add_argument('--columns', nargs='+', default=[])
+    group_cmd.add_argument('--agg', nargs='+', default=['mean'], choices=AGGREGATIONS)
+    counts_cmd = commands.add_parser('counts', help="Value counts of a column")
+    counts_cmd.add_argument('column')
+    sample_cmd = commands.add_parser('sample', help="Write a training sample (CSV or Parquet by extension)")
+    sample_cmd.add_argument('--target')
+    sample_cmd.add_argument('--columns', nargs='+')
+    sample_cmd.add_argument('--rows', type=int, default=DEFAULT_SAMPLE_ROWS)
+    sample_cmd.add_argument('--seed', type=int, default=42)
+    sample_cmd.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    query = get_dataset_query(args.data, args.backend)
+    filters = [parse_filter(text) for text in args.where]
+    print(f"{query.backend} backend, {query.count(filters):,} matching rows")
+    if args.command == 'describe':
+        result = query.describe(args.columns, filters, by=args.by)
+        for name, stats in (result.items() if args.by else [(None, result)]):
+            if name is not None:
+                print(f"\n{args.by} = {name}")
+            print(compact_table(stats.T))
+    elif args.command == 'group':
+        print(compact_table(query.group_summary(args.by, args.columns, args.agg, filters)))
+    elif args.command == 'counts':
+        print(compact_table(query.value_counts(args.column, filters).to_frame()))
+    else:
+        sample = query.training_sample(args.target, args.columns, args.rows, filters, args.seed)
+        if args.output.lower().endswith('.parquet'):
+            sample.to_parquet(args.output, index=False)
+        else:
+            sample.to_csv(args.output, index=False)
+        print(f"{len(sample):,} rows written to {args.output}")
@@ -0,0 +1,183 @@
+"""
+Per-district aggregate index for the chat path.
+
+Built once per dataset version: each district's row positions, its
+describe() table and the pre-rendered prompt context, so answering a
+district question is a single dictionary lookup. Ingested datasets with
+stored aggregates take the tables and category shares from those instead
+of describing every district's rows. When the app works on a sample of a
+larger dataset (see dataset_query), names, counts and statistics come from
+the query over the whole dataset and only the sample rows from the frame.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.utils.context_builder import category_shares, compact_table, render_shares, stats_from_describe
+from app.utils.data_loader import dataset_version
+from app.utils.dataset_aggregates import stored_aggregates
+from app.utils.helpers import find_district_column, normalize_district
+from app.utils.instrumentation import span
+
+if TYPE_CHECKING:
+    from app.utils.dataset_query import DatasetQuery
+
+SAMPLE_ROWS = 3
+MAX_CACHED_INDEXES = 4
+
+
+@dataclass(frozen=True)
+class DistrictEntry:
+    name: str
+    positions: np.ndarray
+    summary: pd.DataFrame
+    categories: Dict[str, str]
+    context: str
+    total: Optional[int] = None
+
+    @property
+    def sample_count(self) -> int:
+        """Rows of the district in the dataset (positions may cover only a sample of them)."""
+        return len(self.positions) if self.total is None else self.total
+
+
+def render_district_context(
+    name: str,
+    rows: pd.DataFrame,
+    summary: pd.DataFrame,
+    categories: Dict[str, str],
+    sample_count: Optional[int] = None
+) -> str:
+    """Formats the full (unbudgeted) context block for one district (rows may be just the samples shown)."""
+    return (
+        f"{name}: {len(rows) if sample_count is None else sample_count:,} samples\n"
+        f"\n"
+        f"Statistics (CSV):\n"
+        f"{compact_table(stats_from_describe(summary))}\n"
+        f"\n"
+        f"Category shares:\n"
+        f"{render_shares(categories)}\n"
+        f"\n"
+        f"Sample rows (CSV):\n"
+        f"{compact_table(rows.head(SAMPLE_ROWS), index=False)}"
+    )
+
+
+class DistrictIndex:
+    """Maps normalized district names to precomputed DistrictEntry records."""
+
+    def __init__(self, df: pd.DataFrame, district_col: Optional[str] = None, query: Optional['DatasetQuery'] = None):
+        self.district_col = district_col or find_district_column(df)
+        self.version = dataset_version(df)
+        self._entries: Dict[str, DistrictEntry] = {}
+        if self.district_col is None:
+            return
+        if query is not None:
+            self._build_from_query(df, query)
+            return
+
+        aggregates = stored_aggregates(df)
+        if aggregates is not None and aggregates.district_col != self.district_col:
+            aggregates = None
+        groups = df.groupby(df[self.district_col], observed=True, sort=True).indices
+        for name, positions in groups.items():
+            group = aggregates.districts.get(str(name)) if aggregates is not None else None
+            if group is not None:
+                rows = df.take(positions[:SAMPLE_ROWS])
+                summary = group.describe()
+                categories = group.category_shares()
+            else:
+                rows = df.take(positions)
+                summary = rows.describe(include='all')
+                categories = category_shares(rows.drop(columns=[self.district_col]))
+            display_name = " ".join(str(name).split())
+            self._entries[normalize_district(name)] = DistrictEntry(
+                name=display_name,
+                positions=positions,
+                summary=summary,
+                categories=categories,
+                context=render_district_context(display_name, rows, summary, categories, len(positions)),
+            )
+
+    def _build_from_query(self, df: pd.DataFrame, query: 'DatasetQuery') -> None:
+        totals = query.value_counts(self.district_col)
+        summaries = query.describe(by=self.district_col)
+        shares = query.category_shares(by=self.district_col)
+        groups = df.groupby(df[self.district_col], observed=True, sort=True).indices
+        for name, total in totals.sort_index().items():
+            positions = groups.get(name, np.empty(0, dtype=np.intp))
+            if len(positions):
+                rows = df.take(positions[:SAMPLE_ROWS])
+            else:
+                rows = query.select(filters=[(self.district_col, '==', name)], limit=SAMPLE_ROWS)
+            summary = summaries.get(name, pd.DataFrame())
+            categories = shares.get(name, {})
+            display_name = " ".join(str(name).split())
+            self._entries[normalize_district(name)] = DistrictEntry(
+                name=display_name,
+                positions=positions,
+                summary=summary,
+                categories=categories,
+                context=render_district_context(display_name, rows, summary, categories, int(total)),
+                total=int(total),
+            )
+
+    def get(self, name: str) -> Optional[DistrictEntry]:
+        return self._entries.get(normalize_district(name))
+
+    def __contains__(self, name: str) -> bool:
+        return normalize_district(name) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def names(self) -> List[str]:
+        return [entry.name for entry in self._entries.values()]
+
+    def rows(self, df: pd.DataFrame, name: str) -> pd.DataFrame:
+        """Returns the district's rows from the DataFrame the index was built on."""
+        entry = self.get(name)
+        if entry is None:
+            return df.iloc[0:0]
+        return df.take(entry.positions)
+
+
+_lock = threading.Lock()
+_indexes: "OrderedDict[tuple, DistrictIndex]" = OrderedDict()
+
+
+def get_district_index(
+    df: pd.DataFrame,
+    district_col: Optional[str] = None,
+    query: Optional['DatasetQuery'] = None
+) -> DistrictIndex:
+    """Returns the district index for a dataset, building it once per dataset version.
+
+    Args:
+        df: Dataset returned by data_loader.load_dataset, or DatasetQuery.frame()
+        district_col: District column name (default: detected from the columns)
+        query: Query over the whole dataset when df holds only a sample of it
+
+    Returns:
+        DistrictIndex shared by every caller holding the same dataset version
+    """
+    # Subsets keep the loaded frame's attrs (and so its version); the row count tells them apart.
+    key = (dataset_version(df) or id(df), len(df), district_col, query is not None)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+
+    with span('district.index_build'):
+        index = DistrictIndex(df, district_col, query)
+    with _lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,214 @@
+"""
+District name matching for chat prompts.
+
+Prompts are tokenized once and scanned left to right against a hash index of
+normalized district names, so multi-word names ("Chhota Udaipur"), spacing
+variants ("Banas Kantha") and known aliases ("Baroda") all resolve in a
+single pass whose cost does not grow with the number of districts. Optional
+fuzzy matching uses a deletion index bounded by an edit distance.
+"""
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from app.utils.data_loader import dataset_version
+from app.utils.district_index import get_district_index
+from app.utils.instrumentation import timed
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+MAX_CACHED_MATCHERS = 4
+
+# Common spellings and former names, keyed by the dataset's district name.
+DISTRICT_ALIASES: Dict[str, List[str]] = {
+    'Ahmedabad': ['Amdavad', 'Ahmadabad'],
+    'Aravalli': ['Aravali', 'Arvalli'],
+    'Banaskantha': ['Banas Kantha', 'Banas Kanta'],
+    'Bharuch': ['Broach'],
+    'Chhota Udaipur': ['Chhota Udepur', 'Chhotaudepur', 'Chota Udaipur'],
+    'Dahod': ['Dohad'],
+    'Dang': ['Dangs', 'The Dangs', 'Ahwa'],
+    'Devbhoomi Dwarka': ['Devbhumi Dwarka', 'Dev Bhumi Dwarka', 'Dwarka'],
+    'Gir Somnath': ['Somnath', 'Veraval'],
+    'Junagadh': ['Junagarh'],
+    'Kutch': ['Kachchh', 'Kachh', 'Bhuj'],
+    'Mahisagar': ['Mahi Sagar', 'Lunawada'],
+    'Mehsana': ['Mahesana', 'Mahesena'],
+    'Narmada': ['Rajpipla'],
+    'Panchmahal': ['Panch Mahals', 'Panchmahals', 'Godhra'],
+    'Sabarkantha': ['Sabar Kantha', 'Himmatnagar'],
+    'Vadodara': ['Baroda'],
+}
+
+
+@dataclass(frozen=True)
+class DistrictMatch:
+    name: str
+    start: int
+    end: int
+    text: str
+    distance: int = 0
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """Splits text into lowercase alphanumeric tokens with their character spans."""
+    return [(m.group(), m.start(), m.end()) for m in TOKEN_PATTERN.finditer(str(text).lower())]
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, or max_distance + 1 as soon as the bound is exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            )
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletions(word: str, max_edits: int) -> Set[str]:
+    variants = {word}
+    for n in range(1, min(max_edits, len(word) - 1) + 1):
+        for positions in combinations(range(len(word)), n):
+            variants.add(''.join(c for i, c in enumerate(word) if i not in positions))
+    return variants
+
+
+class DistrictMatcher:
+    """Finds every district mentioned in free text.
+
+    Args:
+        names: Canonical district names, as they appear in the dataset
+        aliases: Extra spellings per canonical name (default: DISTRICT_ALIASES)
+        max_edits: Edit distance allowed for fuzzy matches (0 disables them)
+        min_fuzzy_length: Shortest candidate text considered for fuzzy matching
+    """
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        aliases: Optional[Dict[str, Iterable[str]]] = None,
+        max_edits: int = 0,
+        min_fuzzy_length: int = 5
+    ):
+        self.max_edits = max_edits
+        self.min_fuzzy_length = min_fuzzy_length
+        self._index: Dict[str, str] = {}
+        self._deletion_index: Dict[str, Set[str]] = {}
+        self.max_tokens = 1
+
+        names = [" ".join(str(name).split()) for name in names]
+        for name in names:
+            self._add(name, name)
+
+        known = {name.lower(): name for name in names}
+        for canonical, variants in (DISTRICT_ALIASES if aliases is None else aliases).items():
+            target = known.get(" ".join(str(canonical).split()).lower())
+            if target is None:
+                continue
+            for variant in variants:
+                self._add(variant, target)
+
+        if max_edits > 0:
+            for key in self._index:
+                if len(key) >= min_fuzzy_length:
+                    for variant in _deletions(key, max_edits):
+                        self._deletion_index.setdefault(variant, set()).add(key)
+
+    def _add(self, text: str, canonical: str) -> None:
+        tokens = [token for token, _, _ in tokenize(text)]
+        if not tokens:
+            return
+        # Keys drop spaces so "Banas Kantha" and "Banaskantha" share an entry.
+        self._index.setdefault(''.join(tokens), canonical)
+        self.max_tokens = max(self.max_tokens, len(tokens))
+
+    def _fuzzy_lookup(self, key: str) -> Optional[Tuple[str, int]]:
+        best = None
+        for variant in _deletions(key, self.max_edits):
+            for candidate in self._deletion_index.get(variant, ()):
+                distance = bounded_edit_distance(key, candidate, self.max_edits)
+                if distance <= self.max_edits and (best is None or distance < best[1]):
+                    best = (self._index[candidate], distance)
+        return best
+
+    @timed('district.match')
+    def find_all(self, text: str, fuzzy: Optional[bool] = None) -> List[DistrictMatch]:
+        """Returns each distinct district mentioned in text, in order of appearance.
+
+        Args:
+            text: Free text such as a chat prompt
+            fuzzy: Override whether fuzzy matching is used (default: max_edits > 0)
+        """
+        use_fuzzy = (self.max_edits > 0) if fuzzy is None else (fuzzy and self.max_edits > 0)
+        tokens = tokenize(text)
+        matches: List[DistrictMatch] = []
+        seen: Set[str] = set()
+
+        i = 0
+        while i < len(tokens):
+            # Longest span first, so "Gir Somnath" wins over the "Somnath" alias.
+            widths = range(min(self.max_tokens, len(tokens) - i), 0, -1)
+            keys = [(width, ''.join(token for token, _, _ in tokens[i:i + width])) for width in widths]
+            found = next(((self._index[key], width, 0) for width, key in keys if key in self._index), None)
+            if found is None and use_fuzzy:
+                for width, key in keys:
+                    if len(key) >= self.min_fuzzy_length:
+                        fuzzy_hit = self._fuzzy_lookup(key)
+                        if fuzzy_hit is not None:
+                            found = (fuzzy_hit[0], width, fuzzy_hit[1])
+                            break
+
+            if found is None:
+                i += 1
+                continue
+
+            name, width, distance = found
+            start, end = tokens[i][1], tokens[i + width - 1][2]
+            if name not in seen:
+                seen.add(name)
+                matches.append(DistrictMatch(name, start, end, str(text)[start:end], distance))
+            i += width
+
+        return matches
+
+    def find(self, text: str, fuzzy: Optional[bool] = None) -> Optional[str]:
+        """Returns the first district mentioned in text, if any."""
+        matches = self.find_all(text, fuzzy=fuzzy)
+        return matches[0].name if matches else None
+
+
+_lock = threading.Lock()
+_matchers: "OrderedDict[tuple, DistrictMatcher]" = OrderedDict()
+
+
+def get_district_matcher(df: pd.DataFrame, max_edits: int = 1, query=None) -> DistrictMatcher:
+    """Returns a matcher over the dataset's district names, built once per dataset version.
+
+    query (a dataset_query.DatasetQuery) supplies the names when df is a sample.
+    """
+    key = (dataset_version(df) or id(df), len(df), max_edits, query is not None)
+    with _lock:
+        matcher = _matchers.get(key)
+        if matcher is not None:
+            _matchers.move_to_end(key)
+            return matcher
+
+    matcher = DistrictMatcher(get_district_index(df, query=query).names, max_edits=max_edits)
+    with _lock:
+        _matchers[key] = matcher
+        while len(_matchers) > MAX_CACHED_MATCHERS:
+            _matchers.popitem(last=False)
+    return matcher
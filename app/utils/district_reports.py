@@ -0,0 +1,252 @@
+"""
+Bulk PDF reports, one per district, for a monitoring cycle.
+
+Report content comes from the precomputed district index (statistics and
+category shares), so the dataset is scanned once per run, not once per
+district. Analyses can be left out, taken only from the LLM response cache,
+or generated (and cached) through the shared client. PDFs are rendered in a
+process pool and listed in a manifest.json next to them.
+
+Run ``python -m app.utils.district_reports --help`` for the command line.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from app.utils.context_builder import build_district_context, render_shares, stats_from_describe
+from app.utils.data_loader import dataset_version
+from app.utils.district_index import DistrictEntry, get_district_index
+from app.utils.district_matcher import get_district_matcher
+from app.utils.llm_cache import get_response_cache
+from app.utils.llm_client import LLMError, get_client, generate_text
+from app.utils.report_generator import generate_pdf
+
+ANALYSIS_NONE = 'none'
+ANALYSIS_CACHED = 'cached'
+ANALYSIS_GENERATE = 'generate'
+
+ANALYSIS_THREADS = 8
+
+ANALYSIS_QUESTION = "Summarize groundwater quality, main risks and recommended actions for this district."
+
+ANALYSIS_PROMPT = """You are a groundwater quality expert. Using the district data below, write a short
+assessment for a monitoring report: overall water quality, parameters of concern and
+recommended actions.
+
+{context}"""
+
+
+def default_cycle() -> str:
+    return datetime.now().strftime('%Y-%m')
+
+
+def report_filename(district: str, cycle: str) -> str:
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', district).strip('_') or 'district'
+    return f"{slug}_{cycle}.pdf"
+
+
+def analysis_prompt(df: pd.DataFrame, entry: DistrictEntry) -> str:
+    context = build_district_context(df, [entry], ANALYSIS_QUESTION)
+    return ANALYSIS_PROMPT.format(context=context.text)
+
+
+def district_report_sections(
+    entry: DistrictEntry,
+    cycle: str,
+    analysis: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """generate_pdf sections for one district, built from its index entry."""
+    stats = stats_from_describe(entry.summary)
+    lines = [
+        f"{column}: mean {row['mean']:.2f}, median {row['50%']:.2f}, range {row['min']:.2f} - {row['max']:.2f}"
+        for column, row in stats.iterrows()
+    ]
+    sections = [
+        {
+            'title': 'Overview',
+            'content': f"District: {entry.name}\nMonitoring cycle: {cycle}\nSamples: {entry.sample_count:,}",
+        },
+        {'title': 'Parameter Statistics', 'content': "\n".join(lines) or "No numeric measurements."},
+    ]
+    if entry.categories:
+        sections.append({'title': 'Category Shares', 'content': render_shares(entry.categories)})
+    if analysis and analysis.strip():
+        sections.append({'title': 'Analysis', 'content': analysis.strip()})
+    return sections
+
+
+def _render_report(task: Tuple[str, str, List[Dict[str, str]]]) -> Dict[str, Any]:
+    path, title, sections = task
+    start = time.perf_counter()
+    try:
+        generate_pdf(sections, title=title, output_path=path)
+    except Exception as e:
+        return {'path': path, 'error': str(e)}
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'sha256': digest,
+        'render_seconds': time.perf_counter() - start,
+    }
+
+
+def _analyses(df: pd.DataFrame, entries: Sequence[DistrictEntry], mode: str) -> Dict[str, Optional[str]]:
+    if mode == ANALYSIS_NONE:
+        return {}
+    version = dataset_version(df)
+    client = get_client()
+    prompts = {entry.name: analysis_prompt(df, entry) for entry in entries}
+    if mode == ANALYSIS_CACHED:
+        cache = get_response_cache()
+        return {name: cache.get(client.model_name, version, prompt) for name, prompt in prompts.items()}
+
+    # The client's rate limiter paces the calls; cached prompts return at once.
+    analyses = {}
+    with ThreadPoolExecutor(max_workers=ANALYSIS_THREADS, thread_name_prefix='analysis') as executor:
+        futures = {
+            name: executor.submit(generate_text, prompt, version, client)
+            for name, prompt in prompts.items()
+        }
+        for name, future in futures.items():
+            try:
+                analyses[name] = future.result()
+            except LLMError:
+                analyses[name] = None
+    return analyses
+
+
+def generate_district_reports(
+    df: pd.DataFrame,
+    output_dir: str,
+    districts: Optional[Sequence[str]] = None,
+    cycle: Optional[str] = None,
+    analysis: str = ANALYSIS_NONE,
+    max_workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """Writes one PDF per district plus manifest.json into output_dir.
+
+    Args:
+        df: Dataset returned by data_loader.load_dataset
+        output_dir: Directory for the reports and manifest
+        districts: District names to include, matched like chat questions (default: all)
+        cycle: Monitoring cycle label used in titles and file names (default: current YYYY-MM)
+        analysis: 'none', 'cached' (only analyses already in the LLM response cache)
+            or 'generate' (call the LLM for missing ones)
+        max_workers: Rendering processes (default: CPU count)
+
+    Returns:
+        The manifest: run details, one record per report, unknown district
+        names and failures, elapsed time and reports per second
+    """
+    start = time.perf_counter()
+    cycle = cycle or default_cycle()
+    index = get_district_index(df)
+    unknown = []
+    if districts:
+        matcher = get_district_matcher(df)
+        entries = []
+        for name in districts:
+            match = matcher.find(name)
+            entry = index.get(match) if match else None
+            if entry is None:
+                unknown.append(name)
+            elif all(entry.name != e.name for e in entries):
+                entries.append(entry)
+    else:
+        entries = [index.get(name) for name in index.names]
+
+    analyses = _analyses(df, entries, analysis)
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [
+        (
+            os.path.join(output_dir, report_filename(entry.name, cycle)),
+            f"Groundwater Quality Report - {entry.name} ({cycle})",
+            district_report_sections(entry, cycle, analyses.get(entry.name)),
+        )
+        for entry in entries
+    ]
+
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(tasks) or 1))
+    if workers == 1:
+        results = [_render_report(task) for task in tasks]
+    else:
+        # spawn, as in model_comparison: the LLM client's threads may hold locks a forked child would inherit.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = list(executor.map(_render_report, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+    reports, failures = [], []
+    for entry, result in zip(entries, results):
+        if 'error' in result:
+            failures.append({'district': entry.name, 'error': result['error']})
+            continue
+        reports.append({
+            'district': entry.name,
+            'file': os.path.basename(result['path']),
+            'samples': entry.sample_count,
+            'analysis': bool(analyses.get(entry.name)),
+            'bytes': result['bytes'],
+            'sha256': result['sha256'],
+        })
+
+    elapsed = time.perf_counter() - start
+    manifest = {
+        'cycle': cycle,
+        'dataset_version': dataset_version(df),
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'analysis_mode': analysis,
+        'workers': workers,
+        'reports': reports,
+        'unknown_districts': unknown,
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 3),
+        'reports_per_second': round(len(reports) / elapsed, 2) if elapsed else None,
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    from app.utils.data_loader import load_dataset
+
+    parser = argparse.ArgumentParser(description="Write a PDF report per district for a monitoring cycle.")
+    parser.add_argument('--output', default=None, help="Output directory (default: reports/<cycle>)")
+    parser.add_argument('--cycle', default=None, help="Monitoring cycle label (default: current YYYY-MM)")
+    parser.add_argument('--district', action='append', dest='districts', help="Only this district (repeatable)")
+    parser.add_argument(
+        '--analysis', choices=[ANALYSIS_NONE, ANALYSIS_CACHED, ANALYSIS_GENERATE], default=ANALYSIS_NONE,
+        help="Leave analyses out, use only cached ones, or generate missing ones with the LLM"
+    )
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    run_cycle = args.cycle or default_cycle()
+    result = generate_district_reports(
+        load_dataset(),
+        args.output or os.path.join('reports', run_cycle),
+        districts=args.districts,
+        cycle=run_cycle,
+        analysis=args.analysis,
+        max_workers=args.workers,
+    )
+    print(
+        f"{len(result['reports'])} reports for cycle {result['cycle']} in {result['elapsed_seconds']:.2f}s "
+        f"({result['reports_per_second']} reports/s, {result['workers']} workers, "
+        f"{sum(r['analysis'] for r in result['reports'])} with analysis)"
+    )
+    for name in result['unknown_districts']:
+        print(f"Unknown district: {name}")
+    for failure in result['failures']:
+        print(f"Failed: {failure['district']}: {failure['error']}")
@@ -0,0 +1,303 @@
+"""
+Flat-array inference for trained random forests.
+
+A fitted forest and the StandardScaler in front of it are exported once into
+contiguous NumPy arrays (one node table for all trees). The scaler is folded
+into the split thresholds, so raw feature values are compared directly, and
+all trees are walked together with a few vectorized gathers per level. This
+skips sklearn's input validation, scaling and per-tree dispatch, which
+dominate the cost of predicting one row; large batches still go to sklearn,
+whose compiled traversal is faster once that overhead is amortized.
+
+Thresholds are folded exactly for the float32 arithmetic sklearn uses, and
+leaf values are summed in tree order, so predictions match
+RandomForestRegressor.predict bit for bit.
+
+Run ``python -m app.utils.forest_engine`` for a latency benchmark.
+"""
+import argparse
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+DEFAULT_CHUNK_ROWS = 4096
+# Above this many rows sklearn's compiled traversal is faster than the NumPy walk.
+FLAT_MAX_ROWS = 128
+
+_compiled: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_compiled_lock = threading.Lock()
+
+
+def supports(model) -> bool:
+    return (
+        isinstance(model, (RandomForestRegressor, ExtraTreesRegressor))
+        and hasattr(model, 'estimators_')
+        and model.n_outputs_ == 1
+    )
+
+
+def _scaled(x: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    # Same float32 operations as StandardScaler.transform on float32 input.
+    return (x - mean) / scale
+
+
+def fold_thresholds(
+    threshold: np.ndarray,
+    feature: np.ndarray,
+    mean: np.ndarray,
+    scale: np.ndarray
+) -> np.ndarray:
+    """Largest float32 raw value per node whose scaled value still goes left.
+
+    For raw float32 x, ``x <= folded`` holds exactly when
+    ``scaled(x) <= threshold``, because float32 scaling is monotonic.
+    """
+    m = mean[feature]
+    s = scale[feature]
+    with np.errstate(over='ignore', invalid='ignore'):
+        folded = (threshold * s.astype(np.float64) + m.astype(np.float64)).astype(np.float32)
+        for _ in range(64):
+            up = np.nextafter(folded, np.float32(np.inf))
+            step_up = np.isfinite(up) & (_scaled(up, m, s) <= threshold)
+            step_down = _scaled(folded, m, s) > threshold
+            if not step_up.any() and not step_down.any():
+                break
+            folded = np.where(step_up, up, np.where(step_down, np.nextafter(folded, np.float32(-np.inf)), folded))
+    return folded
+
+
+class FlatForest:
+    """A regression forest flattened into one node table.
+
+    Each node is one int32 record (feature, threshold bits, right, left), so a
+    step of the walk is a single gather. Leaves point to themselves.
+    """
+
+    def __init__(
+        self,
+        nodes: np.ndarray,
+        is_leaf: np.ndarray,
+        missing_left: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        depth: int,
+        n_features: int
+    ):
+        self.nodes = nodes
+        self.is_leaf = is_leaf
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.n_features = n_features
+
+    @classmethod
+    def from_sklearn(cls, model, scaler: Optional[StandardScaler] = None) -> 'FlatForest':
+        n_features = model.n_features_in_
+        mean = np.zeros(n_features, dtype=np.float32)
+        scale = np.ones(n_features, dtype=np.float32)
+        if scaler is not None:
+            if getattr(scaler, 'mean_', None) is not None and scaler.with_mean:
+                mean = scaler.mean_.astype(np.float32)
+            if getattr(scaler, 'scale_', None) is not None and scaler.with_std:
+                scale = scaler.scale_.astype(np.float32)
+
+        tables, leaves, missing, values, roots = [], [], [], [], []
+        offset = 0
+        depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            ids = np.arange(offset, offset + n, dtype=np.int32)
+            leaf = tree.children_left < 0
+            feature = np.where(leaf, 0, tree.feature).astype(np.int32)
+            threshold = np.where(leaf, np.float32(np.inf), fold_thresholds(tree.threshold, feature, mean, scale))
+
+            table = np.empty((n, 4), dtype=np.int32)
+            table[:, 0] = feature
+            table[:, 1] = threshold.astype(np.float32).view(np.int32)
+            # Columns 2 and 3 are the children taken when the row goes right and left.
+            table[:, 2] = np.where(leaf, ids, tree.children_right + offset)
+            table[:, 3] = np.where(leaf, ids, tree.children_left + offset)
+
+            tables.append(table)
+            leaves.append(leaf)
+            missing.append(np.asarray(getattr(tree, 'missing_go_to_left', np.zeros(n)), dtype=bool))
+            values.append(tree.value[:, 0, 0].astype(np.float64))
+            roots.append(offset)
+            depth = max(depth, tree.max_depth)
+            offset += n
+
+        return cls(
+            nodes=np.ascontiguousarray(np.concatenate(tables)),
+            is_leaf=np.concatenate(leaves),
+            missing_left=np.concatenate(missing),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            depth=depth,
+            n_features=n_features,
+        )
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.nodes, self.is_leaf, self.missing_left, self.value, self.roots))
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """Leaf node ids, shape (rows, trees), for a raw float32 feature matrix."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_trees = len(X), self.n_trees
+        has_missing = bool(np.isnan(X).any())
+        flat_x = X.ravel()
+        out = np.empty(n_rows * n_trees, dtype=np.int32)
+
+        # Active (row, tree) walks, tree-major so each tree's nodes stay in cache.
+        slot = np.arange(n_rows * n_trees, dtype=np.int64)
+        row_offset = np.tile(np.arange(n_rows, dtype=np.int64) * X.shape[1], n_trees)
+        node = np.repeat(self.roots, n_rows)
+        while len(node):
+            record = self.nodes[node]
+            x = flat_x[row_offset + record[:, 0]]
+            go_left = x <= record[:, 1].view(np.float32)
+            if has_missing:
+                go_left |= np.isnan(x) & self.missing_left[node]
+            node = np.where(go_left, record[:, 3], record[:, 2])
+            done = self.is_leaf[node]
+            if done.any():
+                out[slot[done]] = node[done]
+                active = ~done
+                slot, node, row_offset = slot[active], node[active], row_offset[active]
+        return out.reshape(n_trees, n_rows).T
+
+    def predict(self, X: np.ndarray, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> np.ndarray:
+        """Predictions for a raw (unscaled) float32 feature matrix."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), chunk_rows):
+            leaf_values = self.value[self.leaves(X[start:start + chunk_rows])]
+            # Sequential sum in tree order, as RandomForestRegressor accumulates it.
+            out[start:start + len(leaf_values)] = np.cumsum(leaf_values, axis=1)[:, -1] / self.n_trees
+        return out
+
+
+def compile_forest(model, scaler: Optional[StandardScaler] = None) -> FlatForest:
+    """Returns the flat form of a fitted forest, compiling it once per model object."""
+    with _compiled_lock:
+        entry = _compiled.get(model)
+        if entry is not None and entry[0] is scaler and entry[1].n_trees == len(model.estimators_):
+            return entry[1]
+    forest = FlatForest.from_sklearn(model, scaler)
+    with _compiled_lock:
+        _compiled[model] = (scaler, forest)
+    return forest
+
+
+def predict_features(model, scaler: StandardScaler, X: np.ndarray) -> np.ndarray:
+    """Predicts from a raw float32 feature matrix.
+
+    Small inputs to a supported forest use the flat engine; larger ones go to
+    sklearn, whose compiled traversal wins once per-call overhead is amortized
+    (see benchmark).
+    """
+    if supports(model) and len(X) <= FLAT_MAX_ROWS:
+        return compile_forest(model, scaler).predict(X)
+    return model.predict(scaler.transform(X))
+
+
+def _best_time(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def benchmark(
+    model,
+    scaler: StandardScaler,
+    X: np.ndarray,
+    sizes: Sequence[int] = (1, 8, 32, 128, 512, 4096),
+    repeats: int = 20
+) -> Dict[str, Any]:
+    """Compares sklearn and the flat engine on batches of increasing size.
+
+    Args:
+        model: Fitted forest
+        scaler: Scaler the forest was trained behind
+        X: Raw float32 feature matrix; batches are taken from (and cycle over) its rows
+        sizes: Batch sizes to time
+        repeats: Calls per batch size; the fastest is kept
+
+    Returns:
+        Engine facts, agreement with sklearn over X, and per batch size the
+        latency of both implementations
+    """
+    t = time.perf_counter()
+    forest = FlatForest.from_sklearn(model, scaler)
+    compile_ms = (time.perf_counter() - t) * 1000
+
+    reference = model.predict(scaler.transform(X))
+    flat = forest.predict(X)
+
+    timings = []
+    for size in sizes:
+        batch = X[np.arange(size) % len(X)]
+        calls = max(1, repeats if size <= 512 else repeats // 10)
+        sklearn_s = _best_time(lambda: model.predict(scaler.transform(batch)), calls)
+        flat_s = _best_time(lambda: forest.predict(batch), calls)
+        timings.append({
+            'rows': size,
+            'sklearn_ms': sklearn_s * 1000,
+            'flat_ms': flat_s * 1000,
+            'speedup': sklearn_s / flat_s,
+        })
+    return {
+        'trees': forest.n_trees,
+        'nodes': forest.n_nodes,
+        'max_depth': forest.depth,
+        'engine_mb': forest.nbytes / 1e6,
+        'compile_ms': compile_ms,
+        'rows_checked': len(X),
+        'max_abs_diff': float(np.max(np.abs(reference - flat))) if len(X) else 0.0,
+        'identical': bool(np.array_equal(reference, flat)),
+        'timings': timings,
+    }
+
+
+if __name__ == '__main__':
+    from app.utils.data_loader import load_dataset
+    from app.utils.ml_models import leakage_columns, preprocess_data, train_model
+
+    parser = argparse.ArgumentParser(description="Compare sklearn and flat-array forest prediction latency.")
+    parser.add_argument('--target', default='PH')
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=20, help="Calls per batch size")
+    args = parser.parse_args()
+
+    df = load_dataset()
+    X, y, _, feature_columns = preprocess_data(df, args.target, leakage_columns(args.target))
+    model, scaler, _ = train_model(X, y, feature_columns, n_estimators=args.trees)
+    result = benchmark(model, scaler, X, repeats=args.repeats)
+    for name, value in result.items():
+        if name != 'timings':
+            print(f"{name:>14}: {value:,.3f}" if isinstance(value, float) else f"{name:>14}: {value}")
+    print(f"\n{'rows':>6} {'sklearn ms':>11} {'flat ms':>9} {'speedup':>8}")
+    for row in result['timings']:
+        print(f"{row['rows']:>6} {row['sklearn_ms']:>11.2f} {row['flat_ms']:>9.2f} {row['speedup']:>7.1f}x")
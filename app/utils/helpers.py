@@ -1,26 +1,68 @@
 import pandas as pd
+from typing import Optional
 
-def get_data_summary(df: pd.DataFrame) -> str:
+from app.utils.dataset_aggregates import stored_aggregates
+from app.utils.instrumentation import timed
+
+def find_district_column(df: pd.DataFrame) -> Optional[str]:
+    return next((col for col in df.columns if 'district' in str(col).lower() or 'location' in str(col).lower()), None)
+
+def normalize_district(name) -> str:
+    return " ".join(str(name).split()).lower()
+
+@timed('data.summary')
+def get_data_summary(df: pd.DataFrame, query=None) -> str:
+    """Short dataset overview for prompts.
+
+    query (a dataset_query.DatasetQuery) answers the counts when df holds
+    only a sample of the dataset.
+    """
+    if query is not None:
+        return _query_summary(query)
     state_col = next((col for col in df.columns if 'state' in str(col).lower() or 'stn_name' in str(col).lower()), None)
-    district_col = next((col for col in df.columns if 'district' in str(col).lower() or 'location' in str(col).lower()), None)
+    district_col = find_district_column(df)
     year_col = next((col for col in df.columns if any(x in str(col).lower() for x in ['year', 'date', 'yr'])), None)
     
+    aggregates = stored_aggregates(df)
+    # Ingested datasets store their canonical district names, so the column is not rescanned.
+    stored_districts = aggregates is not None and district_col is not None and district_col == aggregates.district_col
+    
     states = df[state_col].astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.title() if state_col is not None else pd.Series()
-    districts = df[district_col].astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.title() if district_col is not None else pd.Series()
+    districts = df[district_col].astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.title() if district_col is not None and not stored_districts else pd.Series()
     years = pd.to_numeric(df[year_col], errors='coerce') if year_col is not None else pd.Series()
     
     num_states = states.nunique() if not states.empty else 0
-    num_districts = districts.nunique() if not districts.empty else 0
+    num_districts = len(aggregates.districts) if stored_districts else (districts.nunique() if not districts.empty else 0)
     year_min = int(years.min()) if not years.empty and not pd.isna(years.min()) else 'N/A'
     year_max = int(years.max()) if not years.empty and not pd.isna(years.max()) else 'N/A'
     
-    return f"""
-    Loaded groundwater quality dataset with {len(df)} samples.
-    Columns: {', '.join(df.columns.tolist())}
-    Number of states: {num_states}
-    Number of districts: {num_districts}
-    Year range: {year_min} - {year_max}
-    
-    First few rows of data:
-    {df.head(3).to_string()}
-    """
+    # Row-level detail is left to context_builder, which adds compact aggregates within a token budget.
+    return "\n".join([
+        f"Loaded groundwater quality dataset with {len(df)} samples.",
+        f"Columns: {', '.join(map(str, df.columns))}",
+        f"Number of states: {num_states}",
+        f"Number of districts: {num_districts}",
+        f"Year range: {year_min} - {year_max}",
+    ])
+
+def _query_summary(query) -> str:
+    state_col = next((col for col in query.columns if 'state' in col.lower() or 'stn_name' in col.lower()), None)
+    year_col = next((col for col in query.numeric_columns if any(x in col.lower() for x in ['year', 'date', 'yr'])), None)
+
+    def distinct(col: Optional[str]) -> int:
+        if col is None:
+            return 0
+        names = query.value_counts(col).index.astype(str).str.strip().str.replace(r"\s+", " ", regex=True).str.title()
+        return names.nunique()
+
+    years = query.describe([year_col]) if year_col is not None else None
+    year_min = int(years.at['min', year_col]) if years is not None and not pd.isna(years.at['min', year_col]) else 'N/A'
+    year_max = int(years.at['max', year_col]) if years is not None and not pd.isna(years.at['max', year_col]) else 'N/A'
+
+    return "\n".join([
+        f"Loaded groundwater quality dataset with {query.count()} samples.",
+        f"Columns: {', '.join(query.columns)}",
+        f"Number of states: {distinct(state_col)}",
+        f"Number of districts: {distinct(query.district_col)}",
+        f"Year range: {year_min} - {year_max}",
+    ])
@@ -0,0 +1,561 @@
+"""
+Streaming ingestion of groundwater CSV extracts into partitioned Parquet.
+
+Source files are read in fixed-size chunks, so memory does not depend on
+their size. Each chunk gets normalized headers (known columns map to the
+dataset's names whatever their spacing, case or units punctuation) and
+district names (aliases such as "Baroda" resolve to "Vadodara"), and known
+measurements are parsed to float32, so the same sample spelled differently
+in two files is recognized as a duplicate.
+
+De-duplication across files runs in two passes. The first spills each
+normalized row to one of several bucket files chosen by its row hash; the
+second loads one bucket at a time, drops repeated rows and writes the
+survivors into ``<output>/District=<name>/`` Parquet partitions. Identical
+rows always share a bucket, and the bucket count grows with the input, so
+peak memory stays near a chunk plus a bucket. The sorted hashes of the
+stored rows and running aggregates (see dataset_aggregates) are kept next to
+the data, so append() can add new sample batches without rereading it.
+
+Run ``python -m app.utils.ingestion --help`` for the command line.
+"""
+import argparse
+import codecs
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from app.utils.data_loader import CATEGORICAL_COLUMNS, DATASET_MANIFEST, FLOAT_COLUMNS
+from app.utils.dataset_aggregates import DatasetAggregates
+from app.utils.district_matcher import DISTRICT_ALIASES
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported
+    resource = None
+
+if TYPE_CHECKING:
+    from app.utils.model_registry import ModelRegistry
+
+PARTITION_COLUMN = 'District'
+DEFAULT_CHUNK_ROWS = 100_000
+# Input bytes per de-duplication bucket; a bucket is held in memory in the second pass.
+DEFAULT_BUCKET_BYTES = 64 << 20
+MAX_BUCKETS = 1024
+# Sorted row hashes of the stored rows, one .npy segment per bucket or append,
+# so an append can skip rows the dataset already holds without reading it.
+HASH_DIR = '_row_hashes'
+ENCODING_SAMPLE_BYTES = 1 << 20
+
+HEADER_ALIASES = {
+    'district_name': 'District',
+    'dist': 'District',
+    'ph_value': 'PH',
+    'tds': 'TDS_mg_L',
+    'ec_level': 'TDS/EC_Level',
+}
+
+
+def _header_key(name: str) -> str:
+    return re.sub(r'[^a-z0-9]', '', str(name).lower())
+
+
+_CANONICAL_HEADERS = {
+    _header_key(name): name for name in CATEGORICAL_COLUMNS + FLOAT_COLUMNS
+}
+_CANONICAL_HEADERS.update({_header_key(alias): name for alias, name in HEADER_ALIASES.items()})
+
+_CANONICAL_DISTRICTS = {
+    _header_key(variant): canonical
+    for canonical, variants in DISTRICT_ALIASES.items()
+    for variant in [canonical, *variants]
+}
+
+
+def detect_encoding(path: str, sample_bytes: int = ENCODING_SAMPLE_BYTES) -> str:
+    """Guesses a text file's encoding from a leading sample.
+
+    A byte-order mark wins; otherwise UTF-8 is used if the sample decodes,
+    then cp1252, and latin-1 (which accepts any byte) as the last resort.
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # A multi-byte character may be cut at the end of a truncated sample.
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=len(sample) < sample_bytes)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def normalize_header(name: Any) -> str:
+    """Dataset column name for a source header ('  tds (mg/L)\\n' -> 'TDS_mg_L')."""
+    text = " ".join(str(name).replace('\ufeff', '').split())
+    return _CANONICAL_HEADERS.get(_header_key(text), text.replace(' ', '_'))
+
+
+def normalize_headers(columns: Sequence[Any]) -> List[str]:
+    """normalize_header for every column; repeated results get _2, _3, ... suffixes."""
+    names, seen = [], {}
+    for column in columns:
+        name = normalize_header(column)
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return names
+
+
+def normalize_text(value: Any) -> Optional[str]:
+    """Whitespace-collapsed text, or None when nothing is left."""
+    text = " ".join(str(value).split())
+    return text or None
+
+
+def canonical_district(name: Any) -> Optional[str]:
+    """Dataset spelling of a district name; unknown names are title-cased."""
+    text = normalize_text(name)
+    if text is None:
+        return None
+    return _CANONICAL_DISTRICTS.get(_header_key(text), text.title())
+
+
+def _map_distinct(values: pd.Series, fn: Callable[[Any], Optional[str]]) -> pd.Series:
+    # Text columns repeat a few values (statuses, districts), so each distinct one is normalized once.
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([fn(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(mapped[codes], index=values.index, dtype=object)
+
+
+def output_schema(columns: Sequence[str]) -> pa.Schema:
+    """float32 for known measurements, strings for everything else."""
+    return pa.schema([
+        pa.field(col, pa.float32() if col in FLOAT_COLUMNS else pa.string())
+        for col in columns
+    ])
+
+
+def read_source_columns(path: str, encoding: str) -> List[str]:
+    return normalize_headers(pd.read_csv(path, nrows=0, encoding=encoding, encoding_errors='replace').columns)
+
+
+def iter_normalized_chunks(
+    path: str,
+    columns: Sequence[str],
+    encoding: str,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS
+) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """(rows read, normalized chunk) pairs for one source.
+
+    Chunks are reindexed to the union of all sources' columns. Text is
+    whitespace-collapsed with empty strings as missing, districts are
+    canonical, known measurements are float32, and all-empty rows are dropped.
+    """
+    reader = pd.read_csv(path, dtype=str, chunksize=chunk_rows, encoding=encoding, encoding_errors='replace')
+    for chunk in reader:
+        chunk.columns = normalize_headers(chunk.columns)
+        out = {}
+        for col in columns:
+            if col not in chunk.columns:
+                out[col] = pd.Series(np.nan, index=chunk.index, dtype='float32' if col in FLOAT_COLUMNS else object)
+                continue
+            if col in FLOAT_COLUMNS:
+                out[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float32')
+            else:
+                out[col] = _map_distinct(chunk[col], canonical_district if col == PARTITION_COLUMN else normalize_text)
+        frame = pd.DataFrame(out, index=chunk.index)
+        yield len(chunk), frame[frame.notna().any(axis=1)]
+
+
+def row_hashes(frame: pd.DataFrame) -> np.ndarray:
+    """64-bit hash per row of normalized values (equal rows hash equal across files)."""
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+
+
+def _bucket_count(paths: Sequence[str], bucket_bytes: int) -> int:
+    total = sum(os.path.getsize(p) for p in paths)
+    return int(min(MAX_BUCKETS, max(1, -(-total // max(bucket_bytes, 1)))))
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def ingest(
+    sources: Sequence[str],
+    output_dir: str,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    encoding: Optional[str] = None,
+    bucket_bytes: int = DEFAULT_BUCKET_BYTES,
+    overwrite: bool = False
+) -> Dict[str, Any]:
+    """Merges CSV extracts into a de-duplicated, district-partitioned Parquet dataset.
+
+    Args:
+        sources: CSV files; their columns are unioned
+        output_dir: Dataset directory (readable by data_loader.load_dataset)
+        chunk_rows: Rows per read chunk
+        encoding: Source encoding (default: detected per file)
+        bucket_bytes: Input bytes per de-duplication bucket
+        overwrite: Replace an existing dataset in output_dir (only a directory
+            holding a dataset manifest is replaced)
+
+    Returns:
+        The manifest written to output_dir: columns, per-source row counts,
+        duplicates dropped, a content hash, elapsed time and peak memory (None on Windows)
+
+    Raises:
+        FileExistsError: output_dir is not empty and overwrite is False, or it
+            is not a dataset directory
+        ValueError: A source lies inside output_dir
+    """
+    start = time.perf_counter()
+    target = os.path.realpath(output_dir)
+    for path in sources:
+        source = os.path.realpath(path)
+        if os.path.commonpath([source, target]) == target:
+            raise ValueError(f"{path} is inside {output_dir}; write the dataset somewhere else")
+    if os.path.isdir(output_dir) and os.listdir(output_dir):
+        if not overwrite:
+            raise FileExistsError(f"{output_dir} is not empty; pass overwrite=True to replace it")
+        # Only a directory an earlier ingest wrote is ever deleted.
+        if not os.path.isfile(os.path.join(output_dir, DATASET_MANIFEST)):
+            raise FileExistsError(f"{output_dir} has no {DATASET_MANIFEST}; refusing to replace a non-dataset directory")
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    encodings = {path: encoding or detect_encoding(path) for path in sources}
+    columns: List[str] = []
+    for path in sources:
+        for col in read_source_columns(path, encodings[path]):
+            if col not in columns:
+                columns.append(col)
+    schema = output_schema(columns)
+    spill_schema = schema.append(pa.field('_row_hash', pa.uint64()))
+    n_buckets = _bucket_count(sources, bucket_bytes)
+
+    source_stats = []
+    aggregates = DatasetAggregates(PARTITION_COLUMN)
+    spill_dir = tempfile.mkdtemp(prefix='.ingest-', dir=output_dir)
+    try:
+        writers: Dict[int, pq.ParquetWriter] = {}
+        try:
+            for path in sources:
+                rows_read = rows_kept = 0
+                for chunk_read, frame in iter_normalized_chunks(path, columns, encodings[path], chunk_rows):
+                    rows_read += chunk_read
+                    rows_kept += len(frame)
+                    hashes = row_hashes(frame)
+                    buckets = (hashes % np.uint64(n_buckets)).astype(np.int64)
+                    # One sort per chunk, then each bucket's rows are a contiguous slice.
+                    order = np.argsort(buckets, kind='stable')
+                    table = pa.Table.from_pandas(
+                        frame.assign(_row_hash=hashes).iloc[order], schema=spill_schema, preserve_index=False
+                    )
+                    sorted_buckets = buckets[order]
+                    present = np.unique(sorted_buckets)
+                    bounds = np.searchsorted(sorted_buckets, present, side='left').tolist() + [len(order)]
+                    for bucket, lo, hi in zip(present.tolist(), bounds[:-1], bounds[1:]):
+                        writer = writers.get(bucket)
+                        if writer is None:
+                            writer = writers[bucket] = pq.ParquetWriter(
+                                os.path.join(spill_dir, f"bucket-{bucket:04d}.parquet"), spill_schema
+                            )
+                        writer.write_table(table.slice(lo, hi - lo))
+                source_stats.append({
+                    'path': os.path.abspath(path),
+                    'encoding': encodings[path],
+                    'rows': rows_read,
+                    'non_empty_rows': rows_kept,
+                })
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        rows_written = 0
+        content_hash = np.uint64(0)
+        for bucket in sorted(writers):
+            # Rows stay in Arrow; only the hash column is needed to find repeats.
+            table = pq.read_table(os.path.join(spill_dir, f"bucket-{bucket:04d}.parquet"))
+            hashes = table.column('_row_hash').to_numpy()
+            first = ~pd.Series(hashes).duplicated().to_numpy()
+            # Order-independent digest of the surviving rows, used as the dataset version.
+            content_hash = np.add(content_hash, hashes[first].sum(dtype=np.uint64), dtype=np.uint64)
+            rows_written += int(first.sum())
+            # The spill file holds one small record batch per chunk; combined, the output
+            # files get whole row groups and the aggregates see a few large batches.
+            table = table.filter(pa.array(first)).drop_columns(['_row_hash']).combine_chunks()
+            _write_partitioned(table, output_dir, f"part-{bucket:04d}")
+            _write_hash_segment(output_dir, f"part-{bucket:04d}", hashes[first])
+            for batch in table.to_batches(max_chunksize=chunk_rows):
+                aggregates.update(batch.to_pandas())
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    total_kept = sum(s['non_empty_rows'] for s in source_stats)
+    aggregates.version = _content_version(content_hash, rows_written)
+    aggregates.save(output_dir)
+    elapsed = time.perf_counter() - start
+    manifest = {
+        'format': 'parquet',
+        'partitioning': [PARTITION_COLUMN] if PARTITION_COLUMN in columns else [],
+        'columns': columns,
+        'sources': source_stats,
+        'rows': rows_written,
+        'duplicates_dropped': total_kept - rows_written,
+        'content_hash': aggregates.version,
+        'chunk_rows': chunk_rows,
+        'buckets': n_buckets,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'elapsed_seconds': round(elapsed, 3),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    _write_manifest(output_dir, manifest)
+    return manifest
+
+
+def append(
+    sources: Sequence[str],
+    dataset_dir: str,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    encoding: Optional[str] = None,
+    registry: Optional['ModelRegistry'] = None
+) -> Dict[str, Any]:
+    """Adds new sample batches to a dataset written by ingest.
+
+    The work is proportional to the new rows: they are normalized as in
+    ingest, rows the dataset already holds are skipped by looking up the
+    stored row hashes, and the stored aggregates are updated rather than
+    recomputed. New rows go to ``append-<n>-*.parquet`` files in the district
+    partitions. Models trained on earlier versions of the dataset are marked
+    stale (see ModelRegistry.mark_stale).
+
+    Args:
+        sources: CSV files with the new samples; their columns must already be in the dataset
+        dataset_dir: Directory written by ingest
+        chunk_rows: Rows per read chunk
+        encoding: Source encoding (default: detected per file)
+        registry: Registry whose models are marked stale (default: the process-wide one)
+
+    Returns:
+        The updated manifest; its last 'appends' entry describes this call
+        (sources, rows added, duplicates skipped, models marked stale)
+    """
+    start = time.perf_counter()
+    manifest_path = os.path.join(dataset_dir, DATASET_MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"{dataset_dir} has no {DATASET_MANIFEST}; create it with ingest first")
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    columns = manifest['columns']
+    encodings = {path: encoding or detect_encoding(path) for path in sources}
+    for path in sources:
+        extra = [col for col in read_source_columns(path, encodings[path]) if col not in columns]
+        if extra:
+            raise ValueError(f"{path} has columns the dataset lacks ({', '.join(extra)}); re-run ingest to add them")
+
+    previous = manifest['content_hash']
+    aggregates = DatasetAggregates.load(dataset_dir)
+    if aggregates is None or aggregates.version != previous or not os.path.isdir(os.path.join(dataset_dir, HASH_DIR)):
+        # Written by an older ingest: one full scan, after which appends are incremental.
+        aggregates = _rebuild_state(dataset_dir, columns, previous, chunk_rows)
+    stored = [
+        np.load(os.path.join(dataset_dir, HASH_DIR, name), mmap_mode='r')
+        for name in sorted(os.listdir(os.path.join(dataset_dir, HASH_DIR))) if name.endswith('.npy')
+    ]
+
+    appends = manifest.get('appends', [])
+    name = f"append-{len(appends) + 1:04d}"
+    schema = output_schema(columns)
+    added = np.empty(0, dtype=np.uint64)
+    source_stats = []
+    chunks = 0
+    # Files are staged in a dot-directory (skipped by Parquet dataset discovery) and moved in at the end.
+    staging = tempfile.mkdtemp(prefix='.append-', dir=dataset_dir)
+    try:
+        for path in sources:
+            rows_read = rows_kept = 0
+            for chunk_read, frame in iter_normalized_chunks(path, columns, encodings[path], chunk_rows):
+                rows_read += chunk_read
+                rows_kept += len(frame)
+                hashes = row_hashes(frame)
+                fresh = ~(pd.Series(hashes).duplicated().to_numpy() | _contains(stored, hashes) | np.isin(hashes, added))
+                if not fresh.any():
+                    continue
+                frame, hashes = frame[fresh], hashes[fresh]
+                _write_partitioned(
+                    pa.Table.from_pandas(frame, schema=schema, preserve_index=False),
+                    staging, f"{name}-{chunks:05d}"
+                )
+                chunks += 1
+                aggregates.update(frame)
+                added = np.union1d(added, hashes)
+            source_stats.append({
+                'path': os.path.abspath(path),
+                'encoding': encodings[path],
+                'rows': rows_read,
+                'non_empty_rows': rows_kept,
+            })
+        for root, _, files in os.walk(staging):
+            target_dir = os.path.join(dataset_dir, os.path.relpath(root, staging))
+            os.makedirs(target_dir, exist_ok=True)
+            for file_name in files:
+                os.replace(os.path.join(root, file_name), os.path.join(target_dir, file_name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    rows_added = len(added)
+    duplicates = sum(s['non_empty_rows'] for s in source_stats) - rows_added
+    # The content hash is a sum of row hashes, so it matches a fresh ingest of the same rows.
+    content_hash = (int(previous.split('-')[0], 16) + int(added.sum(dtype=np.uint64))) % (1 << 64)
+    rows = manifest['rows'] + rows_added
+    version = _content_version(content_hash, rows)
+    stale = []
+    if rows_added:
+        # Imported here so plain ingestion does not load scikit-learn.
+        from app.utils.model_registry import get_model_registry
+
+        _write_hash_segment(dataset_dir, name, added)
+        stale = (registry or get_model_registry()).mark_stale(previous, version)
+    aggregates.version = version
+    aggregates.save(dataset_dir)
+
+    manifest.update({
+        'sources': manifest['sources'] + source_stats,
+        'rows': rows,
+        'duplicates_dropped': manifest['duplicates_dropped'] + duplicates,
+        'content_hash': version,
+        'appends': appends + [{
+            'name': name,
+            'sources': [s['path'] for s in source_stats],
+            'rows_added': rows_added,
+            'duplicates_dropped': duplicates,
+            'previous_hash': previous,
+            'stale_models': len(stale),
+            'appended_at': datetime.now().isoformat(timespec='seconds'),
+            'elapsed_seconds': round(time.perf_counter() - start, 3),
+        }],
+    })
+    _write_manifest(dataset_dir, manifest)
+    return manifest
+
+
+def _contains(segments: Sequence[np.ndarray], hashes: np.ndarray) -> np.ndarray:
+    """Which hashes occur in any of the sorted hash segments."""
+    found = np.zeros(len(hashes), dtype=bool)
+    for segment in segments:
+        if len(segment):
+            positions = np.minimum(np.searchsorted(segment, hashes), len(segment) - 1)
+            found |= np.asarray(segment[positions]) == hashes
+    return found
+
+
+def _rebuild_state(dataset_dir: str, columns: Sequence[str], version: str, chunk_rows: int) -> DatasetAggregates:
+    """Recomputes the aggregates and row hashes of a stored dataset in one chunked scan."""
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning='hive')
+    aggregates = DatasetAggregates(PARTITION_COLUMN)
+    segments = []
+    for batch in dataset.to_batches(columns=list(columns), batch_size=chunk_rows):
+        frame = batch.to_pandas()
+        segments.append(row_hashes(frame))
+        aggregates.update(frame)
+    hashes = np.concatenate(segments) if segments else np.empty(0, dtype=np.uint64)
+    found = _content_version(int(hashes.sum(dtype=np.uint64)), len(hashes))
+    if found != version:
+        raise ValueError(f"{dataset_dir} does not match its manifest ({found} != {version}); re-run ingest")
+    shutil.rmtree(os.path.join(dataset_dir, HASH_DIR), ignore_errors=True)
+    _write_hash_segment(dataset_dir, 'rebuild', hashes)
+    aggregates.version = version
+    aggregates.save(dataset_dir)
+    return aggregates
+
+
+def _content_version(content_hash: int, rows: int) -> str:
+    return f"{int(content_hash):016x}-{rows}"
+
+
+def _write_manifest(output_dir: str, manifest: Dict[str, Any]) -> None:
+    # Written last and atomically: load_dataset treats a new manifest as a new dataset version.
+    path = os.path.join(output_dir, DATASET_MANIFEST)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_hash_segment(output_dir: str, name: str, hashes: np.ndarray) -> None:
+    os.makedirs(os.path.join(output_dir, HASH_DIR), exist_ok=True)
+    np.save(os.path.join(output_dir, HASH_DIR, f"{name}.npy"), np.sort(hashes))
+
+
+def _write_partitioned(table: pa.Table, output_dir: str, name: str) -> None:
+    if PARTITION_COLUMN not in table.column_names:
+        pq.write_table(table, os.path.join(output_dir, f"{name}.parquet"))
+        return
+    ds.write_dataset(
+        table,
+        output_dir,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([table.schema.field(PARTITION_COLUMN)]), flavor='hive'),
+        basename_template=f"{name}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Merge groundwater CSV extracts into a de-duplicated, district-partitioned Parquet dataset."
+    )
+    parser.add_argument('sources', nargs='+', help="CSV files to merge")
+    parser.add_argument('--output', required=True, help="Dataset directory (use as HYDRO_DATA_PATH)")
+    parser.add_argument('--append', action='store_true',
+                        help="Add the sources to the existing dataset in --output instead of rebuilding it")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--encoding', default=None, help="Source encoding (default: detected per file)")
+    parser.add_argument('--bucket-mb', type=int, default=DEFAULT_BUCKET_BYTES >> 20,
+                        help="Input megabytes per de-duplication bucket (bounds memory)")
+    parser.add_argument('--overwrite', action='store_true', help="Replace an existing dataset (only a directory ingest wrote)")
+    args = parser.parse_args()
+
+    if args.append:
+        result = append(args.sources, args.output, chunk_rows=args.chunk_rows, encoding=args.encoding)
+        latest = result['appends'][-1]
+        print(
+            f"{latest['rows_added']:,} rows appended to {args.output} "
+            f"({latest['duplicates_dropped']:,} duplicates skipped, {result['rows']:,} rows in total) "
+            f"in {latest['elapsed_seconds']:.2f}s; {latest['stale_models']} stored models marked stale"
+        )
+    else:
+        result = ingest(
+            args.sources, args.output, chunk_rows=args.chunk_rows, encoding=args.encoding,
+            bucket_bytes=args.bucket_mb << 20, overwrite=args.overwrite
+        )
+        for source in result['sources']:
+            print(f"{source['path']}: {source['rows']:,} rows ({source['encoding']})")
+        print(
+            f"{result['rows']:,} rows written to {args.output} "
+            f"({result['duplicates_dropped']:,} duplicates dropped, {result['buckets']} buckets) "
+            f"in {result['elapsed_seconds']:.2f}s"
+            + (f", peak memory {result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "")
+        )
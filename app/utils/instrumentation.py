@@ -0,0 +1,249 @@
+"""
+Lightweight timing spans and counters.
+
+Code wraps a phase in ``span('name')`` (or decorates it with ``@timed``) and
+bumps counters with ``count('name')``. Every finished span feeds process-wide
+per-phase statistics; spans and counters on a thread with an active run trace
+(one Streamlit rerun, see start_run) are also kept on that trace for the
+debug panel. With HYDRO_PERF_LOG set, each span and run is written as one
+JSON log line ('1' or 'stderr' for standard error, otherwise a file path).
+"""
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+
+PERF_LOG_ENV = 'HYDRO_PERF_LOG'
+PERF_PANEL_ENV = 'HYDRO_PERF_PANEL'
+RECENT_SAMPLES = 512
+MAX_TRACE_SPANS = 1000
+
+logger = logging.getLogger('hydro.perf')
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_phase_stats: Dict[str, 'PhaseStats'] = {}
+_counters: Dict[str, float] = {}
+_configured = False
+_configure_lock = threading.Lock()
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    start_ms: float
+    duration_ms: float
+    depth: int
+    fields: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class RunTrace:
+    """Spans and counters recorded on one thread between start_run and finish_run."""
+    name: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started: float = field(default_factory=time.perf_counter)
+    spans: List[SpanRecord] = field(default_factory=list)
+    counters: Dict[str, float] = field(default_factory=dict)
+    duration_ms: Optional[float] = None
+
+    @property
+    def elapsed_ms(self) -> float:
+        return self.duration_ms if self.duration_ms is not None else (time.perf_counter() - self.started) * 1000
+
+
+class PhaseStats:
+    """Call count, total and maximum time, and a window of recent durations for one phase."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent: Deque[float] = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, duration_ms: float) -> None:
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.recent.append(duration_ms)
+
+    def summary(self) -> Dict[str, float]:
+        recent = np.fromiter(self.recent, dtype=np.float64)
+        p50, p95 = np.percentile(recent, [50, 95]) if len(recent) else (float('nan'), float('nan'))
+        return {
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.count if self.count else float('nan'),
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'max_ms': self.max_ms,
+        }
+
+
+def configure_logging() -> bool:
+    """Attaches the JSON line handler named by HYDRO_PERF_LOG (once); returns whether logging is on."""
+    global _configured
+    if _configured:
+        return logger.isEnabledFor(logging.INFO)
+    with _configure_lock:
+        if not _configured:
+            target = os.getenv(PERF_LOG_ENV, '').strip()
+            if target and target != '0':
+                handler = (
+                    logging.StreamHandler(sys.stderr) if target.lower() in ('1', 'stderr', 'true')
+                    else logging.FileHandler(target, encoding='utf-8')
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+            _configured = True
+    return logger.isEnabledFor(logging.INFO)
+
+
+def _log(event: Dict[str, Any]) -> None:
+    if configure_logging():
+        logger.info(json.dumps({'ts': round(time.time(), 3), **event}, default=str))
+
+
+def current_run() -> Optional[RunTrace]:
+    return getattr(_local, 'trace', None)
+
+
+def start_run(name: str = 'rerun') -> RunTrace:
+    """Starts collecting this thread's spans and counters into a new trace."""
+    trace = RunTrace(name)
+    _local.trace = trace
+    _local.depth = 0
+    return trace
+
+
+def finish_run(trace: Optional[RunTrace] = None) -> Optional[RunTrace]:
+    """Closes the thread's trace, records its total as a phase and logs a summary line."""
+    trace = trace or current_run()
+    if trace is None:
+        return None
+    if current_run() is trace:
+        _local.trace = None
+    trace.duration_ms = (time.perf_counter() - trace.started) * 1000
+    _add_stats(trace.name, trace.duration_ms)
+    _log({
+        'event': 'run',
+        'name': trace.name,
+        'run': trace.id,
+        'ms': round(trace.duration_ms, 3),
+        'spans': len(trace.spans),
+        'phases': {name: round(ms, 3) for name, ms in top_level_phases(trace).items()},
+        'counters': trace.counters,
+    })
+    return trace
+
+
+def _add_stats(name: str, duration_ms: float) -> None:
+    with _stats_lock:
+        stats = _phase_stats.get(name)
+        if stats is None:
+            stats = _phase_stats[name] = PhaseStats()
+        stats.add(duration_ms)
+
+
+def record(name: str, seconds: float, **fields) -> None:
+    """Records a phase measured elsewhere (e.g. across a generator's lifetime) as a span."""
+    duration_ms = seconds * 1000
+    _add_stats(name, duration_ms)
+    trace = current_run()
+    if trace is not None and len(trace.spans) < MAX_TRACE_SPANS:
+        start_ms = (time.perf_counter() - trace.started) * 1000 - duration_ms
+        trace.spans.append(SpanRecord(name, start_ms, duration_ms, getattr(_local, 'depth', 0), fields))
+    _log({
+        'event': 'span',
+        'name': name,
+        'run': trace.id if trace else None,
+        'thread': threading.current_thread().name,
+        'ms': round(duration_ms, 3),
+        **fields,
+    })
+
+
+@contextmanager
+def span(name: str, **fields) -> Iterator[Dict[str, Any]]:
+    """Times the enclosed block as phase name.
+
+    Yields the span's field dict, so the block can attach details known only
+    at the end (rows, cache hits).
+    """
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        duration = time.perf_counter() - started
+        _local.depth = depth
+        record(name, duration, **fields)
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Decorator that runs a function inside span(name) (default: its qualified name)."""
+    def decorate(fn: Callable) -> Callable:
+        phase = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name: str, n: float = 1) -> None:
+    """Adds n to a process-wide counter and to the thread's run trace, if any."""
+    with _stats_lock:
+        _counters[name] = _counters.get(name, 0) + n
+    trace = current_run()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + n
+
+
+def top_level_phases(trace: RunTrace) -> Dict[str, float]:
+    """Total milliseconds per phase for a trace's outermost spans."""
+    totals: Dict[str, float] = {}
+    for s in trace.spans:
+        if s.depth == 0:
+            totals[s.name] = totals.get(s.name, 0.0) + s.duration_ms
+    return totals
+
+
+def phase_stats() -> Dict[str, Dict[str, float]]:
+    """Per-phase summaries (see PhaseStats.summary) over the life of the process."""
+    with _stats_lock:
+        return {name: stats.summary() for name, stats in _phase_stats.items()}
+
+
+def counters() -> Dict[str, float]:
+    with _stats_lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    """Clears process-wide statistics and counters."""
+    with _stats_lock:
+        _phase_stats.clear()
+        _counters.clear()
+
+
+def panel_enabled(query_params: Optional[Dict[str, Any]] = None) -> bool:
+    """True when HYDRO_PERF_PANEL=1 or the page URL carries ?debug=perf."""
+    if os.getenv(PERF_PANEL_ENV, '').strip().lower() in ('1', 'true', 'yes'):
+        return True
+    return query_params is not None and query_params.get('debug') == 'perf'
@@ -0,0 +1,591 @@
+"""
+LLM access for the HydroAI application.
+
+All model calls go through generate_text (or stream_text for incremental
+rendering), which consults the persistent response cache before calling the
+process-wide LLMClient. The client wraps a backend (Gemini by default,
+HYDRO_LLM_BACKEND=stub for a local fake) with per-call deadlines, retries
+with exponential backoff, a shared token-bucket rate limiter and a thread
+pool for concurrent and async calls.
+"""
+import argparse
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Iterator, List, Optional, Protocol
+
+from app.utils.instrumentation import count, record, span
+from app.utils.llm_cache import ResponseCache, get_response_cache
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+BACKEND_ENV = 'HYDRO_LLM_BACKEND'
+RATE_ENV = 'HYDRO_LLM_RATE'
+TIMEOUT_ENV = 'HYDRO_LLM_TIMEOUT'
+METRICS_HISTORY = 200
+
+# Exception class names raised by google-api-core / HTTP clients for conditions worth retrying.
+TRANSIENT_ERROR_NAMES = {
+    'ResourceExhausted',
+    'TooManyRequests',
+    'ServiceUnavailable',
+    'InternalServerError',
+    'DeadlineExceeded',
+    'GatewayTimeout',
+    'ConnectionError',
+    'TimeoutError',
+}
+
+# Finish reasons of a candidate whose text was withheld.
+BLOCKED_FINISH_REASONS = {'SAFETY', 'RECITATION', 'BLOCKLIST', 'PROHIBITED_CONTENT', 'SPII'}
+
+
+class LLMError(RuntimeError):
+    """Raised when a model call fails after all retries."""
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when a model call misses its deadline."""
+
+
+class TransientLLMError(LLMError):
+    """Retryable backend failure (used by the fake backend)."""
+
+
+class LLMBackend(Protocol):
+    model_name: str
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        ...
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        ...
+
+
+class GeminiBackend:
+    """Google Gemini backend; the SDK is configured once per process."""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, api_key: Optional[str] = None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _request_options(timeout: Optional[float]) -> Dict:
+        return {'timeout': timeout} if timeout else {}
+
+    @staticmethod
+    def _text(response) -> str:
+        """Text of a response or stream chunk; `.text` raises ValueError on chunks without text parts."""
+        feedback = getattr(response, 'prompt_feedback', None)
+        if feedback is not None and getattr(feedback, 'block_reason', None):
+            raise LLMError(f"Prompt blocked by the model: {feedback.block_reason}")
+        for candidate in list(getattr(response, 'candidates', None) or [])[:1]:
+            parts = candidate.content.parts if getattr(candidate, 'content', None) is not None else []
+            text = "".join(getattr(part, 'text', '') or '' for part in parts)
+            reason = getattr(candidate.finish_reason, 'name', str(candidate.finish_reason))
+            if not text and reason in BLOCKED_FINISH_REASONS:
+                raise LLMError(f"Response blocked by the model: {reason}")
+            return text
+        return ""
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        return self._text(self._model.generate_content(prompt, request_options=self._request_options(timeout)))
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        response = self._model.generate_content(
+            prompt, stream=True, request_options=self._request_options(timeout)
+        )
+        for chunk in response:
+            text = self._text(chunk)
+            if text:
+                yield text
+
+
+class StubBackend:
+    """Offline backend returning canned or computed responses.
+
+    Latency and failures can be simulated for load testing.
+
+    Args:
+        responder: Callable mapping a prompt to a response (default: echoes a prompt digest)
+        model_name: Name reported for cache keys
+        chunk_size: Characters per streamed chunk
+        chunk_delay: Seconds to sleep before each streamed chunk
+        latency: Seconds to sleep per call, or a (low, high) range sampled uniformly
+        error_rate: Probability that a call raises TransientLLMError
+        seed: Seed for the latency/error random generator
+    """
+
+    def __init__(
+        self,
+        responder: Optional[Callable[[str], str]] = None,
+        model_name: str = "stub",
+        chunk_size: int = 16,
+        chunk_delay: float = 0.0,
+        latency=0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.model_name = model_name
+        self.responder = responder or (lambda prompt: f"[stub response to {len(prompt)} prompt characters]")
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: List[str] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self, timeout: Optional[float]) -> None:
+        with self._lock:
+            if isinstance(self.latency, (tuple, list)):
+                delay = self._random.uniform(*self.latency)
+            else:
+                delay = float(self.latency)
+            failed = self._random.random() < self.error_rate
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"stub call exceeded {timeout:.2f}s")
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise TransientLLMError("simulated upstream failure")
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        self._simulate(timeout)
+        with self._lock:
+            self.calls.append(prompt)
+        return self.responder(prompt)
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        text = self.generate(prompt, timeout)
+        for start in range(0, len(text), self.chunk_size):
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield text[start:start + self.chunk_size]
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available.
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum burst size
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (TransientLLMError, TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+class LLMClient:
+    """Process-wide access point to a backend.
+
+    Args:
+        backend: Object implementing LLMBackend
+        requests_per_second: Sustained rate shared by every caller of this client
+        burst: Requests allowed back-to-back before rate limiting applies
+        timeout: Default per-call deadline in seconds (covers queueing and retries)
+        max_retries: Retries for transient failures
+        backoff_base: First retry delay in seconds, doubled on each attempt
+        backoff_max: Upper bound for a single retry delay
+        max_workers: Size of the thread pool used by submit() and agenerate()
+    """
+
+    def __init__(
+        self,
+        backend: LLMBackend,
+        requests_per_second: float = 2.0,
+        burst: int = 5,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        max_workers: int = 8
+    ):
+        self.backend = backend
+        self.limiter = TokenBucket(requests_per_second, burst)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self._random = random.Random()
+        self.counters = {'calls': 0, 'retries': 0, 'failures': 0, 'timeouts': 0}
+        self._counter_lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.model_name
+
+    def _count(self, name: str) -> None:
+        with self._counter_lock:
+            self.counters[name] += 1
+        count(f"llm.{name}")
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * self._random.uniform(0.5, 1.0)
+
+    def _call(self, fn: Callable[[Optional[float]], object], deadline: float):
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.limiter.acquire(timeout=remaining):
+                self._count('timeouts')
+                raise LLMTimeoutError("LLM call deadline exceeded while waiting for rate limit")
+            self._count('calls')
+            try:
+                with span('llm.call', attempt=attempt):
+                    return fn(max(deadline - time.monotonic(), 0.001))
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    self._count('failures')
+                    raise LLMError(f"LLM call failed: {e}") from e
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    self._count('timeouts')
+                    raise LLMTimeoutError(f"LLM call deadline exceeded after {attempt + 1} attempts") from e
+                self._count('retries')
+                time.sleep(delay)
+                attempt += 1
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Blocking call with retries; raises LLMTimeoutError once the deadline passes."""
+        future = self.submit(prompt, timeout)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self._count('timeouts')
+            raise LLMTimeoutError(f"LLM call exceeded {timeout or self.timeout:.1f}s")
+
+    def submit(self, prompt: str, timeout: Optional[float] = None) -> Future:
+        """Runs generate on the client's thread pool and returns the future."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        return self._executor.submit(
+            self._call, lambda remaining: self.backend.generate(prompt, remaining), deadline
+        )
+
+    async def agenerate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Async variant of generate for event-loop callers."""
+        future = asyncio.wrap_future(self.submit(prompt, timeout))
+        try:
+            return await asyncio.wait_for(future, timeout=timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._count('timeouts')
+            raise LLMTimeoutError(f"LLM call exceeded {timeout or self.timeout:.1f}s")
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        """Streams chunks; failures before the first chunk are retried like generate.
+
+        Later failures cannot be retried without repeating text already
+        yielded; they raise LLMError. Later chunks are read on the client's
+        pool, so a backend that stops sending raises LLMTimeoutError at the
+        deadline instead of blocking the caller.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        def first_chunk(remaining: Optional[float]):
+            chunks = iter(self.backend.stream(prompt, remaining))
+            return next(chunks, None), chunks
+
+        first, rest = self._call(first_chunk, deadline)
+        if first is None:
+            return
+        yield first
+        while True:
+            future = self._executor.submit(next, rest, None)
+            try:
+                chunk = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                future.cancel()
+                self._count('timeouts')
+                raise LLMTimeoutError(f"LLM stream exceeded {timeout or self.timeout:.1f}s") from None
+            except Exception as e:
+                self._count('failures')
+                raise LLMError(f"LLM stream failed: {e}") from e
+            if chunk is None:
+                return
+            yield chunk
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+_metrics: deque = deque(maxlen=METRICS_HISTORY)
+
+
+def _default_backend() -> LLMBackend:
+    if os.getenv(BACKEND_ENV, 'gemini').lower() == 'stub':
+        return StubBackend()
+    return GeminiBackend()
+
+
+def get_client() -> LLMClient:
+    """Returns the process-wide client; HYDRO_LLM_RATE and HYDRO_LLM_TIMEOUT tune its limits."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient(
+                _default_backend(),
+                requests_per_second=float(os.getenv(RATE_ENV, 2.0)),
+                timeout=float(os.getenv(TIMEOUT_ENV, 60.0)),
+            )
+        return _client
+
+
+def set_client(client: LLMClient) -> None:
+    """Replaces the process-wide client, e.g. with one wrapping a StubBackend."""
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    if previous is not None and previous is not client:
+        previous.shutdown()
+
+
+def set_backend(backend: LLMBackend) -> None:
+    """Replaces the process-wide client with a default-configured one around backend."""
+    set_client(LLMClient(backend))
+
+
+def generate_text(
+    prompt: str,
+    dataset_version: str = "",
+    client: Optional[LLMClient] = None,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
+    timeout: Optional[float] = None
+) -> str:
+    """Generates a response, answering repeated prompts from the response cache.
+
+    Args:
+        prompt: Full prompt sent to the model
+        dataset_version: Version of the data the prompt was built from
+        client: Client to call (default: get_client())
+        cache: Response cache (default: the process-wide cache)
+        use_cache: Set to False to bypass the cache for this call
+        timeout: Per-call deadline in seconds (default: the client's)
+
+    Returns:
+        Response text
+
+    Raises:
+        LLMTimeoutError: If the deadline passes
+        LLMError: If the backend keeps failing
+    """
+    client = client or get_client()
+    if not use_cache:
+        return client.generate(prompt, timeout)
+
+    cache = cache or get_response_cache()
+    cached = cache.get(client.model_name, dataset_version, prompt)
+    if cached is not None:
+        count('llm.cache_hits')
+        return cached
+
+    response = client.generate(prompt, timeout)
+    cache.put(client.model_name, dataset_version, prompt, response)
+    return response
+
+
+class TextStream:
+    """Iterable over response chunks that records latency as it is consumed.
+
+    The full text is written to the response cache once the stream is
+    exhausted; an interrupted stream is not cached.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        dataset_version: str,
+        client: LLMClient,
+        cache: Optional[ResponseCache],
+        timeout: Optional[float] = None
+    ):
+        self.prompt = prompt
+        self.dataset_version = dataset_version
+        self.client = client
+        self.cache = cache
+        self.timeout = timeout
+        self.text = ""
+        self.from_cache = False
+        self.time_to_first_token: Optional[float] = None
+        self.total_latency: Optional[float] = None
+
+    def __iter__(self) -> Iterator[str]:
+        started = time.perf_counter()
+        chunks = []
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(self.client.model_name, self.dataset_version, self.prompt)
+
+        if cached is not None:
+            self.from_cache = True
+            source = iter([cached])
+        else:
+            source = self.client.stream(self.prompt, self.timeout)
+
+        for chunk in source:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - started
+            chunks.append(chunk)
+            yield chunk
+
+        self.text = "".join(chunks)
+        self.total_latency = time.perf_counter() - started
+        if self.cache is not None and not self.from_cache:
+            self.cache.put(self.client.model_name, self.dataset_version, self.prompt, self.text)
+        elif self.from_cache:
+            count('llm.cache_hits')
+        _metrics.append(self.metrics())
+        record(
+            'llm.stream', self.total_latency, cached=self.from_cache,
+            first_token_ms=round(self.time_to_first_token * 1000, 1) if self.time_to_first_token is not None else None,
+            prompt_chars=len(self.prompt)
+        )
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            'model': self.client.model_name,
+            'cached': self.from_cache,
+            'time_to_first_token': self.time_to_first_token,
+            'total_latency': self.total_latency,
+            'prompt_chars': len(self.prompt),
+            'response_chars': len(self.text),
+        }
+
+
+def stream_text(
+    prompt: str,
+    dataset_version: str = "",
+    client: Optional[LLMClient] = None,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
+    timeout: Optional[float] = None
+) -> TextStream:
+    """Streams a response chunk by chunk; cached prompts arrive as a single chunk.
+
+    Args:
+        prompt: Full prompt sent to the model
+        dataset_version: Version of the data the prompt was built from
+        client: Client to call (default: get_client())
+        cache: Response cache (default: the process-wide cache)
+        use_cache: Set to False to bypass the cache for this call
+        timeout: Deadline for the first chunk in seconds (default: the client's)
+
+    Returns:
+        TextStream to iterate (e.g. with st.write_stream); its text,
+        time_to_first_token and total_latency are set once it is exhausted
+    """
+    client = client or get_client()
+    if use_cache:
+        cache = cache or get_response_cache()
+    else:
+        cache = None
+    return TextStream(prompt, dataset_version, client, cache, timeout)
+
+
+def get_llm_metrics() -> List[Dict[str, object]]:
+    """Returns latency records for the most recent streamed responses."""
+    return list(_metrics)
+
+
+def load_test(client: LLMClient, requests: int = 200, concurrency: int = 16) -> Dict[str, float]:
+    """Fires concurrent uncached requests at a client and summarizes latency."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(i: int) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            client.generate(f"load test request {i}")
+        except LLMError:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else float('nan')
+
+    return {
+        'requests': requests,
+        'succeeded': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_s': pct(0.50),
+        'p99_s': pct(0.99),
+        **client.counters,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the LLM client against the local fake backend.")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=50.0, help="Token-bucket rate (requests/second)")
+    parser.add_argument('--latency', type=float, nargs=2, default=(0.05, 0.3), help="Simulated latency range (s)")
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    fake = StubBackend(latency=tuple(args.latency), error_rate=args.error_rate, seed=0)
+    test_client = LLMClient(
+        fake,
+        requests_per_second=args.rate,
+        burst=max(1, int(args.rate)),
+        timeout=args.timeout,
+        backoff_base=0.05,
+        max_workers=args.concurrency,
+    )
+    for key, value in load_test(test_client, args.requests, args.concurrency).items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    test_client.shutdown()
@@ -5,34 +5,267 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.metrics import mean_squared_error, r2_score
+import copy
 import joblib
 import os
-from typing import Dict, Tuple, Any, Union, Optional
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple, Any, Union, Optional
 
-def preprocess_data(df: pd.DataFrame, target_column: str) -> Tuple[pd.DataFrame, pd.Series, Dict, list]:
-    df_processed = df.copy()
-    categorical_cols = df_processed.select_dtypes(include=['object', 'category']).columns.tolist()
-    label_encoders = {}
-    
-    for col in categorical_cols:
-        if col != target_column:
-            le = LabelEncoder()
-            df_processed[col] = le.fit_transform(df_processed[col].astype(str))
-            label_encoders[col] = le
+from app.utils.forest_engine import predict_features
+from app.utils.instrumentation import span, timed
+
+TRAIN_JOBS_ENV = 'HYDRO_TRAIN_JOBS'
+
+# Status columns computed from a measurement; using them to predict that
+# measurement leaks the target.
+DERIVED_COLUMNS = {
+    'Nitrate_mg_L': ['Nitrate_Status'],
+    'Fluoride_mg_L': ['Fluoride_Status'],
+    'TDS_mg_L': ['TDS/EC_Level'],
+}
+
+class TrainingCancelled(Exception):
+    pass
+
+def default_n_jobs() -> int:
+    return int(os.getenv(TRAIN_JOBS_ENV, -1))
+
+def leakage_columns(target_column: str) -> List[str]:
+    return list(DERIVED_COLUMNS.get(target_column, []))
+
+class CategoryVocabulary:
+    """Category lists for every categorical feature, shared by training and inference.
+
+    Values are encoded as their position in the column's sorted category list;
+    missing and unseen values become -1.
+    """
+
+    def __init__(self, categories: Dict[str, np.ndarray]):
+        self.categories = categories
+        self._indexes = {col: pd.Index(values) for col, values in categories.items()}
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, columns: Iterable[str]) -> 'CategoryVocabulary':
+        categories = {}
+        for col in columns:
+            series = df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values = series.cat.categories
+            else:
+                values = pd.Index(series.dropna().unique())
+            categories[col] = np.unique(np.asarray(values.astype(str), dtype=object))
+        return cls(categories)
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders: Dict[str, LabelEncoder]) -> 'CategoryVocabulary':
+        return cls({col: np.asarray(le.classes_, dtype=object) for col, le in label_encoders.items()})
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.categories
+
+    def code(self, column: str, value: Any) -> int:
+        """Code of a single value (-1 if missing or unseen)."""
+        if pd.isna(value):
+            return -1
+        try:
+            return int(self._indexes[column].get_loc(str(value)))
+        except KeyError:
+            return -1
+
+    def __getstate__(self):
+        return {'categories': self.categories}
+
+    def __setstate__(self, state):
+        self.__init__(state['categories'])
+
+    def encode(self, series: pd.Series, column: str) -> np.ndarray:
+        index = self._indexes[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Map the (few) categories once, then gather by code.
+            table = np.append(index.get_indexer(series.cat.categories.astype(str)), -1)
+            return table[series.cat.codes.to_numpy()].astype(np.int32)
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        table = np.append(index.get_indexer(pd.Index(uniques).astype(str)), -1)
+        return table[codes].astype(np.int32)
+
+def build_feature_matrix(
+    input_data: pd.DataFrame,
+    vocabulary: CategoryVocabulary,
+    feature_columns: list
+) -> np.ndarray:
+    """float32 matrix of feature_columns; categoricals as vocabulary codes, missing columns as 0."""
+    matrix = np.zeros((len(input_data), len(feature_columns)), dtype=np.float32)
+    for i, col in enumerate(feature_columns):
+        if col not in input_data.columns:
+            continue
+        if col in vocabulary:
+            matrix[:, i] = vocabulary.encode(input_data[col], col)
+        else:
+            matrix[:, i] = pd.to_numeric(input_data[col], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    return matrix
+
+def build_feature_row(values: Dict, vocabulary: CategoryVocabulary, feature_columns: list) -> np.ndarray:
+    """(1, n_features) float32 matrix for one record, without building a DataFrame."""
+    row = np.zeros((1, len(feature_columns)), dtype=np.float32)
+    for i, col in enumerate(feature_columns):
+        if col not in values:
+            continue
+        if col in vocabulary:
+            row[0, i] = vocabulary.code(col, values[col])
+        else:
+            value = pd.to_numeric(values[col], errors='coerce')
+            row[0, i] = np.nan if pd.isna(value) else value
+    return row
+
+def preprocess_data(
+    df: pd.DataFrame,
+    target_column: Union[str, List[str]],
+    exclude_columns: Optional[Iterable[str]] = None
+) -> Tuple[np.ndarray, np.ndarray, CategoryVocabulary, list]:
+    # Reads columns straight into one float32 matrix instead of copying and re-encoding the frame.
+    # A list of targets gives a 2-D y (one column per target) for a multi-output model.
+    targets = [target_column] if isinstance(target_column, str) else list(target_column)
+    excluded = set(exclude_columns or []) | set(targets)
+    feature_columns = [col for col in df.columns if col not in excluded]
+    categorical_cols = [
+        col for col in df.select_dtypes(include=['object', 'category', 'string']).columns
+        if col in feature_columns
+    ]
+    vocabulary = CategoryVocabulary.fit(df, categorical_cols)
     
-    X = df_processed.drop(columns=[target_column])
-    y = df_processed[target_column]
-    feature_columns = X.columns.tolist()
+    y = df[target_column].to_numpy(dtype=np.float64, na_value=np.nan)
+    known = ~np.isnan(y) if y.ndim == 1 else ~np.isnan(y).any(axis=1)
+    rows = df if known.all() else df[known]
+    X = build_feature_matrix(rows, vocabulary, feature_columns)
     
-    return X, y, label_encoders, feature_columns
+    return X, y[known], vocabulary, feature_columns
+
+def correlated_target_groups(
+    df: pd.DataFrame,
+    targets: Optional[Iterable[str]] = None,
+    threshold: float = 0.6
+) -> List[List[str]]:
+    """Groups numeric targets linked by |correlation| >= threshold (singletons included)."""
+    targets = list(targets if targets is not None else df.select_dtypes(include='number').columns)
+    corr = df[targets].corr().abs().to_numpy()
+    groups, seen = [], set()
+    for i, col in enumerate(targets):
+        if col in seen:
+            continue
+        group, pending = [], [i]
+        while pending:
+            j = pending.pop()
+            if targets[j] in seen:
+                continue
+            seen.add(targets[j])
+            group.append(j)
+            pending.extend(k for k in range(len(targets)) if corr[j, k] >= threshold and targets[k] not in seen)
+        groups.append([targets[j] for j in sorted(group)])
+    return groups
+
+class SingleOutput:
+    """One output of a fitted multi-output regressor, usable wherever a single-target model is."""
+
+    def __init__(self, model: RandomForestRegressor, index: int):
+        self.model = model
+        self.index = index
+
+    def predict(self, X) -> np.ndarray:
+        return self.model.predict(X)[:, self.index]
+
+    @property
+    def feature_importances_(self) -> np.ndarray:
+        return self.model.feature_importances_
+
+    @property
+    def estimators_(self) -> list:
+        return self.model.estimators_
+
+    @property
+    def n_features_in_(self) -> int:
+        return self.model.n_features_in_
+
+def output_bundle(bundle: Dict[str, Any], target_column: str) -> Dict[str, Any]:
+    """Single-target view of a multi-output bundle (see train_model with a 2-D y)."""
+    index = bundle['target_column'].index(target_column)
+    metrics = dict(bundle['metrics']['per_output'][index])
+    metrics['feature_importances'] = bundle['metrics']['feature_importances']
+    return {
+        **bundle,
+        'model': SingleOutput(bundle['model'], index),
+        'target_column': target_column,
+        'metrics': metrics,
+        'shared_targets': list(bundle['target_column']),
+    }
+
+def _grow_forest(
+    model: RandomForestRegressor,
+    X_train_scaled: np.ndarray,
+    y_train: np.ndarray,
+    n_estimators: int,
+    progress_callback: Optional[Callable[[int, int], None]],
+    cancel_event: Optional[threading.Event],
+    batch_size: int
+) -> None:
+    # Trees are added in warm-start batches so progress can be reported and training
+    # cancelled between batches; the fitted forest is identical to a single fit.
+    while True:
+        built = len(getattr(model, 'estimators_', []))
+        if built >= n_estimators:
+            break
+        if cancel_event is not None and cancel_event.is_set():
+            raise TrainingCancelled(f"Training cancelled after {built} trees")
+        model.set_params(n_estimators=min(n_estimators, built + batch_size))
+        model.fit(X_train_scaled, y_train)
+        if progress_callback is not None:
+            progress_callback(len(model.estimators_), n_estimators)
+    # Single-row predictions are faster without a thread pool.
+    model.set_params(warm_start=False, n_jobs=None)
 
+def _tree_prediction_sum(trees: list, X: np.ndarray) -> np.ndarray:
+    total = 0.0
+    for tree in trees:
+        total = total + tree.predict(X)
+    return total
+
+def _evaluate(
+    model: RandomForestRegressor,
+    y_test: np.ndarray,
+    test_prediction_sum: np.ndarray,
+    feature_columns: list
+) -> Dict:
+    y_pred = test_prediction_sum / len(model.estimators_)
+    metrics = {
+        'mse': mean_squared_error(y_test, y_pred),
+        'r2': r2_score(y_test, y_pred),
+        'mae': mean_absolute_error(y_test, y_pred),
+        'feature_importances': dict(zip(feature_columns, model.feature_importances_)),
+        # Sum of per-tree test predictions, so resize_model can update the scores.
+        'test_prediction_sum': test_prediction_sum,
+    }
+    if y_test.ndim == 2:
+        metrics['per_output'] = [
+            {
+                'mse': mean_squared_error(y_test[:, i], y_pred[:, i]),
+                'r2': r2_score(y_test[:, i], y_pred[:, i]),
+                'mae': mean_absolute_error(y_test[:, i], y_pred[:, i]),
+            }
+            for i in range(y_test.shape[1])
+        ]
+    return metrics
+
+@timed('model.train')
 def train_model(
-    X: pd.DataFrame,
-    y: pd.Series,
-    label_encoders: Dict,
+    X: np.ndarray,
+    y: np.ndarray,
+    feature_columns: list,
     test_size: float = 0.2,
     random_state: int = 42,
-    n_estimators: int = 100
+    n_estimators: int = 100,
+    n_jobs: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    batch_size: int = 10
 ) -> Tuple[RandomForestRegressor, StandardScaler, Dict]:
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=test_size, random_state=random_state
@@ -42,63 +275,121 @@ def train_model(
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
     
-    model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state)
-    model.fit(X_train_scaled, y_train)
+    model = RandomForestRegressor(
+        n_estimators=min(batch_size, n_estimators),
+        random_state=random_state,
+        n_jobs=default_n_jobs() if n_jobs is None else n_jobs,
+        warm_start=True
+    )
+    _grow_forest(model, X_train_scaled, y_train, n_estimators, progress_callback, cancel_event, batch_size)
     
-    y_pred = model.predict(X_test_scaled)
-    mse = mean_squared_error(y_test, y_pred)
-    r2 = r2_score(y_test, y_pred)
-    mae = mean_absolute_error(y_test, y_pred)
-    
-    metrics = {
-        'mse': mse,
-        'r2': r2,
-        'mae': mae,
-        'feature_importances': dict(zip(X.columns, model.feature_importances_))
-    }
+    metrics = _evaluate(model, y_test, _tree_prediction_sum(model.estimators_, X_test_scaled), feature_columns)
     
     return model, scaler, metrics
 
+@timed('model.resize')
+def resize_model(
+    base_model: RandomForestRegressor,
+    scaler: StandardScaler,
+    base_metrics: Dict,
+    X: np.ndarray,
+    y: np.ndarray,
+    feature_columns: list,
+    n_estimators: int,
+    test_size: float = 0.2,
+    random_state: int = 42,
+    n_jobs: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    batch_size: int = 10
+) -> Tuple[RandomForestRegressor, StandardScaler, Dict]:
+    """Grows or trims a trained forest to n_estimators trees.
+
+    base_model must have been trained by train_model on the same data, split
+    and random_state. Tree i of a forest depends only on random_state, so the
+    result equals a forest trained from scratch with n_estimators trees while
+    only the added trees are fitted. Metrics are updated from the base
+    model's per-tree test prediction sum. base_model is not modified.
+    """
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=random_state
+    )
+    X_test_scaled = scaler.transform(X_test)
+    
+    model = copy.copy(base_model)
+    base_trees = list(base_model.estimators_)
+    test_prediction_sum = base_metrics.get('test_prediction_sum')
+    if test_prediction_sum is None or len(test_prediction_sum) != len(y_test):
+        test_prediction_sum = _tree_prediction_sum(base_trees, X_test_scaled)
+    
+    if n_estimators <= len(base_trees):
+        model.estimators_ = base_trees[:n_estimators]
+        model.set_params(n_estimators=n_estimators)
+        test_prediction_sum = test_prediction_sum - _tree_prediction_sum(base_trees[n_estimators:], X_test_scaled)
+        if progress_callback is not None:
+            progress_callback(n_estimators, n_estimators)
+    else:
+        model.estimators_ = list(base_trees)
+        model.set_params(warm_start=True, n_jobs=default_n_jobs() if n_jobs is None else n_jobs)
+        _grow_forest(model, scaler.transform(X_train), y_train, n_estimators, progress_callback, cancel_event, batch_size)
+        test_prediction_sum = test_prediction_sum + _tree_prediction_sum(model.estimators_[len(base_trees):], X_test_scaled)
+    
+    return model, scaler, _evaluate(model, y_test, test_prediction_sum, feature_columns)
+
+def predict_batch(
+    input_data: pd.DataFrame,
+    model: RandomForestRegressor,
+    scaler: StandardScaler,
+    vocabulary: CategoryVocabulary,
+    feature_columns: list,
+    chunk_size: int = 100_000
+) -> np.ndarray:
+    """Scores every row of a DataFrame; missing feature columns are treated as 0."""
+    predictions = np.empty(len(input_data), dtype=np.float64)
+    with span('model.predict_batch', rows=len(input_data)):
+        for start in range(0, len(input_data), chunk_size):
+            chunk = input_data.iloc[start:start + chunk_size]
+            features = build_feature_matrix(chunk, vocabulary, feature_columns)
+            predictions[start:start + len(chunk)] = predict_features(model, scaler, features)
+    return predictions
+
 def predict(
     input_data: Union[Dict, pd.DataFrame],
     model: RandomForestRegressor,
     scaler: StandardScaler,
-    label_encoders: Dict,
+    vocabulary: CategoryVocabulary,
     feature_columns: list
 ) -> float:
-    if not isinstance(input_data, pd.DataFrame):
-        input_data = pd.DataFrame([input_data])
-    
-    for col, encoder in label_encoders.items():
-        if col in input_data.columns:
-            input_data[col] = input_data[col].map(
-                lambda x: encoder.transform([x])[0] if x in encoder.classes_ else -1
-            )
-    
-    for col in feature_columns:
-        if col not in input_data.columns:
-            input_data[col] = 0
-    
-    input_data = input_data[feature_columns]
-    input_scaled = scaler.transform(input_data)
-    return model.predict(input_scaled)[0]
+    if isinstance(input_data, pd.DataFrame):
+        return float(predict_batch(input_data, model, scaler, vocabulary, feature_columns)[0])
+    with span('model.predict'):
+        features = build_feature_row(input_data, vocabulary, feature_columns)
+        return float(predict_features(model, scaler, features)[0])
 
 def save_model(
     model: RandomForestRegressor,
     scaler: StandardScaler,
-    label_encoders: Dict,
+    vocabulary: CategoryVocabulary,
     feature_columns: list,
     target_column: str,
-    path: str = 'water_quality_model.joblib'
+    path: str = 'water_quality_model.joblib',
+    metrics: Optional[Dict] = None
 ) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
     joblib.dump({
         'model': model,
         'scaler': scaler,
-        'label_encoders': label_encoders,
+        'vocabulary': vocabulary,
         'feature_columns': feature_columns,
-        'target_column': target_column
-    }, path)
+        'target_column': target_column,
+        'metrics': metrics or {}
+    }, tmp_path)
+    os.replace(tmp_path, path)
 
 def load_model(path: str = 'water_quality_model.joblib') -> Dict[str, Any]:
-    return
\ No newline at end of file
+    bundle = joblib.load(path)
+    bundle.setdefault('metrics', {})
+    if 'vocabulary' not in bundle and 'label_encoders' in bundle:
+        bundle['vocabulary'] = CategoryVocabulary.from_label_encoders(bundle.pop('label_encoders'))
+    return bundle
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Cross-validated comparison of model families.
+
+Every (family, fold) pair is fitted in a separate worker process, so k-fold
+CV for all families runs in parallel. Each fit reports accuracy on its
+held-out fold next to fit time, batch and single-row predict latency, and
+pickled model size; results are averaged per family into a leaderboard.
+Leaderboards are cached per dataset version and configuration.
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import ExtraTreesRegressor, HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import KFold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from app.utils.data_loader import dataset_version
+from app.utils.instrumentation import timed
+from app.utils.ml_models import preprocess_data
+from app.utils.model_registry import code_version
+
+WORKERS_ENV = 'HYDRO_CV_WORKERS'
+CACHED_LEADERBOARDS = 16
+SINGLE_ROW_REPEATS = 20
+
+
+def _random_forest(n_estimators: int, random_state: int):
+    return make_pipeline(
+        StandardScaler(),
+        RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=1)
+    )
+
+
+def _extra_trees(n_estimators: int, random_state: int):
+    return make_pipeline(
+        StandardScaler(),
+        ExtraTreesRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=1)
+    )
+
+
+def _hist_gradient_boosting(n_estimators: int, random_state: int):
+    # n_estimators maps to boosting iterations; early stopping may use fewer.
+    return HistGradientBoostingRegressor(max_iter=n_estimators, random_state=random_state)
+
+
+def _linear(n_estimators: int, random_state: int):
+    return make_pipeline(SimpleImputer(strategy='median'), StandardScaler(), Ridge(alpha=1.0))
+
+
+# Family name -> factory(n_estimators, random_state) returning an unfitted regressor.
+MODEL_FAMILIES: Dict[str, Callable[[int, int], Any]] = {
+    'RandomForest': _random_forest,
+    'ExtraTrees': _extra_trees,
+    'HistGradientBoosting': _hist_gradient_boosting,
+    'Ridge (linear baseline)': _linear,
+}
+
+_worker_data: Dict[str, np.ndarray] = {}
+
+_leaderboards: "OrderedDict[tuple, pd.DataFrame]" = OrderedDict()
+_leaderboards_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    return int(os.getenv(WORKERS_ENV, os.cpu_count() or 1))
+
+
+def _init_worker(X: np.ndarray, y: np.ndarray) -> None:
+    # Sent once per worker process instead of once per task.
+    _worker_data['X'] = X
+    _worker_data['y'] = y
+
+
+def evaluate_fold(
+    family: str,
+    fold: int,
+    train_idx: np.ndarray,
+    test_idx: np.ndarray,
+    n_estimators: int,
+    random_state: int
+) -> Dict[str, Any]:
+    """Fits one family on one fold and measures accuracy, speed and size."""
+    X, y = _worker_data['X'], _worker_data['y']
+    model = MODEL_FAMILIES[family](n_estimators, random_state)
+
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - start
+
+    X_test = X[test_idx]
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    batch_seconds = time.perf_counter() - start
+
+    single_times = []
+    for i in range(min(SINGLE_ROW_REPEATS, len(X_test))):
+        start = time.perf_counter()
+        model.predict(X_test[i:i + 1])
+        single_times.append(time.perf_counter() - start)
+
+    y_test = y[test_idx]
+    return {
+        'family': family,
+        'fold': fold,
+        'r2': r2_score(y_test, y_pred),
+        'mae': mean_absolute_error(y_test, y_pred),
+        'rmse': float(np.sqrt(mean_squared_error(y_test, y_pred))),
+        'fit_s': fit_seconds,
+        'predict_us_per_row': batch_seconds / max(len(X_test), 1) * 1e6,
+        'single_row_ms': float(np.median(single_times)) * 1000 if single_times else float('nan'),
+        'size_mb': len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1e6,
+    }
+
+
+def cross_validate_families(
+    X: np.ndarray,
+    y: np.ndarray,
+    families: Optional[Sequence[str]] = None,
+    n_splits: int = 5,
+    n_estimators: int = 100,
+    random_state: int = 42,
+    max_workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Runs k-fold CV for each family, one process per (family, fold) task.
+
+    Args:
+        X: Feature matrix (see ml_models.preprocess_data)
+        y: Target values
+        families: Names from MODEL_FAMILIES (default: all)
+        n_splits: Number of folds
+        n_estimators: Trees (or boosting iterations) for ensemble families
+        random_state: Seed for the folds and the models
+        max_workers: Worker processes (default: HYDRO_CV_WORKERS or the CPU count)
+
+    Returns:
+        One result per (family, fold); see evaluate_fold
+    """
+    families = list(families or MODEL_FAMILIES)
+    folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(X))
+    tasks = [(family, i, train, test) for family in families for i, (train, test) in enumerate(folds)]
+    workers = max(1, min(max_workers or default_workers(), len(tasks)))
+
+    # Spawned workers do not inherit the server's threads or open handles.
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(X, y),
+    ) as executor:
+        futures = [
+            executor.submit(evaluate_fold, family, i, train, test, n_estimators, random_state)
+            for family, i, train, test in tasks
+        ]
+        return [future.result() for future in futures]
+
+
+def summarize(results: Iterable[Dict[str, Any]]) -> pd.DataFrame:
+    """Per-family means (and R² spread) of fold results, best R² first."""
+    frame = pd.DataFrame(list(results))
+    grouped = frame.groupby('family', sort=False)
+    board = grouped[['r2', 'mae', 'rmse', 'fit_s', 'predict_us_per_row', 'single_row_ms', 'size_mb']].mean()
+    board.insert(1, 'r2_std', grouped['r2'].std(ddof=0))
+    board.insert(0, 'folds', grouped.size())
+    return board.sort_values('r2', ascending=False)
+
+
+@timed('model.compare')
+def compare_models(
+    df: pd.DataFrame,
+    target_column: str,
+    exclude_columns: Optional[Iterable[str]] = None,
+    families: Optional[Sequence[str]] = None,
+    n_splits: int = 5,
+    n_estimators: int = 100,
+    random_state: int = 42,
+    max_workers: Optional[int] = None
+) -> pd.DataFrame:
+    """Leaderboard of model families for a target, cached per dataset version and settings."""
+    families = list(families or MODEL_FAMILIES)
+    key = (
+        dataset_version(df), code_version(), target_column, tuple(sorted(exclude_columns or [])),
+        tuple(families), n_splits, n_estimators, random_state
+    )
+    with _leaderboards_lock:
+        if key[0] and key in _leaderboards:
+            _leaderboards.move_to_end(key)
+            return _leaderboards[key]
+
+    X, y, _, _ = preprocess_data(df, target_column, exclude_columns)
+    board = summarize(cross_validate_families(
+        X, y, families, n_splits=n_splits, n_estimators=n_estimators,
+        random_state=random_state, max_workers=max_workers
+    ))
+
+    if key[0]:
+        with _leaderboards_lock:
+            _leaderboards[key] = board
+            while len(_leaderboards) > CACHED_LEADERBOARDS:
+                _leaderboards.popitem(last=False)
+    return board
+
+
+if __name__ == '__main__':
+    from app.utils.data_loader import load_dataset
+    from app.utils.ml_models import leakage_columns
+
+    parser = argparse.ArgumentParser(description="Cross-validate model families on one target.")
+    parser.add_argument('--target', default='PH')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    data = load_dataset()
+    leaderboard = compare_models(
+        data, args.target, leakage_columns(args.target),
+        n_splits=args.folds, n_estimators=args.trees, max_workers=args.workers
+    )
+    print(leaderboard.round(4).to_string())
@@ -0,0 +1,378 @@
+"""
+Content-addressed registry of trained models.
+
+A trained model is stored under a key derived from the dataset version, the
+target column, the training hyperparameters and the version of the training
+code, so repeating a configuration loads the stored artifact instead of
+retraining. Artifacts live on disk (shared across sessions and restarts),
+recently used ones are also kept in memory, and the store is trimmed by
+total size and age.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from app.utils import ml_models
+from app.utils.data_loader import dataset_version, default_cache_dir
+from app.utils.ml_models import (
+    correlated_target_groups, leakage_columns, load_model, output_bundle, preprocess_data, resize_model,
+    save_model, train_model
+)
+
+MAX_BYTES_ENV = 'HYDRO_MODEL_CACHE_BYTES'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+MEMORY_SLOTS = 8
+
+
+@lru_cache(maxsize=1)
+def code_version() -> str:
+    """Hash of the training code, so changes to ml_models invalidate stored models."""
+    with open(ml_models.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def model_key(dataset: str, target_column: str, params: Dict[str, Any], code: Optional[str] = None) -> str:
+    payload = json.dumps({
+        'dataset': dataset,
+        'target': target_column,
+        'params': params,
+        'code': code or code_version(),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def training_params(
+    test_size: float,
+    n_estimators: int,
+    random_state: int = 42,
+    exclude_columns: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """Hyperparameters that identify a trained model in the registry."""
+    return {
+        'test_size': test_size,
+        'n_estimators': n_estimators,
+        'random_state': random_state,
+        'exclude_columns': sorted(exclude_columns or []),
+    }
+
+
+def _json_metrics(metrics: Dict) -> Dict[str, float]:
+    return {k: float(v) for k, v in metrics.items() if isinstance(v, (int, float, np.number))}
+
+
+class ModelRegistry:
+    """Disk-backed model store with an in-memory LRU in front of it.
+
+    Args:
+        root: Directory for artifacts (default: models/ in the cache directory)
+        max_bytes: Total artifact size kept on disk (default: HYDRO_MODEL_CACHE_BYTES or 2 GiB)
+        max_age_seconds: Artifacts unused for longer are evicted
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS
+    ):
+        self.root = root or os.path.join(default_cache_dir(), 'models')
+        self.max_bytes = max_bytes or int(os.getenv(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+        self.max_age_seconds = max_age_seconds
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _artifact_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.joblib")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def _remember(self, key: str, bundle: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = bundle
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_SLOTS:
+                self._memory.popitem(last=False)
+
+    def _touch(self, key: str) -> None:
+        meta = self.metadata(key)
+        if meta is not None:
+            meta['last_used'] = time.time()
+            self._write_meta(key, meta)
+
+    def _write_meta(self, key: str, meta: Dict[str, Any]) -> None:
+        tmp_path = f"{self._meta_path(key)}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(key))
+
+    def metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the stored bundle (see ml_models.save_model) or None."""
+        with self._lock:
+            bundle = self._memory.get(key)
+            if bundle is not None:
+                self._memory.move_to_end(key)
+        if bundle is None:
+            path = self._artifact_path(key)
+            if not os.path.exists(path):
+                return None
+            try:
+                bundle = load_model(path)
+            except Exception:
+                # Unreadable artifact (e.g. written by an incompatible scikit-learn); drop it.
+                self.remove(key)
+                return None
+            self._remember(key, bundle)
+        self._touch(key)
+        return bundle
+
+    def put(self, key: str, bundle: Dict[str, Any], params: Dict[str, Any], dataset: str) -> None:
+        save_model(
+            bundle['model'],
+            bundle['scaler'],
+            bundle['vocabulary'],
+            bundle['feature_columns'],
+            bundle['target_column'],
+            path=self._artifact_path(key),
+            metrics=bundle.get('metrics'),
+        )
+        now = time.time()
+        self._write_meta(key, {
+            'key': key,
+            'dataset_version': dataset,
+            'target_column': bundle['target_column'],
+            'params': params,
+            'code': code_version(),
+            'metrics': _json_metrics(bundle.get('metrics', {})),
+            'created': now,
+            'last_used': now,
+            'size': os.path.getsize(self._artifact_path(key)),
+        })
+        self._remember(key, bundle)
+        self.evict()
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        for path in (self._artifact_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def list_models(self, dataset: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Metadata of stored models, most recently used first, optionally for one dataset version."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            meta = self.metadata(name[:-len('.json')])
+            if meta is None or not os.path.exists(self._artifact_path(meta['key'])):
+                continue
+            if dataset is not None and meta.get('dataset_version') != dataset:
+                continue
+            entries.append(meta)
+        return sorted(entries, key=lambda m: m.get('last_used', 0), reverse=True)
+
+    def mark_stale(self, dataset: str, superseded_by: str) -> List[str]:
+        """Flags models trained on dataset, or already stale for it, as stale for superseded_by.
+
+        Called when rows are appended to a dataset: the models stay loadable
+        (see stale_models) until they are retrained on the new version.
+        """
+        marked = []
+        for meta in self.list_models():
+            if meta.get('dataset_version') == dataset or meta.get('superseded_by') == dataset:
+                meta['superseded_by'] = superseded_by
+                self._write_meta(meta['key'], meta)
+                marked.append(meta['key'])
+        return marked
+
+    def stale_models(self, dataset: str) -> List[Dict[str, Any]]:
+        """Metadata of models trained on earlier versions of dataset, most recently used first."""
+        return [meta for meta in self.list_models() if meta.get('superseded_by') == dataset]
+
+    def find_resizable(self, dataset: str, target_column: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Metadata of a stored model that differs from params only in n_estimators.
+
+        Prefers the smallest forest with at least the requested trees (trimming
+        is free), otherwise the largest smaller one (fewest trees to add).
+        """
+        wanted = params['n_estimators']
+        others = {k: v for k, v in params.items() if k != 'n_estimators'}
+        candidates = [
+            meta for meta in self.list_models(dataset)
+            if meta.get('target_column') == target_column
+            and meta.get('code') == code_version()
+            and {k: v for k, v in meta.get('params', {}).items() if k != 'n_estimators'} == others
+        ]
+        larger = [m for m in candidates if m['params']['n_estimators'] >= wanted]
+        if larger:
+            return min(larger, key=lambda m: m['params']['n_estimators'])
+        return max(candidates, key=lambda m: m['params']['n_estimators'], default=None)
+
+    def evict(self) -> List[str]:
+        """Removes artifacts past max_age_seconds, then least recently used ones beyond max_bytes."""
+        now = time.time()
+        removed = []
+        entries = self.list_models()
+        kept = []
+        for meta in entries:
+            if now - meta.get('last_used', 0) > self.max_age_seconds:
+                self.remove(meta['key'])
+                removed.append(meta['key'])
+            else:
+                kept.append(meta)
+        total = sum(meta.get('size', 0) for meta in kept)
+        for meta in reversed(kept):
+            if total <= self.max_bytes:
+                break
+            self.remove(meta['key'])
+            removed.append(meta['key'])
+            total -= meta.get('size', 0)
+        return removed
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Returns the process-wide registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
+
+
+def load_registered(
+    df: pd.DataFrame,
+    target_column: Union[str, List[str]],
+    test_size: float = 0.2,
+    n_estimators: int = 100,
+    random_state: int = 42,
+    registry: Optional[ModelRegistry] = None,
+    exclude_columns: Optional[Iterable[str]] = None
+) -> Optional[Dict[str, Any]]:
+    """Returns the stored bundle for a configuration without training, or None."""
+    dataset = dataset_version(df)
+    if not dataset:
+        return None
+    registry = registry or get_model_registry()
+    key = model_key(dataset, target_column, training_params(test_size, n_estimators, random_state, exclude_columns))
+    bundle = registry.get(key)
+    return None if bundle is None else {**bundle, 'key': key, 'cached': True}
+
+
+def load_pretrained(
+    df: pd.DataFrame,
+    target_column: str,
+    test_size: float = 0.2,
+    n_estimators: int = 100,
+    random_state: int = 42,
+    registry: Optional[ModelRegistry] = None,
+    exclude_columns: Optional[Iterable[str]] = None
+) -> Optional[Dict[str, Any]]:
+    """Stored model for a target: its own, else its view of a shared multi-output model.
+
+    A multi-output model is only used when it honours exclude_columns (its
+    features leave out every target in its group and their leakage columns).
+    """
+    bundle = load_registered(df, target_column, test_size, n_estimators, random_state, registry, exclude_columns)
+    if bundle is not None:
+        return bundle
+    for group in correlated_target_groups(df):
+        if target_column not in group or len(group) < 2:
+            continue
+        group_excluded = multi_output_exclusions(group)
+        if not set(exclude_columns or []) <= group_excluded | set(group):
+            return None
+        shared = load_registered(df, group, test_size, n_estimators, random_state, registry, group_excluded)
+        return None if shared is None else output_bundle(shared, target_column)
+    return None
+
+
+def multi_output_exclusions(targets: Iterable[str]) -> set:
+    return {col for target in targets for col in leakage_columns(target)}
+
+
+def train_or_load(
+    df: pd.DataFrame,
+    target_column: Union[str, List[str]],
+    test_size: float = 0.2,
+    n_estimators: int = 100,
+    random_state: int = 42,
+    registry: Optional[ModelRegistry] = None,
+    n_jobs: Optional[int] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    exclude_columns: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """Returns a trained model bundle, training only if this configuration is not stored.
+
+    A list of target columns trains one multi-output model for all of them
+    (see ml_models.output_bundle). If a stored model differs only in n_estimators, it is grown or trimmed
+    (ml_models.resize_model) instead of training every tree again.
+    exclude_columns are left out of the features (see ml_models.leakage_columns);
+    n_jobs, progress_callback and cancel_event are passed to ml_models.train_model.
+
+    Returns:
+        Bundle with model, scaler, vocabulary, feature_columns,
+        target_column, metrics, plus 'key', 'cached' (True when loaded) and
+        'resized_from' (tree count of the reused model, or None)
+    """
+    registry = registry or get_model_registry()
+    params = training_params(test_size, n_estimators, random_state, exclude_columns)
+    dataset = dataset_version(df)
+    key = model_key(dataset, target_column, params)
+
+    stored = load_registered(df, target_column, test_size, n_estimators, random_state, registry, exclude_columns)
+    if stored is not None:
+        return stored
+
+    X, y, vocabulary, feature_columns = preprocess_data(df, target_column, exclude_columns)
+    base_meta = registry.find_resizable(dataset, target_column, params) if dataset else None
+    base = registry.get(base_meta['key']) if base_meta else None
+    if base is not None and base['feature_columns'] == feature_columns:
+        model, scaler, metrics = resize_model(
+            base['model'], base['scaler'], base['metrics'], X, y, feature_columns, n_estimators,
+            test_size=test_size, random_state=random_state,
+            n_jobs=n_jobs, progress_callback=progress_callback, cancel_event=cancel_event
+        )
+        vocabulary = base['vocabulary']
+        resized_from = len(base['model'].estimators_)
+    else:
+        model, scaler, metrics = train_model(
+            X, y, feature_columns, test_size=test_size, random_state=random_state, n_estimators=n_estimators,
+            n_jobs=n_jobs, progress_callback=progress_callback, cancel_event=cancel_event
+        )
+        resized_from = None
+    bundle = {
+        'model': model,
+        'scaler': scaler,
+        'vocabulary': vocabulary,
+        'feature_columns': feature_columns,
+        'target_column': target_column,
+        'metrics': metrics,
+    }
+    if dataset:
+        registry.put(key, bundle, params, dataset)
+    return {**bundle, 'key': key, 'cached': False, 'resized_from': resized_from}
@@ -0,0 +1,368 @@
+"""
+Headless HTTP prediction service.
+
+Loads one registered model at startup and serves it over a stdlib threaded
+HTTP server, independent of Streamlit:
+
+    GET  /health          model details and batching counters
+    POST /predict         {"features": {...}}      -> {"prediction": x}
+    POST /predict/batch   {"records": [{...}, ...]} -> {"predictions": [...]}
+
+Requests handled concurrently are coalesced into micro-batches: a batching
+thread collects feature rows until max_batch_size rows are queued or
+max_wait_ms has passed since the first one, then calls the model once.
+
+    python -m app.utils.prediction_service serve --target PH
+    python -m app.utils.prediction_service load --requests 2000 --concurrency 32
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+from app.utils.forest_engine import predict_features
+from app.utils.ml_models import build_feature_matrix, build_feature_row
+
+MAX_BATCH_ENV = 'HYDRO_SERVICE_MAX_BATCH'
+MAX_WAIT_ENV = 'HYDRO_SERVICE_MAX_WAIT_MS'
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 2.0
+DEFAULT_PORT = 8600
+MAX_BATCH_RECORDS = 100_000
+# JSON values a feature may take; anything else is rejected before it reaches a batch.
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class MicroBatcher:
+    """Coalesces concurrent prediction calls into batched model calls.
+
+    Args:
+        predict_fn: Maps a (rows, features) float32 matrix to one prediction per row
+        max_batch_size: Rows per model call (a single larger request is not split)
+        max_wait_ms: Longest a queued row waits for others before the batch is sent
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size or int(os.getenv(MAX_BATCH_ENV, DEFAULT_MAX_BATCH))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv(MAX_WAIT_ENV, DEFAULT_MAX_WAIT_MS))) / 1000
+        self.batches = 0
+        self.rows = 0
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, features: np.ndarray) -> Future:
+        """Queues a (rows, features) matrix; the future resolves to its predictions."""
+        future: Future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def predict(self, features: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(features).result(timeout)
+
+    @property
+    def mean_batch_rows(self) -> float:
+        return self.rows / self.batches if self.batches else 0.0
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            rows = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch_size:
+                # Rows already queued always join; otherwise wait out the window.
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+            self._flush(pending)
+
+    def _flush(self, pending: List[Tuple[np.ndarray, Future]]) -> None:
+        try:
+            predictions = self.predict_fn(np.concatenate([features for features, _ in pending]))
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(predictions)
+        offset = 0
+        for features, future in pending:
+            future.set_result(predictions[offset:offset + len(features)])
+            offset += len(features)
+
+
+def check_record(record: Dict[str, Any], label: str = "features") -> None:
+    """Raises ValueError unless every feature value is a JSON scalar."""
+    for column, value in record.items():
+        if not isinstance(value, SCALAR_TYPES):
+            raise ValueError(f"{label}.{column} must be a number, string or null, got {type(value).__name__}")
+
+
+class PredictionService:
+    """A loaded model bundle (see model_registry) behind a MicroBatcher."""
+
+    def __init__(self, bundle: Dict[str, Any], max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self.bundle = bundle
+        self.model = bundle['model']
+        self.scaler = bundle['scaler']
+        self.vocabulary = bundle['vocabulary']
+        self.feature_columns = bundle['feature_columns']
+        self.batcher = MicroBatcher(self._predict_matrix, max_batch_size, max_wait_ms)
+
+    def _predict_matrix(self, features: np.ndarray) -> np.ndarray:
+        return predict_features(self.model, self.scaler, features)
+
+    def predict_one(self, record: Dict[str, Any]) -> float:
+        check_record(record)
+        features = build_feature_row(record, self.vocabulary, self.feature_columns)
+        return float(self.batcher.predict(features)[0])
+
+    def predict_many(self, records: List[Dict[str, Any]]) -> List[float]:
+        if not records:
+            return []
+        for i, record in enumerate(records):
+            check_record(record, f"records[{i}]")
+        features = build_feature_matrix(pd.DataFrame.from_records(records), self.vocabulary, self.feature_columns)
+        return self.batcher.predict(features).tolist()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'status': 'ok',
+            'target_column': self.bundle['target_column'],
+            'model_key': self.bundle.get('key'),
+            'feature_columns': list(self.feature_columns),
+            'max_batch_size': self.batcher.max_batch_size,
+            'max_wait_ms': self.batcher.max_wait * 1000,
+            'batches': self.batcher.batches,
+            'rows': self.batcher.rows,
+            'mean_batch_rows': round(self.batcher.mean_batch_rows, 2),
+        }
+
+
+def make_handler(service: PredictionService):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+        def _send(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip('/') == '/health':
+                self._send(200, service.info())
+            else:
+                self._send(404, {'error': f"Unknown path {self.path}"})
+
+        def do_POST(self) -> None:
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send(400, {'error': "Request body must be JSON"})
+                return
+            if not isinstance(payload, dict):
+                self._send(400, {'error': "Request body must be a JSON object"})
+                return
+            path = self.path.rstrip('/')
+            try:
+                if path == '/predict':
+                    if not isinstance(payload.get('features'), dict):
+                        raise ValueError("Expected {\"features\": {column: value, ...}}")
+                    self._send(200, {'prediction': service.predict_one(payload['features'])})
+                elif path == '/predict/batch':
+                    records = payload.get('records')
+                    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+                        raise ValueError("Expected {\"records\": [{column: value, ...}, ...]}")
+                    if len(records) > MAX_BATCH_RECORDS:
+                        raise ValueError(f"At most {MAX_BATCH_RECORDS:,} records per request")
+                    self._send(200, {'predictions': service.predict_many(records)})
+                else:
+                    self._send(404, {'error': f"Unknown path {self.path}"})
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+
+    return PredictionHandler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections under concurrent load.
+    request_queue_size = 128
+
+
+def serve(service: PredictionService, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Starts the HTTP server on a background thread and returns it (call shutdown() to stop)."""
+    server = _Server((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, name='prediction-http', daemon=True).start()
+    return server
+
+
+def load_bundle(
+    df: pd.DataFrame,
+    key: Optional[str] = None,
+    target_column: Optional[str] = None,
+    test_size: float = 0.2,
+    n_estimators: int = 100,
+    train: bool = False
+) -> Dict[str, Any]:
+    """Loads a model by registry key, or the stored (optionally newly trained) model for a target."""
+    from app.utils.ml_models import leakage_columns
+    from app.utils.model_registry import get_model_registry, load_pretrained, train_or_load
+
+    if key:
+        bundle = get_model_registry().get(key)
+        if bundle is None:
+            raise LookupError(f"No registered model {key}")
+        return {**bundle, 'key': key}
+    if not target_column:
+        raise ValueError("Give a model key or a target column")
+    exclude = leakage_columns(target_column)
+    bundle = load_pretrained(df, target_column, test_size, n_estimators, exclude_columns=exclude)
+    if bundle is None and train:
+        bundle = train_or_load(df, target_column, test_size, n_estimators, exclude_columns=exclude)
+    if bundle is None:
+        raise LookupError(f"No stored model for {target_column}; train it first or pass --train")
+    return bundle
+
+
+def load_test(
+    url: str,
+    records: List[Dict[str, Any]],
+    requests: int = 2000,
+    concurrency: int = 32,
+    batch_size: int = 1
+) -> Dict[str, float]:
+    """Sends concurrent prediction requests over keep-alive connections and summarizes latency.
+
+    Args:
+        url: Service base URL
+        records: Feature records to cycle through
+        requests: Total requests
+        concurrency: Client threads, each with its own connection
+        batch_size: Records per request (1 uses /predict, more use /predict/batch)
+    """
+    target = urlparse(url)
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def worker(i: int) -> None:
+        nonlocal errors
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        if batch_size == 1:
+            path, payload = '/predict', {'features': records[i % len(records)]}
+        else:
+            chunk = [records[(i * batch_size + j) % len(records)] for j in range(batch_size)]
+            path, payload = '/predict/batch', {'records': chunk}
+        body = json.dumps(payload, default=str)
+        started = time.perf_counter()
+        try:
+            local.conn.request('POST', path, body, {'Content-Type': 'application/json'})
+            response = local.conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            del local.conn
+            ok = False
+        with lock:
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else float('nan')
+
+    return {
+        'requests': requests,
+        'succeeded': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'rows_per_s': len(latencies) * batch_size / elapsed if elapsed else 0.0,
+        'p50_ms': pct(0.50) * 1000,
+        'p99_ms': pct(0.99) * 1000,
+    }
+
+
+if __name__ == '__main__':
+    from app.utils.data_loader import load_dataset
+
+    parser = argparse.ArgumentParser(description="Serve a registered model over HTTP, or load-test the service.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="Run the prediction service")
+    serve_parser.add_argument('--key', help="Registry key of the model to serve")
+    serve_parser.add_argument('--target', help="Serve the stored model for this target at the given settings")
+    serve_parser.add_argument('--trees', type=int, default=100)
+    serve_parser.add_argument('--test-size', type=float, default=0.2)
+    serve_parser.add_argument('--train', action='store_true', help="Train the model if it is not stored")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--max-batch', type=int, default=None, help=f"Rows per model call (default: {MAX_BATCH_ENV} or {DEFAULT_MAX_BATCH})")
+    serve_parser.add_argument('--max-wait-ms', type=float, default=None, help=f"Batching window (default: {MAX_WAIT_ENV} or {DEFAULT_MAX_WAIT_MS})")
+
+    load_parser = commands.add_parser('load', help="Load-test a running service with rows from the dataset")
+    load_parser.add_argument('--url', default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    load_parser.add_argument('--requests', type=int, default=2000)
+    load_parser.add_argument('--concurrency', type=int, default=32)
+    load_parser.add_argument('--batch-size', type=int, default=1, help="Records per request")
+    args = parser.parse_args()
+
+    data = load_dataset()
+    if args.command == 'serve':
+        service = PredictionService(
+            load_bundle(data, args.key, args.target, args.test_size, args.trees, args.train),
+            max_batch_size=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+        )
+        server = serve(service, args.host, args.port)
+        print(f"Serving {service.bundle['target_column']} on http://{args.host}:{args.port}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        sample = data.head(1000).astype(object).where(data.head(1000).notna(), None).to_dict('records')
+        result = load_test(args.url, sample, args.requests, args.concurrency, args.batch_size)
+        for name, value in result.items():
+            print(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}")
@@ -1,8 +1,17 @@
 from fpdf import FPDF
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+import hashlib
+import json
 import os
+import threading
 from typing import Dict, List, Optional, Union
 
+from app.utils.instrumentation import timed
+
+CACHED_REPORTS = 32
+
 def create_prediction_content(prediction_data: Dict) -> str:
     """Generate formatted prediction content for the report.
     
@@ -34,21 +43,7 @@ def create_prediction_content(prediction_data: Dict) -> str:
     
     return "\n".join(content)
 
-def generate_pdf(
-    sections: List[Dict[str, str]], 
-    title: str = "Water Quality Report", 
-    output_path: Optional[str] = None
-) -> str:
-    """Generate a PDF report with the given sections.
-    
-    Args:
-        sections: List of dictionaries with 'title' and 'content' keys
-        title: Report title
-        output_path: Path to save the PDF (default: auto-generated filename)
-        
-    Returns:
-        Path to the generated PDF file
-    """
+def _build_pdf(sections: List[Dict[str, str]], title: str) -> FPDF:
     if not sections:
         raise ValueError("No sections provided for the report")
         
@@ -77,6 +72,44 @@ def generate_pdf(
         pdf.multi_cell(0, 10, str(section['content']))
         pdf.ln(8)
     
+    return pdf
+
+@timed('report.render_pdf')
+def render_pdf(sections: List[Dict[str, str]], title: str = "Water Quality Report") -> bytes:
+    """Render a PDF report with the given sections into memory.
+    
+    Args:
+        sections: List of dictionaries with 'title' and 'content' keys
+        title: Report title
+        
+    Returns:
+        PDF file contents
+    """
+    pdf = _build_pdf(sections, title)
+    try:
+        data = pdf.output(dest='S')
+    except Exception as e:
+        raise RuntimeError(f"Failed to generate PDF: {str(e)}")
+    # PyFPDF returns a latin-1 str, fpdf2 a bytearray.
+    return data.encode('latin-1') if isinstance(data, str) else bytes(data)
+
+def generate_pdf(
+    sections: List[Dict[str, str]], 
+    title: str = "Water Quality Report", 
+    output_path: Optional[str] = None
+) -> str:
+    """Generate a PDF report with the given sections.
+    
+    Args:
+        sections: List of dictionaries with 'title' and 'content' keys
+        title: Report title
+        output_path: Path to save the PDF (default: auto-generated filename)
+        
+    Returns:
+        Path to the generated PDF file
+    """
+    pdf = _build_pdf(sections, title)
+    
     if output_path is None:
         output_path = os.path.join(
             os.getcwd(),
@@ -115,26 +148,94 @@ def generate_prediction_report(
     if not prediction_data:
         raise ValueError("No prediction data provided")
     
-    sections = []
-    
     try:
-        prediction_content = create_prediction_content(prediction_data)
-        sections.append({
-            'title': 'Prediction Results',
-            'content': prediction_content
-        })
-        
-        if analysis_text and str(analysis_text).strip():
-            sections.append({
-                'title': 'Analysis',
-                'content': str(analysis_text).strip()
-            })
-        
         return generate_pdf(
-            sections, 
+            prediction_report_sections(prediction_data, analysis_text),
             title="Water Quality Prediction Report",
             output_path=output_path
         )
         
     except Exception as e:
         raise RuntimeError(f"Failed to generate prediction report: {str(e)}")
+
+def prediction_report_sections(prediction_data: Dict, analysis_text: str = "") -> List[Dict[str, str]]:
+    if not prediction_data:
+        raise ValueError("No prediction data provided")
+    
+    sections = [{
+        'title': 'Prediction Results',
+        'content': create_prediction_content(prediction_data)
+    }]
+    
+    if analysis_text and str(analysis_text).strip():
+        sections.append({
+            'title': 'Analysis',
+            'content': str(analysis_text).strip()
+        })
+    
+    return sections
+
+def render_prediction_report(prediction_data: Dict, analysis_text: str = "") -> bytes:
+    """Render a water quality prediction report to PDF bytes without touching disk.
+    
+    Raises:
+        ValueError: If prediction_data is missing required fields
+        RuntimeError: If PDF generation fails
+    """
+    if not prediction_data:
+        raise ValueError("No prediction data provided")
+    
+    try:
+        return render_pdf(
+            prediction_report_sections(prediction_data, analysis_text),
+            title="Water Quality Prediction Report"
+        )
+    except Exception as e:
+        raise RuntimeError(f"Failed to generate prediction report: {str(e)}")
+
+def report_key(prediction_data: Dict, analysis_text: str = "") -> str:
+    payload = json.dumps([prediction_data, analysis_text], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ReportRenderer:
+    """Renders prediction reports on a worker thread, caching the PDFs by content.
+    
+    Args:
+        max_workers: Reports rendered concurrently
+        max_cached: Rendered reports kept (least recently requested are dropped)
+    """
+    
+    def __init__(self, max_workers: int = 2, max_cached: int = CACHED_REPORTS):
+        self.max_cached = max_cached
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._reports: "OrderedDict[str, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def submit(self, prediction_data: Dict, analysis_text: str = "") -> str:
+        """Starts rendering a report unless the same one is cached; returns its key."""
+        key = report_key(prediction_data, analysis_text)
+        with self._lock:
+            future = self._reports.get(key)
+            if future is not None and not (future.done() and future.exception() is not None):
+                self._reports.move_to_end(key)
+                return key
+            self._reports[key] = self._executor.submit(render_prediction_report, prediction_data, analysis_text)
+            while len(self._reports) > self.max_cached:
+                self._reports.popitem(last=False)
+        return key
+    
+    def get(self, key: Optional[str]) -> Optional[Future]:
+        """Future of the PDF bytes for a submitted key, or None if unknown or evicted."""
+        with self._lock:
+            return self._reports.get(key) if key else None
+
+_renderer: Optional[ReportRenderer] = None
+_renderer_lock = threading.Lock()
+
+def get_report_renderer() -> ReportRenderer:
+    """Returns the process-wide report renderer."""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = ReportRenderer()
+        return _renderer
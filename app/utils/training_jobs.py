@@ -0,0 +1,287 @@
+"""
+Background model training.
+
+Training runs on a process-wide worker pool instead of the session's script
+thread. Sessions keep only a job id and poll the job for progress (trees
+built so far); a job can be cancelled between tree batches. Identical
+configurations submitted by several sessions share one job, which is only
+cancelled once every session that submitted it has released it.
+
+Pre-training submits a job for every numeric target at the UI's default
+settings (once, or on an interval), so switching targets finds a stored
+model. Groups of correlated targets are trained as one multi-output model
+unless each already has its own.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+
+import pandas as pd
+
+from app.utils.data_loader import dataset_version, load_dataset
+from app.utils.forest_engine import compile_forest, supports
+from app.utils.ml_models import TrainingCancelled, correlated_target_groups, leakage_columns
+from app.utils.model_registry import (
+    get_model_registry, load_pretrained, model_key, multi_output_exclusions, train_or_load, training_params
+)
+
+WORKERS_ENV = 'HYDRO_TRAIN_WORKERS'
+PRETRAIN_ENV = 'HYDRO_PRETRAIN'
+PRETRAIN_INTERVAL_ENV = 'HYDRO_PRETRAIN_INTERVAL'
+FINISHED_JOBS_KEPT = 50
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class TrainingJob:
+    """State of one background training run; read by any session holding its id."""
+
+    def __init__(
+        self,
+        target_column: Union[str, List[str]],
+        test_size: float,
+        n_estimators: int,
+        key: str,
+        exclude_columns: Optional[List[str]] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.target_column = target_column
+        self.test_size = test_size
+        self.n_estimators = n_estimators
+        self.exclude_columns = exclude_columns or []
+        self.status = QUEUED
+        self.trees_built = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        # Who submitted this configuration; see TrainingJobManager.release.
+        self.subscribers: Set[str] = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def progress(self) -> float:
+        if self.status == DONE:
+            return 1.0
+        return min(self.trees_built / self.n_estimators, 1.0) if self.n_estimators else 0.0
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+        if self.status == QUEUED:
+            self.status = CANCELLED
+            self.finished_at = time.time()
+
+    def _on_progress(self, built: int, total: int) -> None:
+        self.trees_built = built
+
+
+class TrainingJobManager:
+    """Runs training jobs on a thread pool.
+
+    scikit-learn releases the GIL while growing trees, so worker threads plus
+    the forest's own n_jobs keep all cores busy without copying the dataset
+    into other processes.
+
+    Args:
+        max_workers: Concurrent training jobs (default: HYDRO_TRAIN_WORKERS or 2)
+        n_jobs: Cores per job passed to the forest (default: HYDRO_TRAIN_JOBS or all)
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, n_jobs: Optional[int] = None):
+        self.n_jobs = n_jobs
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv(WORKERS_ENV, 2)),
+            thread_name_prefix='train'
+        )
+        self._jobs: Dict[str, TrainingJob] = {}
+        self._active_by_key: Dict[str, TrainingJob] = {}
+        self._lock = threading.Lock()
+        self._pretrain_thread: Optional[threading.Thread] = None
+
+    def submit(
+        self,
+        df: pd.DataFrame,
+        target_column: Union[str, List[str]],
+        test_size: float = 0.2,
+        n_estimators: int = 100,
+        exclude_columns: Optional[Iterable[str]] = None,
+        subscriber: Optional[str] = None
+    ) -> TrainingJob:
+        """Queues training for a configuration, or returns the job already running it.
+
+        Args:
+            subscriber: Id the caller later passes to release (e.g. a session
+                id); without one the submission can never be released, so
+                the job runs to completion
+        """
+        subscriber = subscriber or uuid.uuid4().hex
+        exclude_columns = sorted(exclude_columns or [])
+        key = model_key(
+            dataset_version(df), target_column,
+            training_params(test_size, n_estimators, exclude_columns=exclude_columns)
+        )
+        with self._lock:
+            active = self._active_by_key.get(key)
+            if active is not None and not active.finished and not active.cancel_event.is_set():
+                active.subscribers.add(subscriber)
+                return active
+            job = TrainingJob(target_column, test_size, n_estimators, key, exclude_columns)
+            job.subscribers.add(subscriber)
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+            self._trim()
+        self._executor.submit(self._run, job, df)
+        return job
+
+    def release(self, job_id: Optional[str], subscriber: str) -> bool:
+        """Drops a subscriber's interest in a job; the last one to leave cancels it.
+
+        Returns:
+            True if the job was cancelled, False if it keeps running for
+            other subscribers (or had already finished)
+        """
+        with self._lock:
+            job = self._jobs.get(job_id) if job_id else None
+            if job is None or job.finished:
+                return False
+            job.subscribers.discard(subscriber)
+            if job.subscribers:
+                return False
+            job.cancel()
+            return True
+
+    def _run(self, job: TrainingJob, df: pd.DataFrame) -> None:
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            job.finished_at = job.finished_at or time.time()
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = train_or_load(
+                df,
+                job.target_column,
+                test_size=job.test_size,
+                n_estimators=job.n_estimators,
+                registry=get_model_registry(),
+                n_jobs=self.n_jobs,
+                progress_callback=job._on_progress,
+                cancel_event=job.cancel_event,
+                exclude_columns=job.exclude_columns,
+            )
+            if supports(job.result['model']):
+                # Flatten for fast predictions here rather than on the first form submit.
+                compile_forest(job.result['model'], job.result['scaler'])
+            job.trees_built = job.n_estimators
+            job.status = DONE
+        except TrainingCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def pretrain(
+        self,
+        df: pd.DataFrame,
+        targets: Optional[Iterable[str]] = None,
+        test_size: float = 0.2,
+        n_estimators: int = 100,
+        multi_output: bool = True
+    ) -> List[TrainingJob]:
+        """Submits training for every numeric target not yet stored, at the UI's default settings.
+
+        Each target excludes its leakage columns, as the sidebar does by default.
+        With multi_output, a group of correlated targets none of which is
+        stored yet is trained as one multi-output forest instead of one forest
+        per target.
+        """
+        targets = list(targets if targets is not None else df.select_dtypes(include='number').columns)
+        groups = correlated_target_groups(df, targets) if multi_output else [[t] for t in targets]
+        jobs = []
+        for group in groups:
+            missing = [
+                t for t in group
+                if load_pretrained(df, t, test_size, n_estimators, exclude_columns=leakage_columns(t)) is None
+            ]
+            if len(group) > 1 and len(missing) == len(group):
+                jobs.append(self.submit(df, group, test_size, n_estimators, multi_output_exclusions(group)))
+                continue
+            for target in missing:
+                jobs.append(self.submit(df, target, test_size, n_estimators, leakage_columns(target)))
+        return jobs
+
+    def start_pretraining(self, interval: Optional[float] = None) -> bool:
+        """Pre-trains the current dataset in a background thread, repeating every interval seconds.
+
+        The dataset is reloaded each round, so a changed extract is picked up.
+        Returns False if pre-training is already running.
+        """
+        interval = interval if interval is not None else float(os.getenv(PRETRAIN_INTERVAL_ENV, 0))
+        with self._lock:
+            if self._pretrain_thread is not None and self._pretrain_thread.is_alive():
+                return False
+
+            def run() -> None:
+                while True:
+                    self.pretrain(load_dataset())
+                    if interval <= 0:
+                        return
+                    time.sleep(interval)
+
+            self._pretrain_thread = threading.Thread(target=run, name='pretrain', daemon=True)
+            self._pretrain_thread.start()
+            return True
+
+    def get(self, job_id: Optional[str]) -> Optional[TrainingJob]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def jobs(self) -> List[TrainingJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.submitted_at, reverse=True)
+
+    def _trim(self) -> None:
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.submitted_at)
+        for job in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job.id]
+            if self._active_by_key.get(job.key) is job:
+                del self._active_by_key[job.key]
+
+
+_manager: Optional[TrainingJobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_training_manager() -> TrainingJobManager:
+    """Returns the process-wide training job manager.
+
+    With HYDRO_PRETRAIN=1 the manager starts pre-training when it is created.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = TrainingJobManager()
+            if os.getenv(PRETRAIN_ENV, '0').lower() in ('1', 'true', 'yes'):
+                _manager.start_pretraining()
+        return _manager
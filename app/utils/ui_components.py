@@ -3,8 +3,12 @@ UI Components for the HydroAI Streamlit Application
 
 This module contains reusable UI components and theme settings for the HydroAI application.
 """
+import pandas as pd
 import streamlit as st
 
+from app.utils.instrumentation import timed
+
+@timed('ui.apply_theme')
 def apply_theme():
     """Applies the custom theme and styles to the Streamlit app."""
     st.markdown("""
@@ -256,6 +260,7 @@ def create_sidebar_header():
     </div>
     """, unsafe_allow_html=True)
 
+@timed('ui.metric_card')
 def metric_card(title: str, value: str, delta: str = None, icon: str = None, trend: str = None):
     """Creates a material design metric card component.
     
@@ -392,3 +397,38 @@ def info_card(title: str, content: str, icon: str = "info"):
         </div>
     </div>
     """, unsafe_allow_html=True)
+
+def perf_panel(trace, stats: dict, counters: dict):
+    """Sidebar debug panel with this rerun's timing spans and per-phase statistics.
+    
+    Args:
+        trace: The current instrumentation.RunTrace (may be None)
+        stats: Per-phase summaries from instrumentation.phase_stats()
+        counters: Process-wide counters from instrumentation.counters()
+    """
+    with st.sidebar.expander("⏱ Performance", expanded=False):
+        if trace is not None:
+            st.caption(f"This rerun so far: {trace.elapsed_ms:.1f} ms in {len(trace.spans)} spans")
+            if trace.spans:
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            'Phase': f"{'  ' * s.depth}{s.name}",
+                            'Start (ms)': round(s.start_ms, 1),
+                            'Duration (ms)': round(s.duration_ms, 2),
+                        }
+                        for s in sorted(trace.spans, key=lambda s: s.start_ms)
+                    ]),
+                    hide_index=True
+                )
+            if trace.counters:
+                st.caption(" · ".join(f"{name}: {value:g}" for name, value in sorted(trace.counters.items())))
+        if stats:
+            st.markdown("**All reruns and background work**")
+            st.dataframe(
+                pd.DataFrame.from_dict(stats, orient='index')
+                .sort_values('total_ms', ascending=False)
+                .round(2),
+            )
+        if counters:
+            st.caption(" · ".join(f"{name}: {value:g}" for name, value in sorted(counters.items())))
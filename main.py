@@ -1,27 +1,61 @@
 import streamlit as st
 import pandas as pd
-import google.generativeai as genai
-from dotenv import load_dotenv 
-import os
-import joblib
-import numpy as np
-import tempfile
+from dotenv import load_dotenv
+import uuid
 from datetime import datetime
+from app.utils.chat_query import build_query_context, plan_query, query_mode_enabled, run_query_spec
+from app.utils.column_profiles import get_column_profiles
+from app.utils.context_builder import build_dataset_context, build_district_context, record_prompt_metrics
+from app.utils.data_loader import dataset_version
+from app.utils.dataset_query import get_dataset_query
+from app.utils.district_index import get_district_index
+from app.utils.district_matcher import get_district_matcher
 from app.utils.helpers import get_data_summary
-from app.utils.ml_models import preprocess_data, load_model, train_model, predict, save_model
-from app.utils.report_generator import generate_prediction_report
+from app.utils.instrumentation import counters, finish_run, panel_enabled, phase_stats, span, start_run
+from app.utils.llm_client import LLMError, stream_text
+from app.utils.ml_models import leakage_columns, predict, predict_batch
+from app.utils.model_comparison import compare_models
+from app.utils.model_registry import get_model_registry, load_pretrained, load_registered
+from app.utils.training_jobs import CANCELLED, DONE, FAILED, get_training_manager
+from app.utils.report_generator import get_report_renderer
 from app.utils.ui_components import (
-    apply_theme, create_header, create_sidebar_header, 
-    metric_card, loading_spinner, info_card
+    apply_theme, create_header, create_sidebar_header,
+    metric_card, info_card, perf_panel
 )
 
+# The page is split into fragments (chat, training sidebar, prediction, batch
+# scoring, model comparison). A widget interaction reruns only the fragment
+# that owns the widget; the theme, header and dataset metric cards are drawn
+# on full app runs only. Fragments get the dataset as arguments and share
+# everything else through session state.
+
+run_trace = start_run('rerun')
+# Lets fragments tell a full app run from a rerun of just themselves (see rerun_app).
+st.session_state.full_run = True
+
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'ml_model' not in st.session_state:
+    st.session_state.ml_model = None
+if 'model_trained' not in st.session_state:
+    st.session_state.model_trained = False
+if 'session_token' not in st.session_state:
+    # Identifies this session to shared background jobs (see training_jobs.release).
+    st.session_state.session_token = uuid.uuid4().hex
 
 load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-df = pd.read_csv(f"F:\\study\\hydro ai\\data\\gujarat_groundwater_merged_final.csv")
+# Shared by every session; set HYDRO_DATA_PATH to point at another extract.
+# Large Parquet datasets stay on disk: df is then a bounded sample for the
+# widgets and training, and `full_data` answers counts and statistics over
+# every row (see app.utils.dataset_query).
+with span('load_dataset'):
+    query = get_dataset_query()
+    df = query.frame()
+full_data = query if query.sampled else None
+profiles = get_column_profiles(df)
+# Creating the manager starts background pre-training when HYDRO_PRETRAIN=1.
+get_training_manager()
 
 apply_theme()
 create_header()
@@ -34,145 +68,329 @@ info_card(
     "info"
 )
 
-tab1, tab2 = st.tabs(["💬 Chat Analysis", "📊 ML Predictions"])
+def rerun_app():
+    """Reruns the whole app after a fragment changed state other sections read.
 
-data_summary = get_data_summary(df)
+    During a full app run the sections drawn later already see the change,
+    so nothing is done.
+    """
+    if not st.session_state.get('full_run'):
+        st.rerun()
 
-with tab1:
+def dataset_metrics(df, profiles, full_data=None):
+    """Dataset metric cards; they only change with the dataset, so full runs draw them."""
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        metric_card("Total Samples", f"{len(df):,}", icon="dataset")
+        total = full_data.count() if full_data is not None else len(df)
+        metric_card("Total Samples", f"{total:,}", icon="dataset")
     with col2:
         metric_card("Features", f"{len(df.columns)}", icon="category")
     with col3:
-        numeric_cols = len(df.select_dtypes(include=['int64', 'float64']).columns)
+        numeric_cols = len(profiles.numeric_columns)
         metric_card("Numeric Features", str(numeric_cols), icon="calculate")
     with col4:
-        cat_cols = len(df.select_dtypes(include=['object', 'category']).columns)
+        cat_cols = len(profiles.columns) - len(profiles.numeric_columns)
         metric_card("Categorical Features", str(cat_cols), icon="list")
 
-    for message in st.session_state.chat_history:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-
-    prompt = st.chat_input("Ask about Gujarat groundwater (add a district to focus)...")
-
-if prompt:
-    st.session_state.chat_history.append({"role": "user", "content": prompt})
-
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-        with st.chat_message("assistant"):
-            with st.spinner("Processing..."):
-                model = genai.GenerativeModel("gemini-1.5-flash")
-                district_col = next((col for col in df.columns if 'district' in col.lower() or 'location' in col.lower()), None)
-                district_names = df[district_col].unique().astype(str).tolist() if district_col is not None else []
-                city = next((word for word in prompt.split() if word.lower() in [name.lower() for name in district_names]), None)
-                
-                if city and district_col:
-                    city_data = df[df[district_col].str.lower() == city.lower()].copy()
-                    city_summary = city_data.describe(include='all').to_string()
-                    sample_data = city_data.head(5).to_string()
-                    
-                    context_prompt = f"""
-                    You are a water quality expert analyzing groundwater data for {city}. 
-                    
-                    City Data Summary:
-                    - Total samples: {len(city_data):,}
-                    - Data columns: {', '.join(city_data.columns)}
-                    
-                    Sample Data (first 5 rows):
-                    {sample_data}
-                    
-                    Statistics:
-                    {city_summary}
-                    
-                    User Request: {prompt}
-                    
-                    Provide a clear, concise analysis focusing on key metrics. 
-                    Keep the response under 100 lines. Highlight any concerning water quality issues.
-                    """
-                else:
-                    context_prompt = f"""
-                    You are a water quality expert analyzing Gujarat groundwater data. Use ONLY the dataset text provided.
-                    
-                    Dataset Summary:
-                    {data_summary}
-                    
-                    User Request: {prompt}
-                    
-                    Provide a clear, quantitative answer with specific numbers when possible. 
-                    If a city is mentioned, focus on that city's data. 
-                    Keep the response under 250 lines.
-                    """
-                response = model.generate_content(context_prompt)
-                response_text = response.text
-                st.markdown(response_text)
-                st.session_state.chat_history.append({"role": "assistant", "content": response_text})
+@st.fragment
+def chat_section(df, query):
+    """Chat history and input; sending a message reruns only this section."""
+    full_data = query if query.sampled else None
+    with span('fragment.chat'):
+        for message in st.session_state.chat_history:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
 
-with tab2:
-    st.markdown("##  Water Quality Prediction")
-    st.markdown("Leverage machine learning to predict and analyze water quality parameters with high accuracy.")
-    
-    info_card(
-        "How to Use",
-        "Select a target variable and input features, then click 'Train Model' to create predictions. "
-        "The model will show performance metrics and allow you to make new predictions.",
-        "help_outline"
-    )
-    
-    if 'ml_model' not in st.session_state:
-        st.session_state.ml_model = None
-    if 'model_trained' not in st.session_state:
-        st.session_state.model_trained = False
-    
-    with st.sidebar:
+        prompt = st.chat_input("Ask about Gujarat groundwater (add a district to focus)...")
+
+        if prompt:
+            st.session_state.chat_history.append({"role": "user", "content": prompt})
+
+            with st.chat_message("user"):
+                st.markdown(prompt)
+
+                with st.chat_message("assistant"):
+                    with st.spinner("Processing..."), span('chat.context'):
+                        district_index = get_district_index(df, query=full_data)
+                        mentioned = get_district_matcher(df, query=full_data).find_all(prompt)
+                        districts = [district_index.get(match.name) for match in mentioned]
+
+                        spec, plan_size = None, None
+                        if not districts and query_mode_enabled():
+                            # Dataset-wide questions are first turned into a query that runs locally;
+                            # without a usable query the model gets the summarized dataset instead.
+                            spec, plan_size = plan_query(prompt, query, dataset_version(df))
+
+                        if districts:
+                            context = build_district_context(df, districts, prompt)
+                            context_prompt = "\n\n".join([
+                                f"You are a water quality expert analyzing groundwater data for {', '.join(district.name for district in districts)}.",
+                                context.text,
+                                f"User Request: {prompt}",
+                                "Provide a clear, concise analysis focusing on key metrics. "
+                                "Keep the response under 100 lines. Highlight any concerning water quality issues.",
+                            ])
+                            prompt_size = record_prompt_metrics('chat_district', context, context_prompt)
+                        elif spec is not None:
+                            result, total_rows = run_query_spec(spec, query)
+                            context = build_query_context(spec, result, total_rows)
+                            context_prompt = "\n\n".join([
+                                "You are a water quality expert. Answer from this result, computed from the "
+                                "Gujarat groundwater dataset, using ONLY its numbers.",
+                                context.text,
+                                f"User Request: {prompt}",
+                                "Keep the response under 100 lines.",
+                            ])
+                            prompt_size = record_prompt_metrics('chat_query', context, context_prompt)
+                        else:
+                            context = build_dataset_context(
+                                df, prompt, get_data_summary(df, full_data), district_index.district_col, query=full_data
+                            )
+                            context_prompt = "\n\n".join([
+                                "You are a water quality expert analyzing Gujarat groundwater data. Use ONLY the dataset text provided.",
+                                f"Dataset Summary:\n{context.text}",
+                                f"User Request: {prompt}",
+                                "Provide a clear, quantitative answer with specific numbers when possible. "
+                                "If a city is mentioned, focus on that city's data. "
+                                "Keep the response under 250 lines.",
+                            ])
+                            prompt_size = record_prompt_metrics('chat_dataset', context, context_prompt)
+                    response_stream = stream_text(context_prompt, dataset_version=dataset_version(df))
+                    try:
+                        st.write_stream(response_stream)
+                    except LLMError as e:
+                        st.error(f"The analysis service did not respond: {e}")
+                    else:
+                        response_text = response_stream.text
+                        # A query-planning call counts too, whether or not its spec was usable.
+                        prompt_tokens = prompt_size['prompt_tokens'] + (plan_size['prompt_tokens'] if plan_size else 0)
+                        st.caption(
+                            f"Prompt ~{prompt_tokens:,} tokens · "
+                            f"first token after {response_stream.time_to_first_token or 0:.2f}s, "
+                            f"complete after {response_stream.total_latency:.2f}s"
+                        )
+                        st.session_state.chat_history.append({"role": "assistant", "content": response_text})
+
+@st.fragment(run_every=1.0)
+def training_progress():
+    """Polls the session's background training job and picks up the model when it finishes."""
+    job = get_training_manager().get(st.session_state.get('training_job_id'))
+    if job is None:
+        st.session_state.training_job_id = None
+        return
+    if job.status == DONE:
+        st.session_state.ml_model = job.result
+        st.session_state.model_trained = True
+        st.session_state.training_job_id = None
+        st.rerun()
+    elif job.status == FAILED:
+        st.session_state.training_job_id = None
+        st.error(f"Training failed: {job.error}")
+    elif job.status == CANCELLED:
+        st.session_state.training_job_id = None
+        st.info(f"Training cancelled after {job.trees_built} trees.")
+    else:
+        st.progress(
+            job.progress,
+            text=f"Training {job.target_column}: {job.trees_built}/{job.n_estimators} trees ({job.elapsed:.0f}s)"
+        )
+        if st.button("Cancel Training"):
+            # Other sessions may be waiting on the same job; it only stops once none is.
+            if get_training_manager().release(job.id, st.session_state.session_token):
+                st.toast(f"Training cancelled after {job.trees_built} trees.")
+            else:
+                st.toast("Training stopped for this session; other sessions are still using it.")
+            st.session_state.training_job_id = None
+            st.rerun()
+
+def report_download():
+    """Download button for the session's PDF report, once its background render has finished."""
+    if st.session_state.get('report_error'):
+        st.error(f"Could not generate the PDF report: {st.session_state.report_error}")
+    elif st.session_state.get('report_pdf') is not None:
+        st.download_button(
+            label="📥 Download Full Report (PDF)",
+            data=st.session_state.report_pdf,
+            file_name=st.session_state.report_file_name,
+            mime='application/pdf',
+            on_click='ignore'
+        )
+    elif st.session_state.get('report_key'):
+        report_progress()
+
+@st.fragment(run_every=0.5)
+def report_progress():
+    """Polls the background render; once it finishes, the result moves to session state and polling stops."""
+    future = get_report_renderer().get(st.session_state.get('report_key'))
+    if future is not None and not future.done():
+        st.caption("Generating PDF report...")
+        return
+    if future is None:
+        st.session_state.report_error = "the report is no longer available; make the prediction again"
+    else:
+        try:
+            st.session_state.report_pdf = future.result()
+        except Exception as e:
+            st.session_state.report_error = str(e)
+    st.session_state.report_key = None
+    st.rerun()
+
+@st.fragment
+def training_sidebar(df, profiles):
+    """Target, model settings, training and saved models.
+
+    The settings are kept in session state (target_column, test_size,
+    n_estimators, exclude_columns) for the other sections; a new target or
+    model reruns the app so they pick it up.
+    """
+    with span('fragment.training'):
         st.markdown("###  Target Variable")
         target_column = st.selectbox(
             "Select target variable to predict:",
-            [col for col in df.select_dtypes(include=['float64', 'int64']).columns],
+            profiles.numeric_columns,
+            key='target_column',
             help="Choose the water quality parameter you want to predict."
         )
-        
+
         st.markdown("---")
         st.markdown("###  Model Settings")
-        
+
         test_size = st.slider(
             "Test Set Size (%)",
             min_value=10,
             max_value=50,
             value=20,
             step=5,
+            key='test_size',
             help="Percentage of data to use for testing the model"
         )
-        
+
         n_estimators = st.slider(
             "Number of Trees",
             min_value=10,
             max_value=200,
             value=100,
             step=10,
+            key='n_estimators',
             help="Number of trees in the random forest"
         )
-        
+
+        exclude_columns = st.multiselect(
+            "Exclude columns",
+            [col for col in df.columns if col != target_column],
+            default=leakage_columns(target_column),
+            key=f"exclude_columns_{target_column}",
+            help="Columns left out of the features, e.g. status columns derived from the target"
+        )
+        st.session_state.exclude_columns = exclude_columns
+
+        # Switching targets picks up a pre-trained (or earlier) model without clicking Train.
+        if st.session_state.get('selected_target') != target_column:
+            st.session_state.selected_target = target_column
+            pretrained = load_pretrained(
+                df, target_column, test_size=test_size/100, n_estimators=n_estimators,
+                exclude_columns=exclude_columns
+            )
+            if pretrained is not None:
+                st.session_state.ml_model = pretrained
+                st.session_state.model_trained = True
+            rerun_app()
+
         if st.button("Train Model"):
-            with st.spinner("Training model... This may take a few minutes."):
-                X, y, label_encoders, feature_columns = preprocess_data(df, target_column)
-                model, scaler, metrics = train_model(X, y, label_encoders, test_size=test_size/100, n_estimators=n_estimators)
-                st.session_state.ml_model = {
-                    'model': model,
-                    'scaler': scaler,
-                    'label_encoders': label_encoders,
-                    'feature_columns': feature_columns,
-                    'target_column': target_column,
-                    'metrics': metrics
-                }
+            stored_model = load_registered(
+                df, target_column, test_size=test_size/100, n_estimators=n_estimators,
+                exclude_columns=exclude_columns
+            )
+            if stored_model is not None:
+                st.session_state.ml_model = stored_model
                 st.session_state.model_trained = True
                 st.rerun()
-    
-    if st.session_state.model_trained and st.session_state.ml_model:
+            manager = get_training_manager()
+            job = manager.submit(
+                df, target_column, test_size=test_size/100, n_estimators=n_estimators,
+                exclude_columns=exclude_columns, subscriber=st.session_state.session_token
+            )
+            if st.session_state.get('training_job_id') not in (None, job.id):
+                manager.release(st.session_state.training_job_id, st.session_state.session_token)
+            st.session_state.training_job_id = job.id
+
+        if st.session_state.get('training_job_id'):
+            training_progress()
+
+        if st.button("Pre-train All Targets", help="Train every numeric target in the background at the default settings"):
+            pretrain_jobs = get_training_manager().pretrain(df)
+            st.caption(f"Queued {len(pretrain_jobs)} training jobs." if pretrain_jobs else "Every target is already trained.")
+
+        # Models from before the latest append stay loadable, marked stale.
+        registry = get_model_registry()
+        saved_models = [
+            m for m in registry.list_models(dataset_version(df)) + registry.stale_models(dataset_version(df))
+            if isinstance(m['target_column'], str)
+        ]
+        if saved_models:
+            st.markdown("---")
+            st.markdown("###  Saved Models")
+            saved_labels = {
+                f"{m['target_column']} · {m['params']['n_estimators']} trees · "
+                f"{int(m['params']['test_size'] * 100)}% test · R² {m['metrics'].get('r2', float('nan')):.3f}"
+                f"{' · stale' if m.get('superseded_by') else ''}": m
+                for m in saved_models
+            }
+            selected_model = st.selectbox(
+                "Previously trained models:",
+                list(saved_labels),
+                help="Models trained earlier on this dataset, by any session. "
+                     "Stale models were trained before new samples were appended."
+            )
+            if st.button("Load Model"):
+                meta = saved_labels[selected_model]
+                bundle = registry.get(meta['key'])
+                if bundle is not None:
+                    st.session_state.ml_model = {
+                        **bundle, 'key': meta['key'], 'cached': True, 'stale': bool(meta.get('superseded_by'))
+                    }
+                    st.session_state.model_trained = True
+                    st.rerun()
+                st.warning("That model is no longer available.")
+
+def prediction_details(target_column, prediction, target_stats, percentile):
+    """Prediction summary; drawn when the form is submitted and again on later runs of the section."""
+    st.write(f"### Prediction Details")
+    st.write(f"- **Predicted Value**: {prediction:.4f}")
+    st.write(f"- **Dataset Statistics for {target_column}:**")
+    st.write(f"  - Minimum: {target_stats['min']:.4f}")
+    st.write(f"  - 25th Percentile: {target_stats['25%']:.4f}")
+    st.write(f"  - Median: {target_stats['50%']:.4f}")
+    st.write(f"  - 75th Percentile: {target_stats['75%']:.4f}")
+    st.write(f"  - Maximum: {target_stats['max']:.4f}")
+    st.write(f"- **Percentile Rank**: Your prediction is higher than {percentile:.1f}% of values in the dataset.")
+
+    if percentile < 25:
+        st.info("This is a relatively low prediction compared to the dataset.")
+    elif percentile > 75:
+        st.warning("This is a relatively high prediction compared to the dataset.")
+    else:
+        st.info("This prediction is within the typical range of values in the dataset.")
+
+@st.fragment
+def prediction_section(df, profiles):
+    """Model metrics and the prediction form; submitting reruns only this section."""
+    with span('fragment.prediction'):
         metrics = st.session_state.ml_model['metrics']
+        if st.session_state.ml_model.get('shared_targets'):
+            st.caption(
+                f"Pre-trained multi-output model shared by {', '.join(st.session_state.ml_model['shared_targets'])}; "
+                "its features leave out those targets. Click Train Model for a dedicated model."
+            )
+        elif st.session_state.ml_model.get('stale'):
+            st.caption("Trained before new samples were appended to the dataset; click Train Model to include them.")
+        elif st.session_state.ml_model.get('cached'):
+            st.caption("Loaded from the model registry; no training was needed.")
+        elif st.session_state.ml_model.get('resized_from'):
+            st.caption(
+                f"Reused a stored {st.session_state.ml_model['resized_from']}-tree forest; "
+                f"only the difference to {len(st.session_state.ml_model['model'].estimators_)} trees was changed."
+            )
         col1, col2, col3 = st.columns(3)
         with col1:
             metric_card("R² Score", f"{metrics['r2']:.3f}", trend='up' if metrics['r2'] > 0.7 else 'down')
@@ -184,123 +402,198 @@ with tab2:
             # Use a more appropriate threshold for MSE trend (lower is better)
             mse_trend = 'down' if metrics['mse'] < 100 else 'up'
             metric_card("MSE", mse_formatted, trend=mse_trend)
-        
+
         st.markdown("### Feature Importance")
         feature_importance = pd.DataFrame({
             'Feature': st.session_state.ml_model['feature_columns'],
             'Importance': st.session_state.ml_model['model'].feature_importances_
         }).sort_values('Importance', ascending=False)
         st.bar_chart(feature_importance.set_index('Feature')['Importance'])
-        
+
         st.markdown("### Make a Prediction")
         with st.form("prediction_form"):
             input_data = {}
             for feature in st.session_state.ml_model['feature_columns']:
-                if feature in df.select_dtypes(include=['float64', 'int64']).columns:
+                profile = profiles[feature]
+                if profile.numeric:
                     input_data[feature] = st.number_input(
                         f"{feature}:",
-                        min_value=float(df[feature].min()),
-                        max_value=float(df[feature].max()),
-                        value=float(df[feature].median())
+                        min_value=profile.minimum,
+                        max_value=profile.maximum,
+                        value=profile.median
                     )
                 else:
                     input_data[feature] = st.selectbox(
                         f"{feature}:",
-                        options=df[feature].unique()
+                        options=profile.categories
                     )
-            
+
             submit_button = st.form_submit_button("Make Prediction")
-            
-            if submit_button:
-                # Make prediction
-                prediction = predict(
-                    input_data,
+
+        if submit_button:
+            # Make prediction
+            prediction = predict(
+                input_data,
+                st.session_state.ml_model['model'],
+                st.session_state.ml_model['scaler'],
+                st.session_state.ml_model['vocabulary'],
+                st.session_state.ml_model['feature_columns']
+            )
+
+            target_profile = profiles[st.session_state.ml_model['target_column']]
+            target_stats = target_profile.stats()
+            percentile = target_profile.percentile_rank(prediction)
+
+            prediction_details(st.session_state.ml_model['target_column'], prediction, target_stats, percentile)
+
+            analysis_prompt = f"""
+            You are a water quality expert. Analyze the following prediction results and provide a professional assessment:
+
+            Parameter: {st.session_state.ml_model['target_column']}
+            Predicted Value: {prediction:.4f}
+
+            Dataset Statistics:
+            - Minimum: {target_stats['min']:.4f}
+            - 25th Percentile: {target_stats['25%']:.4f}
+            - Median: {target_stats['50%']:.4f}
+            - 75th Percentile: {target_stats['75%']:.4f}
+            - Maximum: {target_stats['max']:.4f}
+            - Percentile Rank: {percentile:.1f}%
+
+            Feature Values:
+            """
+
+            for feature, value in input_data.items():
+                analysis_prompt += f"- {feature}: {value}\n"
+
+            analysis_prompt += "\nProvide a detailed analysis of this prediction, including potential implications and recommendations."
+
+            st.subheader("Professional Analysis")
+            analysis_stream = stream_text(analysis_prompt, dataset_version=dataset_version(df))
+            try:
+                st.write_stream(analysis_stream)
+                st.caption(
+                    f"First token after {analysis_stream.time_to_first_token or 0:.2f}s, "
+                    f"complete after {analysis_stream.total_latency:.2f}s"
+                )
+            except LLMError as e:
+                st.error(f"The analysis service did not respond: {e}")
+                # No report without its analysis, and no earlier prediction's report for this one either.
+                st.session_state.last_prediction = None
+                st.session_state.report_key = None
+            else:
+                analysis_text = analysis_stream.text
+
+                prediction_data = {
+                    'target_column': st.session_state.ml_model['target_column'],
+                    'prediction': prediction,
+                    'stats': target_stats,
+                    'percentile': percentile,
+                    'features': input_data
+                }
+                st.session_state.last_prediction = {
+                    **prediction_data, 'analysis': analysis_text, 'model_id': id(st.session_state.ml_model['model'])
+                }
+                with span('report.submit'):
+                    st.session_state.report_key = get_report_renderer().submit(prediction_data, analysis_text)
+                # Named once per report, so every run offers the same file.
+                st.session_state.report_file_name = f"water_quality_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+                st.session_state.report_pdf = None
+                st.session_state.report_error = None
+                report_download()
+        elif (st.session_state.get('last_prediction') or {}).get('model_id') == id(st.session_state.ml_model['model']):
+            last = st.session_state.last_prediction
+            prediction_details(last['target_column'], last['prediction'], last['stats'], last['percentile'])
+            st.subheader("Professional Analysis")
+            st.markdown(last['analysis'])
+            report_download()
+
+@st.fragment
+def batch_scoring():
+    """CSV upload scored with the session's model; reruns only this section."""
+    with span('fragment.batch_scoring'):
+        st.markdown("### Batch Scoring")
+        st.markdown("Upload a CSV of wells with the feature columns above to score them all at once.")
+        uploaded_file = st.file_uploader("Wells to score (CSV)", type=['csv'])
+        if uploaded_file is not None:
+            with span('batch.read_csv'):
+                wells = pd.read_csv(uploaded_file)
+            missing_features = [col for col in st.session_state.ml_model['feature_columns'] if col not in wells.columns]
+            if missing_features:
+                st.warning(f"Missing columns scored as 0: {', '.join(missing_features)}")
+            with st.spinner(f"Scoring {len(wells):,} wells..."):
+                predicted_column = f"predicted_{st.session_state.ml_model['target_column']}"
+                scored = wells.assign(**{predicted_column: predict_batch(
+                    wells,
                     st.session_state.ml_model['model'],
                     st.session_state.ml_model['scaler'],
-                    st.session_state.ml_model['label_encoders']
+                    st.session_state.ml_model['vocabulary'],
+                    st.session_state.ml_model['feature_columns']
+                )})
+            st.dataframe(scored.head(100))
+            st.download_button(
+                label="📥 Download Scored Wells (CSV)",
+                data=scored.to_csv(index=False).encode('utf-8'),
+                file_name=f"scored_wells_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime='text/csv'
+            )
+
+@st.fragment
+def model_comparison(df):
+    """Cross-validated leaderboard for the sidebar's target and settings."""
+    with span('fragment.comparison'):
+        target_column = st.session_state.target_column
+        st.markdown("### Model Comparison")
+        st.markdown(
+            f"Cross-validate several model families on **{target_column}** with the sidebar settings "
+            "to compare accuracy against training time, prediction latency and model size."
+        )
+        comparison_folds = st.slider("Folds", min_value=3, max_value=10, value=5)
+        if st.button("Run Comparison"):
+            with st.spinner("Cross-validating model families..."):
+                st.session_state.leaderboard = compare_models(
+                    df, target_column, exclude_columns=st.session_state.exclude_columns,
+                    n_splits=comparison_folds, n_estimators=st.session_state.n_estimators
                 )
-                
-                target_values = df[st.session_state.ml_model['target_column']].dropna()
-                percentile = (target_values < prediction).mean() * 100
-                
-                st.write(f"### Prediction Details")
-                st.write(f"- **Predicted Value**: {prediction[0]:.4f}")
-                st.write(f"- **Dataset Statistics for {st.session_state.ml_model['target_column']}:**")
-                st.write(f"  - Minimum: {target_values.min():.4f}")
-                st.write(f"  - 25th Percentile: {target_values.quantile(0.25):.4f}")
-                st.write(f"  - Median: {target_values.median():.4f}")
-                st.write(f"  - 75th Percentile: {target_values.quantile(0.75):.4f}")
-                st.write(f"  - Maximum: {target_values.max():.4f}")
-                st.write(f"- **Percentile Rank**: Your prediction is higher than {percentile:.1f}% of values in the dataset.")
-                
-                if percentile < 25:
-                    st.info("This is a relatively low prediction compared to the dataset.")
-                elif percentile > 75:
-                    st.warning("This is a relatively high prediction compared to the dataset.")
-                else:
-                    st.info("This prediction is within the typical range of values in the dataset.")
-                
-                analysis_prompt = f"""
-                You are a water quality expert. Analyze the following prediction results and provide a professional assessment:
-                
-                Parameter: {st.session_state.ml_model['target_column']}
-                Predicted Value: {prediction[0]:.4f}
-                
-                Dataset Statistics:
-                - Minimum: {target_values.min():.4f}
-                - 25th Percentile: {target_values.quantile(0.25):.4f}
-                - Median: {target_values.median():.4f}
-                - 75th Percentile: {target_values.quantile(0.75):.4f}
-                - Maximum: {target_values.max():.4f}
-                - Percentile Rank: {percentile:.1f}%
-                
-                Feature Values:
-                """
-                
-                for feature, value in input_data.items():
-                    analysis_prompt += f"- {feature}: {value}\n"
-                    
-                analysis_prompt += "\nProvide a detailed analysis of this prediction, including potential implications and recommendations."
-            
-            with st.spinner("Generating professional analysis..."):
-                model = genai.GenerativeModel("gemini-1.5-flash")
-                analysis_response = model.generate_content(analysis_prompt)
-                analysis_text = analysis_response.text
-                
-                st.subheader("Professional Analysis")
-                st.write(analysis_text)
-                
-                with st.spinner("Generating PDF report..."):
-                    prediction_data = {
-                        'target_column': st.session_state.ml_model['target_column'],
-                        'prediction': prediction,
-                        'stats': {
-                            'min': target_values.min(),
-                            '25%': target_values.quantile(0.25),
-                            '50%': target_values.median(),
-                            '75%': target_values.quantile(0.75),
-                            'max': target_values.max(),
-                        },
-                        'percentile': percentile,
-                        'features': input_data
-                    }
-                    
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                        report_path = generate_prediction_report(
-                            prediction_data=prediction_data,
-                            analysis_text=analysis_text,
-                            output_path=tmp_file.name
-                        )
-                    
-                    with open(report_path, 'rb') as f:
-                        st.download_button(
-                            label="📥 Download Full Report (PDF)",
-                            data=f,
-                            file_name=f"water_quality_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                            mime='application/pdf'
-                        )
-                    
-                    try:
-                        os.unlink(report_path)
-                    except:
-                        pass
+                st.session_state.leaderboard_target = target_column
+        if st.session_state.get('leaderboard') is not None:
+            st.caption(f"Leaderboard for {st.session_state.leaderboard_target}, best mean R² first.")
+            st.dataframe(
+                st.session_state.leaderboard.rename(columns={
+                    'r2': 'R²', 'r2_std': 'R² std', 'mae': 'MAE', 'rmse': 'RMSE', 'fit_s': 'Fit (s)',
+                    'predict_us_per_row': 'Batch predict (µs/row)', 'single_row_ms': 'Single row (ms)',
+                    'size_mb': 'Size (MB)'
+                }).style.format(precision=3)
+            )
+
+tab1, tab2 = st.tabs(["💬 Chat Analysis", "📊 ML Predictions"])
+
+with tab1:
+    dataset_metrics(df, profiles, full_data)
+    chat_section(df, query)
+
+with tab2:
+    st.markdown("##  Water Quality Prediction")
+    st.markdown("Leverage machine learning to predict and analyze water quality parameters with high accuracy.")
+
+    info_card(
+        "How to Use",
+        "Select a target variable and input features, then click 'Train Model' to create predictions. "
+        "The model will show performance metrics and allow you to make new predictions.",
+        "help_outline"
+    )
+
+    with st.sidebar:
+        training_sidebar(df, profiles)
+
+    if st.session_state.model_trained and st.session_state.ml_model:
+        prediction_section(df, profiles)
+        batch_scoring()
+
+    st.markdown("---")
+    model_comparison(df)
+
+if panel_enabled(st.query_params):
+    perf_panel(run_trace, phase_stats(), counters())
+st.session_state.full_run = False
+finish_run(run_trace)
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from app.utils import chat_query
+from app.utils.dataset_query import PandasQuery
+
+QUESTION = "Which district has the highest TDS?"
+
+
+@pytest.fixture
+def query():
+    df = pd.DataFrame({
+        'District': ['Surat', 'Surat', 'Kutch', 'Kutch'],
+        'TDS_mg_L': [400.0, 600.0, 1500.0, 1700.0],
+        'PH': [7.1, 7.4, 8.0, 8.2],
+    })
+    return PandasQuery(df)
+
+
+def plan_with_reply(monkeypatch, query, reply):
+    monkeypatch.setattr(chat_query, 'generate_text', lambda prompt, dataset_version="": reply)
+    return chat_query.plan_query(QUESTION, query)
+
+
+@pytest.mark.parametrize('reply', [
+    'not json',
+    '[1]',
+    '{"filters": [null]}',
+    '{"filters": [5]}',
+    '{"filters": 5}',
+    '{"filters": [["PH", ">"]]}',
+    '{"filters": [["Depth", ">", 3]]}',
+    '{"filters": [["District", "==", "Atlantis"]]}',
+    '{"filters": [["District", ">", "Surat"]]}',
+    '{"group_by": ["District"]}',
+    '{"group_by": "PH"}',
+    '{"metrics": 5}',
+    '{"metrics": [null]}',
+    '{"metrics": [["District", "mean"]]}',
+    '{"metrics": [["PH", "mode"]]}',
+    '{"limit": Infinity}',
+    '{"limit": 1e400}',
+    '{"limit": NaN}',
+    '{"limit": "many"}',
+    '{"descending": "yes"}',
+    '{"order_by": "PH"}',
+])
+def test_plan_query_falls_back_on_malformed_specs(monkeypatch, query, reply):
+    spec, plan_size = plan_with_reply(monkeypatch, query, reply)
+    assert spec is None
+    assert plan_size['kind'] == 'chat_query_plan'
+
+
+def test_plan_query_returns_valid_spec(monkeypatch, query):
+    reply = (
+        '{"filters": [["District", "in", ["surat", "KUTCH"]]], "group_by": "District",'
+        ' "metrics": [["TDS_mg_L", "mean"]], "order_by": "TDS_mg_L_mean", "descending": "true", "limit": 1}'
+    )
+    spec, _ = plan_with_reply(monkeypatch, query, reply)
+    assert spec.filters == [('District', 'in', ['Surat', 'Kutch'])]
+    result, total_rows = chat_query.run_query_spec(spec, query)
+    assert total_rows == 2
+    assert list(result.index) == ['Kutch']
+    assert result['TDS_mg_L_mean'].iloc[0] == pytest.approx(1600.0)
+
+
+def test_plan_query_skips_questions_without_columns(monkeypatch, query):
+    monkeypatch.setattr(chat_query, 'generate_text', lambda prompt, dataset_version="": pytest.fail("called"))
+    assert chat_query.plan_query("Tell me something interesting", query) == (None, None)